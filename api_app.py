@@ -1,24 +1,42 @@
-import os, io, base64, math, csv, datetime
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import os, re, datetime
 from fastapi import FastAPI, HTTPException, Request, Depends, Body
-from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from typing import Literal
 from pydantic import BaseModel
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 
-# 日本語フォント（無くてもエラーにしない）
-matplotlib.rcParams['font.family'] = ['Noto Sans CJK JP','Noto Sans JP','Hiragino Sans','MS Gothic','sans-serif']
-
 from rules import (
     score_text, label_total, fetch_text_from_url,
-    MAX_PER_CATEGORY, DISPLAY_NAME_MAP
+    DISPLAY_NAME_MAP, RULESET_BASE
+)
+from ruleset import prefilter_stats, warm_rulesets, all_rules
+from ruleprof import report as rule_report, SORT_KEYS as RULE_SORT_KEYS
+from batch import (
+    score_many, fetch_bodies, score_async, stream_ndjson, start_pool, shutdown_pool, set_pool_workers,
+    PoolUnavailable, SERVER_BATCH_WORKERS, STREAM_MAX_ITEMS,
+)
+from cache import (
+    RESULT_CACHE, result_key, cached_fetch, cached_fetch_async, cached_result, cached_result_async,
+    all_stats as cache_stats,
 )
+from singleflight import all_stats as flight_stats
+from chart import (
+    radar_png64, radar_svg, radar_data, chart_format, chart_url, chart_image, chart_etag, parse_fingerprint, IMAGE_TYPES,
+)
+from chartpool import CHART_POOL, ChartUnavailable
+from fetcher import fetch_text_async, aclose as close_fetcher
+from fetch_cache import FETCH_CACHE
+from hostsched import HOST_SCHEDULER, fetch_failure_detail
+from usagelog import USAGE_LOG, log_enabled
+from usagerollup import ROLLUP, DIMENSIONS as ROLLUP_DIMENSIONS
+from reqprof import REQUEST_PROFILER, active as profiling, profiled_response
+from mpmetrics import REQUESTS, endpoint as metrics_endpoint, stage, json_response, render as render_metrics, total as metrics_total
 
 # ---- App / RateLimit ----
 limiter = Limiter(key_func=get_remote_address, default_limits=['30/minute','200/hour'])
@@ -29,10 +47,41 @@ app.add_exception_handler(RateLimitExceeded, lambda request, exc: HTTPException(
 app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
 app.add_middleware(SlowAPIMiddleware)
 
-# ---- Optional simple counters (used by /metrics if実装済み) ----
-REQUESTS_TOTAL = 0
-REQUESTS_OK = 0
-REQUESTS_ERROR = 0
+# 起動時の準備（YABASA_WARMUP=0 なら省き、最初に使うときに作る。--reload で開発するとき向け）
+WARMUP = os.environ.get('YABASA_WARMUP', '1') != '0'
+
+# 採点プールはサーバ向けの大きさにする（既定は最大 2。ライブラリとして score_many を呼ぶときは CPU コア数。batch.py）
+set_pool_workers(SERVER_BATCH_WORKERS)
+
+# 利用ログを書くたびに /admin/data 用の集計（usagerollup.py）も足す
+USAGE_LOG.add_listener(ROLLUP.add_rows)
+
+@app.on_event('startup')
+async def _startup():
+    if log_enabled():
+        # 集計が未作成なら既存の CSV から作る（ログを書き始める前に）
+        await run_in_threadpool(ROLLUP.open)
+    if not WARMUP:
+        return
+    # ルールセットの照合器をまとめて作る（最初のリクエストで組み立てを待たせない）
+    took = await run_in_threadpool(warm_rulesets)
+    print(f"[STARTUP] ルールセットを準備しました（{len(took)} 種, {sum(took.values()):.0f} ms）")
+    # 採点ワーカー・チャート描画ワーカーを先に起動しておく
+    # （採点ワーカーは起動時に照合器を作る。描画ワーカーは matplotlib の読み込みに数秒かかるため）
+    start_pool()
+    CHART_POOL.start()
+
+@app.on_event('shutdown')
+async def _shutdown():
+    # 共有HTTPクライアントの keep-alive 接続と採点プール・描画プールを片付け、利用ログを書き切る
+    await close_fetcher()
+    shutdown_pool()
+    CHART_POOL.shutdown()
+    await run_in_threadpool(USAGE_LOG.close)
+
+# ---- リクエスト数（mpmetrics.py。uvicorn --workers N でも全ワーカーの合計を /metrics で返す） ----
+def _count(endpoint: str, ok: bool):
+    REQUESTS.inc(endpoint=endpoint, outcome='ok' if ok else 'error')
 
 # （もし /metrics /healthz をトークン保護している運用なら以下ガードを維持）
 def _require_token(request: Request, env_var: str):
@@ -64,28 +113,18 @@ def root_page():
 if os.path.isdir('static'):
     app.mount('/ui', StaticFiles(directory='static', html=True), name='static_ui')
 
+ChartFormat = Literal['url', 'png', 'svg', 'data', 'none']
+
 class AnalyzeIn(BaseModel):
     url: str | None = None
     text: str | None = None
     sector: str | None = None
     mode: str | None = None  # standard|strict|lenient
+    chart: ChartFormat | None = None  # url(既定)|png|svg|data|none
 
 def _radar_png64(scores: dict, measured_flags: dict) -> str:
-    cats = list(scores.keys())
-    if not cats:
-        return ""
-    labels = [(DISPLAY_NAME_MAP.get(c, c) + (' (測定不能)' if not measured_flags.get(c, True) else '')) for c in cats]
-    vals = [scores[c] for c in cats]
-    N = len(cats)
-    ang = [n/float(N)*2*math.pi for n in range(N)]
-    vals += vals[:1]; ang += ang[:1]
-    fig, ax = plt.subplots(figsize=(6,6), subplot_kw=dict(polar=True))
-    ax.plot(ang, vals, linewidth=2); ax.fill(ang, vals, alpha=.25)
-    ax.set_xticks(ang[:-1]); ax.set_xticklabels(labels, fontsize=10)
-    ax.set_yticks(range(0, MAX_PER_CATEGORY+1)); ax.set_yticklabels([str(i) for i in range(0, MAX_PER_CATEGORY+1)])
-    ax.grid(True)
-    buf = io.BytesIO(); fig.savefig(buf, format='png', dpi=160, bbox_inches='tight'); plt.close(fig); buf.seek(0)
-    return base64.b64encode(buf.read()).decode('ascii')
+    # 描画・メモ化は chart.py（同じスコアの形ならキャッシュ、無ければ描画プロセスで描く。混雑時は ''）
+    return radar_png64(scores, measured_flags)
 
 def _scale_legend():
     return {
@@ -156,20 +195,14 @@ def _concerns_for_seekers(cat_hits: dict, cat_scores: dict) -> list[dict]:
     return out[:12]
 
 def _log_usage(request: Request, source: str, total: int, label: str, mode: str, sector: str | None):
+    # キューに積むだけ（ファイルへは usagelog.py の書き込みスレッドがまとめて書く）
     try:
-        if os.environ.get("ENABLE_LOG", "1") != "1":
+        if not log_enabled():
             return
-        os.makedirs("logs", exist_ok=True)
-        path = os.path.join("logs", "usage.csv")
-        is_new = not os.path.exists(path)
-        with open(path, "a", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            if is_new:
-                w.writerow(["ts_iso","ip","source","total","label","mode","sector","ua"])
-            ua = request.headers.get("user-agent","-")
-            ts = datetime.datetime.utcnow().isoformat()
-            ip = request.client.host if request.client else "-"
-            w.writerow([ts, ip, source, total, label, mode, sector or "", ua])
+        ua = request.headers.get("user-agent","-")
+        ts = datetime.datetime.utcnow().isoformat()
+        ip = request.client.host if request.client else "-"
+        USAGE_LOG.log([ts, ip, source, total, label, mode, sector or "", ua])
     except Exception:
         pass
 
@@ -180,119 +213,429 @@ def healthz(request: Request):
 
 @app.get('/metrics', response_class=PlainTextResponse, dependencies=[Depends(guard_metrics)])
 def metrics(request: Request):
+    # /analyze・/analyze/batch・/analyze/stream の合計（従来の3行。全ワーカー分）
+    ok, error = metrics_total('yabasa_http_requests', outcome='ok'), metrics_total('yabasa_http_requests', outcome='error')
     lines = [
-        f'yabasa_requests_total {REQUESTS_TOTAL}',
-        f'yabasa_requests_ok {REQUESTS_OK}',
-        f'yabasa_requests_error {REQUESTS_ERROR}',
+        f'yabasa_requests_total {ok + error:g}',
+        f'yabasa_requests_ok {ok:g}',
+        f'yabasa_requests_error {error:g}',
     ]
+    # 以下の件数・状態はこのワーカー（プロセス）の値
+    # 結果キャッシュ / URLキャッシュの件数（ヒット・ミス等は全ワーカー分を末尾に出す）
+    for name, st in cache_stats().items():
+        lines.append(f'yabasa_cache_entries{{cache="{name}"}} {st["size"]}')
+    # 同じ URL / 同じ本文で実行中の処理の数（合流した件数は末尾。singleflight.py）
+    for name, st in flight_stats().items():
+        lines.append(f'yabasa_coalesce_inflight{{kind="{name}"}} {st["inflight"]}')
+    # 求人サイト(ホスト)ごとの取得状況とサーキットブレーカー(hostsched.py)
+    for host, st in sorted(HOST_SCHEDULER.stats().items()):
+        lb = f'host="{host}"'
+        lines.append(f'yabasa_fetch_host_circuit_open{{{lb}}} {1 if st["state"] == "open" else 0}')
+        lines.append(f'yabasa_fetch_host_state{{{lb},state="{st["state"]}"}} 1')
+        lines.append(f'yabasa_fetch_host_inflight{{{lb}}} {st["inflight"]}')
+        lines.append(f'yabasa_fetch_host_waiting{{{lb}}} {st["waiting"]}')
+        for k in ('requests', 'errors', 'rejected', 'opens'):
+            lines.append(f'yabasa_fetch_host_{k}_total{{{lb}}} {st[k]}')
+    # チャート描画プロセス(rejected=混雑で図なし / timeouts=時間切れで図なし)
+    st = CHART_POOL.stats()
+    lines.append(f'yabasa_chart_workers {st["workers"]}')
+    lines.append(f'yabasa_chart_pending {st["pending"]}')
+    for k in ('rendered', 'rejected', 'timeouts', 'errors'):
+        lines.append(f'yabasa_chart_{k}_total {st[k]}')
+    # 利用ログの書き込み(dropped=キューがあふれて捨てた行)
+    st = USAGE_LOG.stats()
+    lines.append(f'yabasa_usage_log_queued {st["queued"]}')
+    for k in ('written', 'dropped', 'flushes', 'errors'):
+        lines.append(f'yabasa_usage_log_{k}_total {st[k]}')
+    # ディスクの URL 取得キャッシュ(fresh=通信なし / revalidated=304)
+    for k, v in FETCH_CACHE.stats().items():
+        lines.append(f'yabasa_fetch_cache_{k}_total {v}')
+    # 必須リテラルのプリフィルタで正規表現の評価を省けたルール数
+    for (version, persona), st in prefilter_stats().items():
+        lb = f'version="{version}",persona="{persona}"'
+        lines.append(f'yabasa_rules_evaluated_total{{{lb}}} {st["evaluated"]}')
+        lines.append(f'yabasa_rules_skipped_total{{{lb}}} {st["skipped"]}')
+        # YABASA_REGEX_MODE=bounded のときの時間予算超過・打ち切り
+        lines.append(f'yabasa_regex_budget_exhausted_total{{{lb}}} {st["budget_exhausted"]}')
+        lines.append(f'yabasa_regex_budget_skipped_rules_total{{{lb}}} {st["budget_skipped"]}')
+        for rule_id, n in sorted(st["over_budget"].items()):
+            lines.append(f'yabasa_rule_over_budget_total{{{lb},rule_id="{rule_id}"}} {n}')
+    # リクエスト単位の計測（YABASA_PROFILE=1 のとき。rejected=同時計測の上限で断った数。reqprof.py）
+    if REQUEST_PROFILER.enabled:
+        st = REQUEST_PROFILER.stats()
+        lines.append(f'yabasa_request_profiles_total {st["profiled"]}')
+        lines.append(f'yabasa_request_profiles_rejected_total {st["rejected"]}')
+    # 全ワーカーの合計: リクエスト数・処理時間・処理段階ごとの時間のヒストグラム、キャッシュ・合流の件数、
+    # ルールごとの評価回数・ヒット数・時間（YABASA_RULE_PROFILE_RATE > 0 のとき。ruleprof.py）
+    lines.extend(render_metrics())
     return "\n".join(lines) + "\n"
 
+def _analyze_response(src: str, mode: str, sector: str | None, scored: tuple, chart='png') -> dict:
+    """
+    score_text(with_spans=True) の結果から /analyze のレスポンスを組み立てる（単発・バッチ共通）。
+    chart: url → chart_url / chart_svg_url（画像は GET /chart/... で配信）/ png → chart_png_base64 /
+           svg → chart_svg / data → chart_data / none → 図なし
+    （chart_png_base64 は互換のため常に含め、png 以外では空文字。真偽値は png / none とみなす）
+    png を混雑・タイムアウトで描けなかったときは chart_unavailable=True を付けて図なしで返す
+    （この応答は結果キャッシュに入れない。_cacheable を参照）
+    partial: YABASA_REGEX_MODE=bounded で時間予算が尽き、一部のルールを評価していない結果なら True
+    （スコアは実際より低い可能性がある。この応答も結果キャッシュに入れない）
+    """
+    chart = chart_format(chart)
+    cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags, spans, budget_skipped = scored
+
+    # 上位理由
+    reasons=[]
+    for cat, hits in cat_hits.items():
+        for h in hits:
+            reasons.append({'category':DISPLAY_NAME_MAP.get(cat, cat),'reason':h['reason'],'weight':h['weight']})
+    reasons.sort(key=lambda x:(-x['weight'], x['category']))
+
+    # ラベル（モード補正）
+    label = label_total(total)
+    max_cat = max(cat_scores.values()) if cat_scores else 0
+    safe_count = sum(len(v) for v in cat_safe_hits.values())
+    if mode == 'strict':
+        if max_cat >= 4 or total >= 12:
+            label = '高（ブラックの可能性大）'
+    elif mode == 'lenient':
+        if label.startswith('高') and safe_count >= 2 and total <= 14:
+            label = '中（注意が必要）'
+
+    with stage('chart'):
+        png64=_radar_png64(cat_scores, measured_flags) if chart == 'png' else ''
+        chart_extra = {}
+        if chart == 'png' and cat_scores and not png64:
+            chart_extra['chart_unavailable'] = True
+        elif chart == 'url':
+            chart_extra['chart_url'] = chart_url(cat_scores, measured_flags)
+            chart_extra['chart_svg_url'] = chart_url(cat_scores, measured_flags, 'svg')
+        elif chart == 'svg':
+            chart_extra['chart_svg'] = radar_svg(cat_scores, measured_flags)
+        elif chart == 'data':
+            chart_extra['chart_data'] = radar_data(cat_scores, measured_flags)
+
+    # エビデンス（赤ハイライト済）
+    ev_list=[]
+    for cat, snippets in cat_evidence.items():
+        for sn in snippets:
+            ev_list.append({'category':DISPLAY_NAME_MAP.get(cat, cat), 'snippet':sn})
+    ev_list = ev_list[:12]
+
+    # ハイライト用のヒット位置（前処理後テキストに対するオフセット；match はその先頭のプレビュー。エビデンスと同じく上限つき）
+    ev_spans = [{**sp, 'category': DISPLAY_NAME_MAP.get(sp['category'], sp['category'])} for sp in spans]
+
+    # 求職者向けの主な懸念点
+    with stage('concerns'):
+        concerns = _concerns_for_seekers(cat_hits, cat_scores)
+
+    return {
+        'source':src,
+        'sector':sector,
+        'mode': mode,
+        'total':total,
+        'label':label,
+        'category_scores':{DISPLAY_NAME_MAP.get(k,k):v for k,v in cat_scores.items()},
+        'measured_flags':{DISPLAY_NAME_MAP.get(k,k):bool(measured_flags.get(k, True)) for k in cat_scores.keys()},
+        'scale_legend': _scale_legend(),
+        'top_reasons':reasons[:10],
+        'evidence': ev_list,
+        'evidence_spans': ev_spans,
+        'partial': bool(budget_skipped),
+        'recommendations': concerns,     # ← UIはこのキーを読んで表示
+        'chart_png_base64':png64,
+        **chart_extra,
+        'notice': "「測定不能」は該当カテゴリにヒット無しの場合に表示。0点＝安全ではなく『懸念が検出されなかった』の意味。"
+    }
+
+def _cacheable(res: dict) -> bool:
+    # 図を描けなかった応答・時間予算切れで一部のルールしか評価していない応答はキャッシュしない
+    # （次のリクエストで描き直す・採点し直す）
+    return not res.get('chart_unavailable') and not res.get('partial')
+
+def _analyze_key(body: str, mode: str, sector: str | None, chart) -> tuple:
+    # 結果キャッシュのキー（ルール変更で fingerprint が変わり自動的に別キーになる）
+    return result_key('analyze', body, RULESET_BASE.fingerprint, mode=mode, sector=sector, chart=chart_format(chart))
+
 @app.post('/analyze')
 @limiter.limit('10/second')
 def analyze(request: Request, inp: AnalyzeIn):
-    global REQUESTS_TOTAL, REQUESTS_OK, REQUESTS_ERROR
-    REQUESTS_TOTAL += 1
+    # X-Yabasa-Profile / ?profile= があればこのリクエストを計測する（YABASA_PROFILE=1 のときのみ。reqprof.py）
+    fmt = REQUEST_PROFILER.requested(request)
+    with metrics_endpoint('analyze'):
+        if fmt is not None:
+            return profiled_response(fmt, 'analyze', lambda: _analyze(request, inp))
+        return _analyze(request, inp)
+
+def _analyze(request: Request, inp: AnalyzeIn):
     try:
         mode = (inp.mode or 'standard').lower()
         body=(inp.text or '').strip(); src='text'
         if not body and inp.url:
-            got=fetch_text_from_url(inp.url)
+            with stage('fetch'):
+                # 計測中はキャッシュを通さずに取得する
+                got=fetch_text_from_url(inp.url) if profiling() else cached_fetch(inp.url, fetch_text_from_url)
             if not got:
-                REQUESTS_ERROR += 1
-                raise HTTPException(status_code=400, detail='URLの取得に失敗。本文貼り付けでお試しください。')
+                _count('analyze', False)
+                raise HTTPException(status_code=400, detail=fetch_failure_detail(inp.url) or 'URLの取得に失敗。本文貼り付けでお試しください。')
             body=got; src='url'
         if not body:
-            REQUESTS_ERROR += 1
+            _count('analyze', False)
             raise HTTPException(status_code=400, detail='入力が空です。url か text のどちらかを指定してください。')
 
-        cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags = score_text(body, sector=inp.sector)
-
-        # 上位理由
-        reasons=[]
-        for cat, hits in cat_hits.items():
-            for h in hits:
-                reasons.append({'category':DISPLAY_NAME_MAP.get(cat, cat),'reason':h['reason'],'weight':h['weight']})
-        reasons.sort(key=lambda x:(-x['weight'], x['category']))
-
-        # ラベル（モード補正）
-        label = label_total(total)
-        max_cat = max(cat_scores.values()) if cat_scores else 0
-        safe_count = sum(len(v) for v in cat_safe_hits.values())
-        if mode == 'strict':
-            if max_cat >= 4 or total >= 12:
-                label = '高（ブラックの可能性大）'
-        elif mode == 'lenient':
-            if label.startswith('高') and safe_count >= 2 and total <= 14:
-                label = '中（注意が必要）'
-
-        png64=_radar_png64(cat_scores, measured_flags)
-
-        # エビデンス（赤ハイライト済）
-        ev_list=[]
-        for cat, snippets in cat_evidence.items():
-            for sn in snippets:
-                ev_list.append({'category':DISPLAY_NAME_MAP.get(cat, cat), 'snippet':sn})
-        ev_list = ev_list[:12]
-
-        # 求職者向けの主な懸念点
-        concerns = _concerns_for_seekers(cat_hits, cat_scores)
+        # 同じ本文の採点が実行中ならそれに合流する(cache.cached_result)
+        chart = chart_format(inp.chart)
+        key = _analyze_key(body, mode, inp.sector, chart)
+        compute = lambda: _analyze_response(
+            src, mode, inp.sector, score_text(body, sector=inp.sector, with_spans=True), chart)
+        res = compute() if profiling() else cached_result(key, compute, _cacheable)
+        res = {**res, 'source': src}
+
+        _count('analyze', True)
+        _log_usage(request, src, res['total'], res['label'], mode, inp.sector)
+        return json_response(res)
+    except HTTPException:
+        raise
+    except TimeoutError:
+        # 合流先の採点がタイムアウトした(singleflight.py)
+        _count('analyze', False)
+        raise HTTPException(status_code=503, detail='処理が混み合っています。しばらくしてから再度お試しください。')
+    except Exception as e:
+        _count('analyze', False)
+        raise HTTPException(status_code=500, detail=f'サーバーエラー: {str(e)}')
 
-        REQUESTS_OK += 1
-        _log_usage(request, src, total, label, mode, inp.sector)
-
-        return {
-            'source':src,
-            'sector':inp.sector,
-            'mode': mode,
-            'total':total,
-            'label':label,
-            'category_scores':{DISPLAY_NAME_MAP.get(k,k):v for k,v in cat_scores.items()},
-            'measured_flags':{DISPLAY_NAME_MAP.get(k,k):bool(measured_flags.get(k, True)) for k in cat_scores.keys()},
-            'scale_legend': _scale_legend(),
-            'top_reasons':reasons[:10],
-            'evidence': ev_list,
-            'recommendations': concerns,     # ← UIはこのキーを読んで表示
-            'chart_png_base64':png64,
-            'notice': "「測定不能」は該当カテゴリにヒット無しの場合に表示。0点＝安全ではなく『懸念が検出されなかった』の意味。"
-        }
+# ---- レーダーチャート画像（/analyze の chart_url。URL がスコアの形そのものなので中身は変わらない） ----
+CHART_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+@app.get('/chart/{fingerprint}.{ext}')
+@limiter.limit('20/second')
+def chart_image_endpoint(request: Request, fingerprint: str, ext: str):
+    if ext not in IMAGE_TYPES:
+        raise HTTPException(status_code=404, detail='png か svg を指定してください。')
+    try:
+        scores, flags = parse_fingerprint(fingerprint)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    etag = chart_etag(fingerprint, ext)
+    headers = {'ETag': etag, 'Cache-Control': CHART_CACHE_CONTROL}
+    # 再検証は描かずに 304（中身は URL で決まる）
+    inm = request.headers.get('If-None-Match', '')
+    if inm.strip() == '*' or etag in (t.strip() for t in inm.split(',')):
+        return Response(status_code=304, headers=headers)
+    try:
+        body = chart_image(ext, scores, flags)
+    except ChartUnavailable:
+        raise HTTPException(status_code=503, detail='描画が混み合っています。しばらくしてから再度お試しください。',
+                            headers={'Retry-After': '1', 'Cache-Control': 'no-store'})
+    return Response(content=body, media_type=IMAGE_TYPES[ext], headers=headers)
+
+# ---- バッチ（夜間の再チェック等。1リクエストで複数件、結果は件ごと） ----
+BATCH_MAX_ITEMS = int(os.environ.get('YABASA_BATCH_MAX_ITEMS', '500'))
+
+class AnalyzeBatchIn(BaseModel):
+    items: list[AnalyzeIn]
+    # 図は既定で生成しない。各件の chart が指定されていればそちらを優先（true は png、false は none）
+    chart: bool | ChartFormat = False
+
+def _item_chart(it: AnalyzeIn, inp: AnalyzeBatchIn) -> str:
+    return chart_format(it.chart if it.chart is not None else inp.chart)
+
+@app.post('/analyze/batch')
+@limiter.limit('2/second')
+def analyze_batch(request: Request, inp: AnalyzeBatchIn):
+    """
+    items の各要素（/analyze と同じ形）を採点し、入力順に
+    {'index', 'ok': True, 'result'} または {'index', 'ok': False, 'error': {'status','detail'}} を返す。
+    """
+    with metrics_endpoint('analyze_batch'):
+        return _analyze_batch(request, inp)
+
+def _analyze_batch(request: Request, inp: AnalyzeBatchIn):
+    if len(inp.items) > BATCH_MAX_ITEMS:
+        _count('analyze_batch', False)
+        raise HTTPException(status_code=413, detail=f'1バッチの上限は {BATCH_MAX_ITEMS} 件です。')
+    try:
+        with stage('fetch'):
+            bodies = fetch_bodies(
+                inp.items, lambda url: cached_fetch(url, fetch_text_from_url),
+                '入力が空です。url か text のどちらかを指定してください。',
+                'URLの取得に失敗。本文貼り付けでお試しください。',
+            )
+
+        results = [None] * len(inp.items)
+        keys = {}
+        for i, (body, src, err) in enumerate(bodies):
+            if err is not None:
+                results[i] = {'index': i, 'ok': False, 'error': err}
+                continue
+            it = inp.items[i]
+            keys[i] = _analyze_key(body, (it.mode or 'standard').lower(), it.sector, _item_chart(it, inp))
+            hit = RESULT_CACHE.get(keys[i])
+            if hit is not None:
+                results[i] = {'index': i, 'ok': True, 'result': {**hit, 'source': src}}
+
+        # キャッシュに無いものだけ採点
+        todo = [i for i in keys if results[i] is None]
+        scored = score_many(
+            [bodies[i][0] for i in todo], version='base',
+            sector=[inp.items[i].sector for i in todo],
+            with_spans=True, return_exceptions=True,
+        )
+        for i, sc in zip(todo, scored):
+            it = inp.items[i]
+            mode = (it.mode or 'standard').lower()
+            if isinstance(sc, Exception):
+                results[i] = {'index': i, 'ok': False, 'error': {'status': 500, 'detail': f'サーバーエラー: {str(sc)}'}}
+                continue
+            try:
+                res = _analyze_response(bodies[i][1], mode, it.sector, sc, chart=_item_chart(it, inp))
+            except Exception as e:
+                results[i] = {'index': i, 'ok': False, 'error': {'status': 500, 'detail': f'サーバーエラー: {str(e)}'}}
+                continue
+            if _cacheable(res):
+                RESULT_CACHE.set(keys[i], res)
+            results[i] = {'index': i, 'ok': True, 'result': res}
+
+        for i in keys:
+            if results[i]['ok']:
+                res = results[i]['result']
+                _log_usage(request, res['source'], res['total'], res['label'], res['mode'], res['sector'])
+
+        _count('analyze_batch', True)
+        return json_response({
+            'count': len(results),
+            'ok_count': sum(1 for r in results if r['ok']),
+            'results': results,
+        })
     except HTTPException:
         raise
+    except PoolUnavailable:
+        # 採点ワーカーのプールを作り直しても使えなかった（batch.py）
+        _count('analyze_batch', False)
+        raise HTTPException(status_code=503, detail='処理が混み合っています。しばらくしてから再度お試しください。')
     except Exception as e:
-        REQUESTS_ERROR += 1
+        _count('analyze_batch', False)
         raise HTTPException(status_code=500, detail=f'サーバーエラー: {str(e)}')
 
+# ---- ストリーミング（NDJSON；終わった順に1件1行、index 付き） ----
+@app.post('/analyze/stream')
+@limiter.limit('2/second')
+def analyze_stream(request: Request, inp: AnalyzeBatchIn):
+    """
+    /analyze/batch と同じ入力を受け取り、1件終わるごとに
+    {"index", "ok": true, "result"} / {"index", "ok": false, "error"} を1行ずつ返す（application/x-ndjson）。
+    """
+    if len(inp.items) > STREAM_MAX_ITEMS:
+        _count('analyze_stream', False)
+        raise HTTPException(status_code=413, detail=f'1リクエストの上限は {STREAM_MAX_ITEMS} 件です。')
+
+    async def process(i: int, it: AnalyzeIn) -> dict:
+        mode = (it.mode or 'standard').lower()
+        body=(it.text or '').strip(); src='text'
+        if not body and it.url:
+            body = await cached_fetch_async(it.url, fetch_text_async); src='url'
+            if not body:
+                return {'index': i, 'ok': False, 'error': {'status': 400, 'detail': fetch_failure_detail(it.url) or 'URLの取得に失敗。本文貼り付けでお試しください。'}}
+        if not body:
+            return {'index': i, 'ok': False, 'error': {'status': 400, 'detail': '入力が空です。url か text のどちらかを指定してください。'}}
+
+        chart = _item_chart(it, inp)
+
+        async def compute():
+            scored = await score_async(body, version='base', sector=it.sector, with_spans=True)
+            if chart == 'png':
+                # PNG は描画プロセスの結果を待つのでイベントループの外で
+                return await run_in_threadpool(_analyze_response, src, mode, it.sector, scored, chart)
+            return _analyze_response(src, mode, it.sector, scored, chart)
+
+        res = await cached_result_async(_analyze_key(body, mode, it.sector, chart), compute, _cacheable)
+        res = {**res, 'source': src}
+        _log_usage(request, src, res['total'], res['label'], mode, it.sector)
+        return {'index': i, 'ok': True, 'result': res}
+
+    _count('analyze_stream', True)
+    return StreamingResponse(stream_ndjson(inp.items, process), media_type='application/x-ndjson')
+
 # --- 管理ダッシュボード（サマリーのみ；既存のadmin.html/jsに合わせて利用） ---
+ADMIN_DEFAULT_DAYS = 7
+_DAY_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
 @app.post('/admin/data')
 def admin_data(payload: dict = Body(...)):
+    """
+    利用ログの集計（usagerollup.py の SQLite から。ログ全体は読み直さない）。
+    payload（password 以外は任意）:
+      from / to : 'YYYY-MM-DD'。期間（省略時は件数のある直近 days 日）
+      days      : 省略時に表示する日数（既定 7）
+      breakdown : 期間内の内訳を出す軸のリスト（mode / sector / label / source。既定 ['mode', 'sector']）
+    total_requests / by_label は全期間の累計（従来どおり）。
+    """
     password = (payload or {}).get('password', '')
     expected = os.environ.get("ADMIN_PASS", "")
     if not expected or password != expected:
         raise HTTPException(status_code=401, detail="パスワード不一致")
 
-    path = os.path.join("logs","usage.csv")
-    daily = {}
-    labels = {"低":0,"中":0,"高":0}
-    total = 0
-    if os.path.exists(path):
-        with open(path, newline='', encoding='utf-8') as f:
-            r = csv.DictReader(f)
-            for row in r:
-                total += 1
-                day = (row.get("ts_iso") or "")[:10]
-                if day:
-                    daily[day] = daily.get(day,0)+1
-                lb = (row.get("label") or "")[:1]
-                if lb in labels: labels[lb]+=1
-
-    days = sorted(daily.keys())
-    if len(days) > 7:
-        days = days[-7:]
-    daily_values = [daily.get(d,0) for d in days]
-
+    start, end = payload.get('from'), payload.get('to')
+    for v in (start, end):
+        if v is not None and not (isinstance(v, str) and _DAY_RE.fullmatch(v)):
+            raise HTTPException(status_code=400, detail="from / to は YYYY-MM-DD で指定してください。")
+    dims = payload.get('breakdown', ['mode', 'sector'])
+    if not isinstance(dims, list) or any(d not in ROLLUP_DIMENSIONS for d in dims):
+        raise HTTPException(status_code=400, detail=f"breakdown は {' / '.join(ROLLUP_DIMENSIONS)} のリストで指定してください。")
+
+    if start is None and end is None:
+        try:
+            days = max(1, min(int(payload.get('days', ADMIN_DEFAULT_DAYS)), 366))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="days は整数で指定してください。")
+        recent = ROLLUP.last_days(days)
+        start, end = (recent[0], recent[-1]) if recent else ('', '')
+    else:
+        start, end = start or '0000-00-00', end or '9999-99-99'
+
+    daily = ROLLUP.daily(start, end)
+    totals = ROLLUP.totals()
     return {
-        "total_requests": total,
-        "by_label": {"low": labels["低"], "mid": labels["中"], "high": labels["高"]},
-        "daily": {"labels": days, "values": daily_values},
+        "total_requests": sum(totals.values()),
+        "by_label": {k: totals.get(k, 0) for k in ("low", "mid", "high")},
+        "daily": {"labels": [d for d, _ in daily], "values": [n for _, n in daily]},
+        "range": {"from": daily[0][0] if daily else None, "to": daily[-1][0] if daily else None,
+                  "total": sum(n for _, n in daily)},
+        "breakdown": {d: ROLLUP.breakdown(d, start, end) for d in dims},
     }
+
+@app.post('/admin/rules')
+def admin_rules(payload: dict = Body(...)):
+    """
+    ルールごとの計測結果（ruleprof.py。YABASA_RULE_PROFILE_RATE > 0 で抽出したリクエストのみ・全ワーカー分）。
+    payload（password 以外は任意）:
+      sort  : seconds（累計時間。既定）/ max_seconds / mean_seconds / evaluations / matches / hit_rate（降順）
+      limit : 上位何件を返すか（既定: 全件）
+    dead は計測中に一度もヒットしなかったルール。
+    """
+    password = (payload or {}).get('password', '')
+    expected = os.environ.get("ADMIN_PASS", "")
+    if not expected or password != expected:
+        raise HTTPException(status_code=401, detail="パスワード不一致")
+    sort = payload.get('sort', 'seconds')
+    if sort not in RULE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort は {' / '.join(RULE_SORT_KEYS)} のいずれかを指定してください。")
+    limit = payload.get('limit')
+    if limit is not None and not (isinstance(limit, int) and limit > 0):
+        raise HTTPException(status_code=400, detail="limit は正の整数で指定してください。")
+    return rule_report(all_rules(), sort=sort, limit=limit)
+
+@app.get('/profiles/{profile_id}', dependencies=[Depends(guard_metrics)])
+def download_profile(profile_id: str):
+    """
+    計測したリクエストのプロファイル（X-Yabasa-Profile-Url。reqprof.py）。
+    .pstats は cProfile の出力（python -m pstats）、.collapsed は flamegraph.pl / speedscope 用の折りたたみスタック
+    """
+    path = REQUEST_PROFILER.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail='プロファイルが見つかりません（古いものは削除されます）')
+    media = 'text/plain; charset=utf-8' if path.suffix == '.collapsed' else 'application/octet-stream'
+    return FileResponse(path, media_type=media, filename=path.name)
+
 from ilora_endpoint import router as ilora_router
 app.include_router(ilora_router)
@@ -0,0 +1,331 @@
+"""
+batch.py
+多数の求人票をまとめて採点するライブラリ関数 score_many()。
+
+  from batch import score_many
+  results = score_many(texts, persona="lifecycle")              # v48(既定)
+  results = score_many(texts, version="base", sector="IT")      # rules.score_text 相当
+
+設計:
+  - 採点はプロセスプール(CPU コア数)で並列実行する。プールはプロセス内で使い回し、
+    各ワーカーは起動時に一度だけルールをコンパイルする(バッチ全体で共有)
+  - API サーバは起動時に set_pool_workers(SERVER_BATCH_WORKERS) でプールを小さくする
+    (uvicorn --workers N では各ワーカーがプールを持つので、合計がコア数を超えないように)
+  - 件数が少ないとき(BATCH_PARALLEL_MIN 未満)やワーカー1つのときはプロセス内で直列に採点する
+    (プロセス間の受け渡しの方が高くつくため)
+  - 戻り値は入力と同じ順序で、各要素は score_text_v48 等と同じタプル
+  - ワーカーが落ちて(OOM kill 等)プールが壊れたら作り直して1回だけやり直す。
+    それでも失敗したら PoolUnavailable(API は 503 で返す)
+  - ワーカーは spawn で起動するため、スクリプトから呼ぶときは
+    if __name__ == "__main__": の中で呼ぶこと
+
+バッチ API(/analyze/batch, /ilora/concerns/batch)向けに、各件の本文を用意する
+fetch_bodies() と、ストリーミング API(/analyze/stream, /ilora/concerns/stream)向けの
+score_async() / stream_ndjson() もここに置く。
+
+環境変数:
+  YABASA_BATCH_WORKERS       : ワーカープロセス数(既定: CPU コア数。API サーバでは
+                               CPU コア数 / uvicorn のワーカー数(WEB_CONCURRENCY)、最大 2)
+  YABASA_BATCH_PARALLEL_MIN  : これ未満の件数はプロセス内で採点(既定: 8)
+  YABASA_BATCH_FETCH_WORKERS : URL 取得の並列数(既定: 8)
+  YABASA_STREAM_CONCURRENCY  : ストリーミングで同時に処理する件数(既定: 8)
+  YABASA_STREAM_MAX_PENDING  : 送信待ちで保持する結果の上限(既定: 16)
+  YABASA_STREAM_MAX_ITEMS    : ストリーミング1リクエストの上限件数(既定: 5000)
+"""
+
+import os
+import json
+import atexit
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from hostsched import fetch_failure_detail
+from mpmetrics import current_endpoint, set_endpoint
+
+_CPUS = os.cpu_count() or 1
+_SERVER_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+BATCH_WORKERS = int(os.environ.get("YABASA_BATCH_WORKERS", "0")) or _CPUS
+SERVER_BATCH_WORKERS = int(os.environ.get("YABASA_BATCH_WORKERS", "0")) or max(1, min(2, _CPUS // _SERVER_WORKERS))
+BATCH_PARALLEL_MIN = int(os.environ.get("YABASA_BATCH_PARALLEL_MIN", "8"))
+BATCH_FETCH_WORKERS = int(os.environ.get("YABASA_BATCH_FETCH_WORKERS", "8"))
+STREAM_CONCURRENCY = int(os.environ.get("YABASA_STREAM_CONCURRENCY", "8"))
+STREAM_MAX_PENDING = int(os.environ.get("YABASA_STREAM_MAX_PENDING", "16"))
+STREAM_MAX_ITEMS = int(os.environ.get("YABASA_STREAM_MAX_ITEMS", "5000"))
+
+VERSIONS = ("base", "ilora", "v48")
+
+
+class PoolUnavailable(RuntimeError):
+    """採点ワーカーのプールを作り直しても使えなかった"""
+
+
+# ------------------------------------------------------------------ #
+#  1件分の採点(ワーカー側でも呼ばれる)
+# ------------------------------------------------------------------ #
+
+def _score_one(version: str, persona: str, sector: str | None, with_spans: bool, text: str):
+    if version == "base":
+        from rules import score_text
+        return score_text(text, sector=sector, with_spans=with_spans)
+    if version == "ilora":
+        from rules_ilora import score_text_ilora
+        return score_text_ilora(text, persona=persona, with_spans=with_spans)
+    from rules_v48 import score_text_v48
+    return score_text_v48(text, persona=persona, with_spans=with_spans)
+
+
+def _score_chunk(args):
+    """
+    (version, [(persona, sector, text), ...], with_spans, return_exceptions, endpoint) を採点する。
+    endpoint は処理段階の時間(mpmetrics.stage)をどのエンドポイントに数えるか
+    """
+    version, items, with_spans, return_exceptions, endpoint = args
+    set_endpoint(endpoint)
+    out = []
+    for persona, sector, text in items:
+        try:
+            out.append(_score_one(version, persona, sector, with_spans, text))
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            out.append(e)
+    return out
+
+
+def _warmup():
+    # ワーカー起動時に全ルールセットの照合器を作っておく(import だけでは作られない。ruleset.warm_rulesets)
+    import rules, rules_ilora, rules_v48  # noqa: F401
+    from ruleset import warm_rulesets
+    warm_rulesets()
+
+
+def _ready():
+    return True
+
+
+# ------------------------------------------------------------------ #
+#  プロセスプール(遅延生成・使い回し)
+# ------------------------------------------------------------------ #
+
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = BATCH_WORKERS
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # API サーバ(スレッドあり)から fork すると危険なので spawn で起動する
+            _pool = ProcessPoolExecutor(
+                max_workers=_pool_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warmup,
+            )
+        return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor):
+    # 壊れたプールを捨てる(次の _get_pool で作り直す)。別のスレッドが作り直し済みなら触らない
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_on_pool(run):
+    """run(pool) を実行する。プールが壊れていたら作り直して1回だけやり直す"""
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            return run(pool)
+        except BrokenProcessPool as e:
+            print(f"[BATCH] 採点ワーカーが停止しました。プールを作り直します: {e}")
+            _reset_pool(pool)
+            if attempt:
+                raise PoolUnavailable(f"採点ワーカーを使えません: {e}") from e
+
+
+async def _run_on_pool_async(fn, args):
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            return await loop.run_in_executor(pool, fn, args)
+        except BrokenProcessPool as e:
+            print(f"[BATCH] 採点ワーカーが停止しました。プールを作り直します: {e}")
+            _reset_pool(pool)
+            if attempt:
+                raise PoolUnavailable(f"採点ワーカーを使えません: {e}") from e
+
+
+def set_pool_workers(workers: int):
+    """プールのワーカー数を変える(API サーバは SERVER_BATCH_WORKERS)。大きさの違うプールがあれば作り直す"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        workers = max(1, workers)
+        pool = _pool if workers != _pool_workers else None
+        _pool_workers = workers
+        if pool is not None:
+            _pool = None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_pool():
+    """ワーカーを先に起動しておく(各ワーカーの照合器の準備を最初のリクエストで待たせない)"""
+    if _pool_workers > 1:
+        pool = _get_pool()
+        for _ in range(_pool_workers):
+            pool.submit(_ready)
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+# ------------------------------------------------------------------ #
+#  公開API
+# ------------------------------------------------------------------ #
+
+def _per_item(value, n: int, name: str) -> list:
+    if value is None or isinstance(value, str):
+        return [value] * n
+    value = list(value)
+    if len(value) != n:
+        raise ValueError(f"{name} の数が texts と一致しません")
+    return value
+
+
+def score_many(texts, persona="standard", version: str = "v48", sector=None,
+               with_spans: bool = False, return_exceptions: bool = False,
+               workers: int | None = None) -> list:
+    """
+    texts を採点し、入力順の結果リストを返す。
+
+    persona / sector: 全件共通の値、または texts と同じ長さの列
+    version: "base"(rules.score_text)| "ilora"(score_text_ilora)| "v48"(score_text_v48)
+    return_exceptions: True なら失敗した要素に例外オブジェクトを入れて続行する
+                       (False なら最初の例外をそのまま送出)
+    workers: 並列に使うワーカー数(既定: プールの大きさ = YABASA_BATCH_WORKERS、未設定なら CPU コア数)。
+             1 ならプロセス内で直列に採点
+    """
+    if version not in VERSIONS:
+        raise ValueError(f"version は {VERSIONS} のいずれかを指定してください: {version!r}")
+
+    texts = list(texts)
+    items = list(zip(
+        _per_item(persona, len(texts), "persona"),
+        _per_item(sector, len(texts), "sector"),
+        texts,
+    ))
+    workers = min(workers or _pool_workers, _pool_workers)
+
+    if workers <= 1 or len(items) < BATCH_PARALLEL_MIN:
+        return _score_chunk((version, items, with_spans, return_exceptions, current_endpoint()))
+
+    # 1ワーカーあたり数チャンクに分けて偏りをならす
+    size = max(1, len(items) // (workers * 4))
+    endpoint = current_endpoint()
+    chunks = [
+        (version, items[i:i+size], with_spans, return_exceptions, endpoint)
+        for i in range(0, len(items), size)
+    ]
+    return _run_on_pool(lambda pool: [r for part in pool.map(_score_chunk, chunks) for r in part])
+
+
+def fetch_bodies(items, fetch, empty_detail: str, fetch_detail: str) -> list[tuple]:
+    """
+    バッチ各件(.text / .url を持つモデル)の本文を用意する。text 優先、無ければ url を並列取得。
+    戻り値: 入力順の [(body, source, error)]。error は {"status", "detail"} または None
+    """
+    out: list = [None] * len(items)
+    todo = []
+    for i, it in enumerate(items):
+        body = (it.text or "").strip()
+        if body:
+            out[i] = (body, "text", None)
+        elif it.url:
+            todo.append(i)
+        else:
+            out[i] = ("", "text", {"status": 400, "detail": empty_detail})
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_FETCH_WORKERS, len(todo)))) as ex:
+            for i, got in zip(todo, ex.map(lambda i: fetch(items[i].url), todo)):
+                if got:
+                    out[i] = (got, "url", None)
+                else:
+                    # 取得を一時停止中のサイトなら専用の案内(hostsched.py)
+                    detail = fetch_failure_detail(items[i].url) or fetch_detail
+                    out[i] = ("", "url", {"status": 400, "detail": detail})
+    return out
+
+
+# ------------------------------------------------------------------ #
+#  ストリーミング(NDJSON、完了順)
+# ------------------------------------------------------------------ #
+
+async def score_async(text: str, persona: str = "standard", version: str = "v48",
+                      sector: str | None = None, with_spans: bool = False):
+    """1件をイベントループの外で採点する(ワーカーが複数ならプロセスプール、1つならスレッド)"""
+    # run_in_executor は contextvar を引き継がないので endpoint は引数で渡す
+    args = (version, [(persona, sector, text)], with_spans, False, current_endpoint())
+    if _pool_workers > 1:
+        part = await _run_on_pool_async(_score_chunk, args)
+    else:
+        part = await asyncio.get_running_loop().run_in_executor(None, _score_chunk, args)
+    return part[0]
+
+
+async def stream_ndjson(items, process, concurrency: int | None = None,
+                        max_pending: int | None = None):
+    """
+    items を process(index, item) で並行処理し、終わった順に NDJSON の1行ずつ返す非同期ジェネレータ。
+
+    process は {"index", "ok", ...} の dict を返すコルーチン。例外は
+    {"index", "ok": False, "error": {"status": 500, "detail"}} の行にする。
+
+    背圧: 結果は大きさ max_pending のキューに入れ、キューが満杯の間は処理側が待つ。
+    サーバが抱える結果は「処理中 concurrency 件 + 送信待ち max_pending 件」を超えない。
+    クライアントが切断してジェネレータが閉じられたら、処理中のタスクは取り消す。
+    """
+    concurrency = max(1, concurrency or STREAM_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_pending or STREAM_MAX_PENDING))
+    todo = iter(enumerate(items))
+
+    async def worker():
+        # 各ワーカーが共有イテレータから次の1件を取る(イベントループ上なので競合しない)
+        for i, item in todo:
+            try:
+                res = await process(i, item)
+            except PoolUnavailable as e:
+                res = {"index": i, "ok": False, "error": {"status": 503, "detail": f"処理が混み合っています: {e}"}}
+            except Exception as e:
+                res = {"index": i, "ok": False, "error": {"status": 500, "detail": f"サーバーエラー: {e}"}}
+            await queue.put(res)
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        await queue.put(None)
+
+    runner = asyncio.create_task(run())
+    try:
+        while True:
+            res = await queue.get()
+            if res is None:
+                break
+            yield json.dumps(res, ensure_ascii=False) + "\n"
+    finally:
+        runner.cancel()
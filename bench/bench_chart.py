@@ -0,0 +1,109 @@
+"""
+bench/bench_chart.py
+レーダーチャート描画のベンチマーク(1枚あたり ms)。
+
+  python bench/bench_chart.py
+  python bench/bench_chart.py --charts 100 --distinct 20
+
+  legacy   : 従来の _radar_png64(毎回 plt.subplots で figure を作り、tight で保存)
+  template : chart.render_radar_png(テンプレート figure の使い回し、キャッシュなし)
+  cached   : chart.radar_png64(--distinct 種類のスコアの形を --charts 枚。2回目以降はキャッシュ)
+
+同じ入力で legacy と template の画像が画素単位で一致するかも確かめる。
+"""
+
+import io
+import os
+import sys
+import math
+import time
+import base64
+import random
+import logging
+import warnings
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+CATS = ['仕事内容・募集条件', '給与・待遇', '勤務時間・休日', '勤務地・募集人数',
+        '社風・福利厚生', '求人票サイン', '企業HPサイン']
+
+
+def legacy_radar_png64(scores: dict, measured_flags: dict) -> str:
+    """従来の実装(比較用にそのまま残す)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from rules import MAX_PER_CATEGORY, DISPLAY_NAME_MAP
+    cats = list(scores.keys())
+    if not cats:
+        return ""
+    labels = [(DISPLAY_NAME_MAP.get(c, c) + (' (測定不能)' if not measured_flags.get(c, True) else '')) for c in cats]
+    vals = [scores[c] for c in cats]
+    N = len(cats)
+    ang = [n/float(N)*2*math.pi for n in range(N)]
+    vals += vals[:1]; ang += ang[:1]
+    fig, ax = plt.subplots(figsize=(6,6), subplot_kw=dict(polar=True))
+    ax.plot(ang, vals, linewidth=2); ax.fill(ang, vals, alpha=.25)
+    ax.set_xticks(ang[:-1]); ax.set_xticklabels(labels, fontsize=10)
+    ax.set_yticks(range(0, MAX_PER_CATEGORY+1)); ax.set_yticklabels([str(i) for i in range(0, MAX_PER_CATEGORY+1)])
+    ax.grid(True)
+    buf = io.BytesIO(); fig.savefig(buf, format='png', dpi=160, bbox_inches='tight'); plt.close(fig); buf.seek(0)
+    return base64.b64encode(buf.read()).decode('ascii')
+
+
+def shapes(n: int, seed: int = 0) -> list[tuple[dict, dict]]:
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        scores = {c: rnd.randint(0, 5) for c in CATS}
+        flags = {c: scores[c] > 0 or rnd.random() < 0.3 for c in CATS}
+        out.append((scores, flags))
+    return out
+
+
+def timed(fn, inputs) -> float:
+    t0 = time.perf_counter()
+    for scores, flags in inputs:
+        fn(scores, flags)
+    return (time.perf_counter() - t0) * 1000 / max(1, len(inputs))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--charts", type=int, default=60, help="描く枚数")
+    ap.add_argument("--distinct", type=int, default=12, help="cached で使うスコアの形の種類")
+    args = ap.parse_args()
+    # 日本語フォントが無い環境の警告で出力が埋まらないようにする
+    logging.getLogger("matplotlib.font_manager").setLevel(logging.ERROR)
+    warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+
+    import numpy as np
+    import matplotlib.image as mpimg
+    import chart
+    from cache import CHART_CACHE
+
+    inputs = shapes(args.charts)
+    # 初回のフォント探索・テンプレート生成は計測から外す
+    legacy_radar_png64(*inputs[0]); chart.render_radar_png(*inputs[0])
+
+    same = 0
+    for scores, flags in inputs[:10]:
+        a = mpimg.imread(io.BytesIO(base64.b64decode(legacy_radar_png64(scores, flags))))
+        b = mpimg.imread(io.BytesIO(chart.render_radar_png(scores, flags)))
+        same += a.shape == b.shape and float(np.abs(a - b).max()) == 0.0
+
+    legacy = timed(legacy_radar_png64, inputs)
+    template = timed(chart.render_radar_png, inputs)
+    CHART_CACHE.clear()
+    pool = shapes(args.distinct, seed=1)
+    cached = timed(chart.radar_png64, [pool[i % len(pool)] for i in range(args.charts)])
+
+    print(f"charts={args.charts} distinct(cached)={args.distinct} pixel-identical={same}/10")
+    print(f"{'legacy':<10}{legacy:>9.1f} ms/chart")
+    print(f"{'template':<10}{template:>9.1f} ms/chart")
+    print(f"{'cached':<10}{cached:>9.1f} ms/chart  {CHART_CACHE.stats()}")
+
+
+if __name__ == "__main__":
+    main()
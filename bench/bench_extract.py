@@ -0,0 +1,171 @@
+"""
+bench/bench_extract.py
+URL 取得 + 本文抽出のベンチマーク: 従来実装(r.text 全読み + BeautifulSoup)と
+現在の rules.fetch_text_from_url(ストリーミング + htmltext の逐次抽出)を比べる。
+
+  python bench/bench_extract.py                        # 生成した 1 / 5 / 20MB のページで比較
+  python bench/bench_extract.py --sizes 2,50
+  python bench/bench_extract.py --fixtures saved_pages/ # 保存済みの *.html を使う
+
+各組み合わせは別プロセスで実行し、ピーク RSS(ru_maxrss。import 後からの増分と絶対値)と
+経過時間を測る。ページはローカルの HTTP サーバから配信する(ネットワークの揺れを含めない)。
+出力: fixture / 実装ごとの wall(ms)・peak RSS の増分と絶対値(MB)・本文文字数・従来実装と同じ本文か
+"""
+
+import os
+import sys
+import json
+import hashlib
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+# ------------------------------------------------------------------ #
+#  fixture の生成(求人サイトの一覧ページ風: 巨大な script / JSON、ナビ、多数の求人カード)
+# ------------------------------------------------------------------ #
+
+def make_page(size_mb: float, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    phrases = ["固定残業45時間を含む", "未経験大歓迎", "年収300万〜1000万", "アットホームな職場",
+               "有給取得実績あり", "月給25万円〜", "土日祝休み", "転勤なし", "研修制度充実"]
+    head = (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>求人一覧</title>"
+        "<style>" + ".c{margin:0}" * 2000 + "</style>"
+        "<script>window.__STATE__=" + json.dumps({"items": list(range(20000))}) + ";</script>"
+        "</head><body><nav>" + "".join(f"<a href='/c/{i}'>カテゴリ{i}</a>" for i in range(300)) + "</nav>"
+        "<noscript><p>JavaScript を有効にしてください</p></noscript>"
+    )
+    cards = []
+    size = len(head.encode())
+    target = int(size_mb * 1024 * 1024)
+    i = 0
+    while size < target:
+        card = (
+            f"<div class='card' data-id='{i}'><h2>求人 {i}</h2><p>"
+            + "。".join(rnd.choice(phrases) for _ in range(6))
+            + "</p><script>track(" + str(i) + ")</script><!-- ad --></div>\n"
+        )
+        cards.append(card)
+        size += len(card.encode())
+        i += 1
+    return (head + "".join(cards) + "</body></html>").encode("utf-8")
+
+
+# ------------------------------------------------------------------ #
+#  子プロセス: 1実装 × 1ページ
+# ------------------------------------------------------------------ #
+
+def legacy_fetch_text_from_url(url: str) -> str:
+    """従来の実装(比較用にそのまま残す)"""
+    import re
+    import requests
+    from bs4 import BeautifulSoup
+    from rules import preprocess_text
+    try:
+        r = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=20); r.raise_for_status()
+        soup = BeautifulSoup(r.text, "html.parser")
+        for t in soup(["script", "style", "noscript"]): t.decompose()
+        text = soup.get_text("\n")
+        text = re.sub(r"\n{2,}", "\n", text)
+        return preprocess_text(text)[:80000]
+    except Exception:
+        return ""
+
+
+def child(impl: str, url: str):
+    os.environ["YABASA_FETCH_CACHE_MAX_ENTRIES"] = "0"
+    sys.path.insert(0, ROOT)
+    import requests  # noqa: F401
+    import bs4  # noqa: F401
+    from rules import fetch_text_from_url
+    fn = legacy_fetch_text_from_url if impl == "legacy" else fetch_text_from_url
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    text = fn(url)
+    wall = (time.perf_counter() - t0) * 1000
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"wall_ms": wall, "rss_mb": (peak - base) / 1024, "peak_mb": peak / 1024,
+                      "chars": len(text), "digest": hashlib.sha256(text.encode()).hexdigest()}))
+
+
+def run_child(impl: str, url: str, env: dict) -> dict:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", impl, url],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+# ------------------------------------------------------------------ #
+#  親プロセス
+# ------------------------------------------------------------------ #
+
+class _Handler(SimpleHTTPRequestHandler):
+    # 従来実装(r.text)が ISO-8859-1 で読まないよう charset を明示する
+    extensions_map = {**SimpleHTTPRequestHandler.extensions_map, ".html": "text/html; charset=utf-8"}
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # ストリーミング側が途中で読むのをやめると接続が切られる(想定どおり)
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1,5,20", help="生成するページの大きさ(MB、カンマ区切り)")
+    ap.add_argument("--fixtures", help="保存済み HTML(*.html)のディレクトリ。指定時は生成しない")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--child", nargs=2, metavar=("IMPL", "URL"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    if args.fixtures:
+        root = args.fixtures
+        names = sorted(n for n in os.listdir(root) if n.endswith(".html"))
+    else:
+        root = tempfile.mkdtemp(prefix="yabasa_fixtures_")
+        names = []
+        for s in args.sizes.split(","):
+            name = f"page_{s}mb.html"
+            with open(os.path.join(root, name), "wb") as f:
+                f.write(make_page(float(s)))
+            names.append(name)
+
+    srv = _Server(("127.0.0.1", 0), partial(_Handler, directory=root))
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    env = dict(os.environ)
+
+    print(f"{'fixture':<24}{'size':>8}{'impl':>10}{'wall_ms':>10}{'rss+MB':>9}{'peakMB':>9}{'chars':>8}{'same':>6}")
+    for name in names:
+        url = f"http://127.0.0.1:{srv.server_address[1]}/{name}"
+        size_mb = os.path.getsize(os.path.join(root, name)) / 1024 / 1024
+        ref = None
+        for impl in ("legacy", "stream"):
+            runs = [run_child(impl, url, env) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r["wall_ms"])
+            ref = ref or best["digest"]
+            print(f"{name:<24}{size_mb:>7.1f}M{impl:>10}{best['wall_ms']:>10.0f}"
+                  f"{max(r['rss_mb'] for r in runs):>9.1f}{max(r['peak_mb'] for r in runs):>9.1f}{best['chars']:>8}"
+                  f"{str(best['digest'] == ref):>6}")
+    srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
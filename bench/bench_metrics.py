@@ -0,0 +1,130 @@
+"""
+bench/bench_metrics.py
+ページビュー集計(metrics.py)のベンチマーク: 1年分の合成トラフィックを流し、1件あたりの record() の
+時間が月を追っても変わらないこと(履歴の量に比例しないこと)と、ユニーク訪問者の推定誤差を確かめる。
+
+  python bench/bench_metrics.py
+  python bench/bench_metrics.py --days 365 --per-day 3000 --paths 40 --visitors 20000
+  python bench/bench_metrics.py --legacy-days 20     # 旧実装(JSON 全体の読み書き)と比べる
+
+  - 日付は metrics._today を差し替えて進める。DB は一時ディレクトリに作る
+  - 月(30日)ごとに 1件あたりの平均 µs(flush を含む)を出す
+  - 最後の月 / 最初の月 の比が 1 + --tolerance を超えたら終了コード 1
+  - --legacy-days > 0 なら、旧実装を同じ条件で流して日ごとの 1件あたりの時間を出す
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+import metrics  # noqa: E402
+from metrics import MetricsStore  # noqa: E402
+
+
+def _day(i: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(1735689600 + i * 86400))  # 2025-01-01 から
+
+
+def _traffic(rng: random.Random, n: int, paths: list[str], visitors: int):
+    # パスは偏り(先頭ほど多い)、訪問者は全体のプールから
+    weights = [1 / (i + 1) for i in range(len(paths))]
+    for path in rng.choices(paths, weights, k=n):
+        v = rng.randrange(visitors)
+        yield path, f"10.{v >> 16 & 255}.{v >> 8 & 255}.{v & 255}"
+
+
+# ------------------------------------------------------------------ #
+#  旧実装(比較用。record のたびに JSON 全体を読み書きする)
+# ------------------------------------------------------------------ #
+
+def legacy_record(db_path: Path, day: str, page_path: str, ip: str):
+    db = json.loads(db_path.read_text(encoding="utf-8")) if db_path.exists() else {"by_day": {}, "by_path": {}}
+    entry = db["by_day"].setdefault(day, {"views": 0, "ips": []})
+    entry["views"] += 1
+    ips = set(entry["ips"])
+    ips.add(hashlib.sha256(("salt|" + ip).encode()).hexdigest()[:12])
+    entry["ips"] = list(ips)
+    db["by_path"].setdefault(page_path, {"views": 0})["views"] += 1
+    db_path.write_text(json.dumps(db, ensure_ascii=False), encoding="utf-8")
+
+
+# ------------------------------------------------------------------ #
+#  本体
+# ------------------------------------------------------------------ #
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--per-day", type=int, default=2000)
+    ap.add_argument("--paths", type=int, default=30)
+    ap.add_argument("--visitors", type=int, default=50000, help="訪問者プールの大きさ")
+    ap.add_argument("--legacy-days", type=int, default=10)
+    ap.add_argument("--tolerance", type=float, default=0.5, help="最初の月からの許容増加率")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    paths = ["/"] + [f"/page/{i}" for i in range(1, args.paths)]
+    tmp = Path(tempfile.mkdtemp(prefix="bench_metrics_"))
+    store = MetricsStore(tmp / "metrics.sqlite3")
+
+    months: list[float] = []
+    errors: list[float] = []
+    t_month, n_month = 0.0, 0
+    for i in range(args.days):
+        day = _day(i)
+        metrics._today = lambda day=day: day
+        events = list(_traffic(rng, args.per_day, paths, args.visitors))
+        t0 = time.perf_counter()
+        for path, ip in events:
+            store.record(path, ip)
+        t_month += time.perf_counter() - t0
+        n_month += len(events)
+        if i % 30 == 0:
+            # 推定誤差(flush して DB から読んだ値と正確な数)
+            store.flush()
+            exact = len({ip for _, ip in events})
+            est = store.summary()["by_day"][day]["unique_ips"]
+            errors.append(abs(est - exact) / exact)
+        if (i + 1) % 30 == 0 or i == args.days - 1:
+            months.append(t_month / n_month * 1e6)
+            t_month, n_month = 0.0, 0
+    store.flush()
+
+    total_views = sum(v["views"] for v in store.summary()["by_day"].values())
+    size_kb = sum(p.stat().st_size for p in tmp.iterdir()) / 1024
+    print(f"metrics: {args.days} days x {args.per_day}/day = {total_views} views, "
+          f"{args.paths} paths, db {size_kb:.0f} KB")
+    for m, us in enumerate(months, 1):
+        print(f"  month {m:>2}: {us:7.2f} us/record")
+    ratio = months[-1] / months[0]
+    print(f"last / first month: {ratio:.2f}  (per-record median {statistics.median(months):.2f} us)")
+    print(f"unique visitors error: mean {statistics.mean(errors) * 100:.2f}%  max {max(errors) * 100:.2f}%")
+
+    if args.legacy_days > 0:
+        legacy = tmp / "metrics.json"
+        per_day = min(args.per_day, 300)
+        print(f"legacy JSON: {args.legacy_days} days x {per_day}/day")
+        for i in range(args.legacy_days):
+            events = list(_traffic(rng, per_day, paths, args.visitors))
+            t0 = time.perf_counter()
+            for path, ip in events:
+                legacy_record(legacy, _day(i), path, ip)
+            print(f"  day {i + 1:>2}: {(time.perf_counter() - t0) / len(events) * 1e6:9.1f} us/record")
+
+    ok = ratio <= 1 + args.tolerance
+    print("OK" if ok else f"REGRESSION: per-record cost grew {ratio:.2f}x over {args.days} days")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
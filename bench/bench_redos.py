@@ -0,0 +1,88 @@
+"""
+bench/bench_redos.py
+ルールごとの最悪ケース所要時間を、入力長を変えながら exact / bounded の両モードで測る。
+
+  python bench/bench_redos.py                       # 既定: v48 lifecycle, 1k/4k/16k 文字
+  python bench/bench_redos.py --sizes 1000 4000 16000 64000 --top 15
+  python bench/bench_redos.py --mode bounded        # 片方のモードだけ
+
+出力:
+  - ルールごとの各サイズの所要時間(ms)と、サイズ4倍あたりの増加率(≒4 なら線形、≒16 なら2乗)
+  - 全ルールを1リクエストとして流したときの所要時間と、bounded モードの予算超過・打ち切り件数
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rules_v48  # noqa: F401  (レイヤ登録のため)
+from ruleset import get_ruleset, REGEX_GAP, RULE_BUDGET_MS, REQUEST_BUDGET_MS
+from redos_corpus import adversarial_text
+
+
+def _time_rule(regex, text: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for i, _m in enumerate(regex.finditer(text)):
+            if i >= 2:
+                break
+        dt = (time.perf_counter() - t0) * 1000
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--version", default="v48")
+    ap.add_argument("--persona", default="lifecycle")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000])
+    ap.add_argument("--mode", choices=["exact", "bounded", "both"], default="both")
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    base = get_ruleset(args.version, args.persona)
+    modes = ["exact", "bounded"] if args.mode == "both" else [args.mode]
+    sizes = sorted(args.sizes)
+
+    print(f"ruleset={args.version}/{args.persona} rules={len(base.rules)} gap={REGEX_GAP} "
+          f"budget(rule/request)={RULE_BUDGET_MS}/{REQUEST_BUDGET_MS}ms")
+
+    texts = {r.rule_id: {n: adversarial_text(r, n) for n in sizes} for r in base.rules}
+
+    for mode in modes:
+        print(f"\n== mode={mode}: ルール単体の最悪ケース(ms) ==")
+        rows = []
+        for r in base.rules:
+            regex = r.bounded if mode == "bounded" else r.regex
+            ts = [_time_rule(regex, texts[r.rule_id][n], args.repeat) for n in sizes]
+            growth = (ts[-1] / ts[-2]) if len(ts) > 1 and ts[-2] > 0 else 0.0
+            rows.append((ts[-1], r.rule_id, ts, growth, r.pattern))
+        rows.sort(reverse=True)
+
+        head = "  ".join(f"{n:>8}" for n in sizes)
+        print(f"{'rule_id':<24}{head}  growth  pattern")
+        for _, rid, ts, growth, pat in rows[:args.top]:
+            cols = "  ".join(f"{t:8.2f}" for t in ts)
+            print(f"{rid:<24}{cols}  {growth:6.1f}  {pat[:50]}")
+
+        # 全ルールの最悪ケース入力を連結した1リクエスト(長さ n)
+        rs = base.with_mode(mode)
+        for n in sizes:
+            chunk = max(200, n // len(base.rules))
+            text = "".join(adversarial_text(r, chunk) for r in base.rules)[:n]
+            report: list = []
+            t0 = time.perf_counter()
+            rs.match(text, report)
+            dt = (time.perf_counter() - t0) * 1000
+            over = sum(1 for x in report if x["status"] == "over_budget")
+            skipped = sum(1 for x in report if x["status"] == "skipped")
+            print(f"request len={len(text):>7}: {dt:9.2f}ms  over_budget={over} skipped={skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+bench/bench_scoring.py
+採点まわりのベンチマーク: job_corpus.py の合成求人票(大きさ × ヒット密度 × persona)で各処理を測り、
+スループット・p50 / p99・メモリ確保量(tracemalloc)を出して、基準値と比べる。
+
+  python bench/bench_scoring.py
+  python bench/bench_scoring.py --quick                                   # 1k / 16k / 80k・typical のみ
+  python bench/bench_scoring.py --cases score_text,endpoint_analyze --sizes 1000,80000
+  python bench/bench_scoring.py --save-baseline bench/scoring_baseline.json   # 基準値を保存
+  python bench/bench_scoring.py --baseline bench/scoring_baseline.json        # 基準値 + tolerance と比較
+
+  html_to_text                : 保存済み HTML fixture(bench/fixtures)からの本文抽出
+  preprocess_text             : rules.preprocess_text
+  score_text                  : rules.score_text(with_spans=True)
+  score_text_ilora            : rules_ilora.score_text_ilora(persona, with_spans=True)
+  score_text_v48              : rules_v48.score_text_v48(persona, with_spans=True)
+  check_hard_limit_violations : aggregation.check_hard_limit_violations(年収下限・地域・働き方・関係性の条件つき)
+  aggregate_to_radar_axes     : aggregation.aggregate_to_radar_axes(score_text_v48 のカテゴリスコアから)
+  radar_png64                 : api_app._radar_png64(図のキャッシュを毎回空にする = 描画プロセスでの描画を含む)
+  endpoint_analyze            : POST /analyze(chart=none)。httpx.ASGITransport でプロセス内から呼ぶ
+  endpoint_analyze_png        : POST /analyze(chart=png)
+  endpoint_ilora              : POST /ilora/concerns(persona つき)
+  (エンドポイントは結果キャッシュを毎回空にして、毎回採点させる)
+
+  - persona で結果が変わらないケースは persona=standard の本文だけで測る
+  - 各ケースは --warmup 回呼んでから --repeat 回測る(ms の p50 / p99、1秒あたりの件数・文字数)
+  - メモリは時間の測定とは別に1回だけ tracemalloc の下で呼び、確保のピーク(KB)と呼び出し後に残った量(KB)を出す
+  - 基準値の p50 / ピーク × (1 + --tolerance) を超えたケースがあれば終了コード 1
+    (p99 は揺れが大きいので表示のみ。基準値はマシンごとに --save-baseline で作る)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import warnings
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+os.environ.setdefault("ENABLE_LOG", "0")
+
+from job_corpus import SIZES, DENSITIES, PERSONAS, FIXTURES, corpus, fixture_name  # noqa: E402
+
+FIXTURE_DIR = os.path.join(HERE, "fixtures")
+
+HARD_LIMITS = {
+    "income_floor": 450,
+    "geography_exclusion": ["沖縄県", "北海道"],
+    "work_style_constraints": ["転勤なし", "夜勤なし", "土日休み"],
+    "relationship_exclusions": ["体育会系の上司"],
+}
+
+# persona で結果が変わるケース
+PERSONA_CASES = {"score_text_ilora", "score_text_v48", "endpoint_ilora"}
+# 本文ではなくスコアを入力にするケース(1秒あたりの文字数は出さない)
+SCORE_INPUT_CASES = {"aggregate_to_radar_axes", "radar_png64"}
+
+
+# ------------------------------------------------------------------ #
+#  ケース(posting → 引数なしで1回分を実行する関数)
+# ------------------------------------------------------------------ #
+
+def _app():
+    import api_app
+    api_app.limiter.enabled = False
+    return api_app
+
+
+class _Client:
+    """プロセス内の ASGI 呼び出し(ネットワークを通さない)"""
+
+    def __init__(self):
+        import httpx
+        self.loop = asyncio.new_event_loop()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=_app().app), base_url="http://bench")
+
+    def post(self, path: str, payload: dict):
+        r = self.loop.run_until_complete(self.client.post(path, json=payload))
+        if r.status_code != 200:
+            raise RuntimeError(f"{path}: {r.status_code} {r.text[:200]}")
+        return r
+
+    def close(self):
+        self.loop.run_until_complete(self.client.aclose())
+        self.loop.close()
+
+
+_CLIENT: _Client | None = None
+
+
+def _client() -> _Client:
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = _Client()
+    return _CLIENT
+
+
+def _uncached(fn):
+    from cache import RESULT_CACHE
+
+    def run():
+        RESULT_CACHE.clear()
+        return fn()
+    return run
+
+
+def case_preprocess_text(p):
+    from rules import preprocess_text
+    return lambda: preprocess_text(p.text)
+
+
+def case_score_text(p):
+    from rules import score_text
+    return lambda: score_text(p.text, with_spans=True)
+
+
+def case_score_text_ilora(p):
+    from rules_ilora import score_text_ilora
+    return lambda: score_text_ilora(p.text, persona=p.persona, with_spans=True)
+
+
+def case_score_text_v48(p):
+    from rules_v48 import score_text_v48
+    return lambda: score_text_v48(p.text, persona=p.persona, with_spans=True)
+
+
+def case_check_hard_limit_violations(p):
+    from aggregation import check_hard_limit_violations
+    return lambda: check_hard_limit_violations(p.text, HARD_LIMITS)
+
+
+def case_aggregate_to_radar_axes(p):
+    from rules_v48 import score_text_v48
+    from aggregation import aggregate_to_radar_axes
+    cat_scores = score_text_v48(p.text, persona=p.persona)[0]
+    return lambda: aggregate_to_radar_axes(cat_scores)
+
+
+def case_radar_png64(p):
+    from rules import score_text
+    from cache import CHART_CACHE
+    api_app = _app()
+    cat_scores, _, _, _, _, flags = score_text(p.text)
+
+    def run():
+        CHART_CACHE.clear()
+        if not api_app._radar_png64(cat_scores, flags):
+            raise RuntimeError("図を描けませんでした(描画プロセスの混雑・タイムアウト)")
+    return run
+
+
+def case_endpoint_analyze(p):
+    c = _client()
+    return _uncached(lambda: c.post("/analyze", {"text": p.text, "chart": "none"}))
+
+
+def case_endpoint_analyze_png(p):
+    c = _client()
+
+    def run():
+        from cache import CHART_CACHE
+        CHART_CACHE.clear()
+        return c.post("/analyze", {"text": p.text, "chart": "png"})
+    return _uncached(run)
+
+
+def case_endpoint_ilora(p):
+    c = _client()
+    return _uncached(lambda: c.post("/ilora/concerns", {"text": p.text, "persona": p.persona}))
+
+
+CASES = {
+    "html_to_text": None,  # fixture ごと(run_fixtures)
+    "preprocess_text": case_preprocess_text,
+    "score_text": case_score_text,
+    "score_text_ilora": case_score_text_ilora,
+    "score_text_v48": case_score_text_v48,
+    "check_hard_limit_violations": case_check_hard_limit_violations,
+    "aggregate_to_radar_axes": case_aggregate_to_radar_axes,
+    "radar_png64": case_radar_png64,
+    "endpoint_analyze": case_endpoint_analyze,
+    "endpoint_analyze_png": case_endpoint_analyze_png,
+    "endpoint_ilora": case_endpoint_ilora,
+}
+
+
+# ------------------------------------------------------------------ #
+#  測定
+# ------------------------------------------------------------------ #
+
+def _pct(xs: list[float], q: float) -> float:
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+
+def measure(fn, chars: int, repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    total = sum(times)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": round(_pct(times, 0.5) * 1000, 3),
+        "p99_ms": round(_pct(times, 0.99) * 1000, 3),
+        "ops": round(len(times) / total, 1) if total else 0.0,
+        "kchars_per_s": round(chars * len(times) / total / 1000, 1) if total else 0.0,
+        "peak_kb": round((peak - before) / 1024, 1),
+        "retained_kb": round((current - before) / 1024, 1),
+    }
+
+
+def run_fixtures(repeat: int, warmup: int) -> dict[str, dict]:
+    from rules import html_to_text
+    out = {}
+    for size, density, persona in FIXTURES:
+        name = fixture_name(size, density, persona)
+        path = os.path.join(FIXTURE_DIR, name)
+        if not os.path.exists(path):
+            print(f"  (fixture がありません: {path}。python bench/job_corpus.py --write bench/fixtures で作成)")
+            continue
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        out[f"html_to_text/{name[len('posting-'):-len('.html')]}"] = measure(
+            lambda: html_to_text(html), len(html), repeat, warmup)
+    return out
+
+
+def _print(key: str, r: dict, base: dict | None):
+    note = ""
+    if base and base["p50_ms"]:
+        note = f"  (p50 {r['p50_ms'] / base['p50_ms'] - 1:+.0%}, peak {r['peak_kb'] / max(base['peak_kb'], 1) - 1:+.0%})"
+    kchars = f"{r['kchars_per_s']:10.1f}" if r["kchars_per_s"] else f"{'-':>10}"
+    print(f"{key:<52} {r['p50_ms']:9.3f} {r['p99_ms']:9.3f} {r['ops']:9.1f} {kchars} "
+          f"{r['peak_kb']:9.1f} {r['retained_kb']:8.1f}{note}")
+
+
+# ------------------------------------------------------------------ #
+#  本体
+# ------------------------------------------------------------------ #
+
+def _ints(s: str) -> tuple[int, ...]:
+    return tuple(int(x) for x in s.split(",") if x)
+
+
+def _names(s: str) -> tuple[str, ...]:
+    return tuple(x for x in s.split(",") if x)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cases", type=_names, default=tuple(CASES), help="カンマ区切り(既定: すべて)")
+    ap.add_argument("--sizes", type=_ints, default=SIZES, help="本文の文字数(カンマ区切り)")
+    ap.add_argument("--densities", type=_names, default=tuple(DENSITIES))
+    ap.add_argument("--personas", type=_names, default=PERSONAS)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--quick", action="store_true", help="1k / 16k / 80k・typical、repeat 10")
+    ap.add_argument("--baseline", help="基準値の JSON(--save-baseline で作る)")
+    ap.add_argument("--tolerance", type=float, default=0.3, help="基準値からの許容増加率")
+    ap.add_argument("--save-baseline", help="今回の結果を基準値として保存する")
+    args = ap.parse_args()
+
+    unknown = [c for c in args.cases if c not in CASES]
+    if unknown:
+        ap.error(f"不明なケース: {', '.join(unknown)}(選べるもの: {', '.join(CASES)})")
+    if args.quick:
+        args.sizes, args.densities, args.repeat = (1_000, 16_000, 80_000), ("typical",), min(args.repeat, 10)
+
+    warnings.filterwarnings("ignore")  # matplotlib のフォント警告
+    base = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+
+    postings = corpus(args.sizes, args.densities, args.personas, args.seed)
+    print(f"corpus: {len(postings)} postings (sizes {','.join(str(s) for s in args.sizes)} chars, "
+          f"densities {','.join(args.densities)}, personas {','.join(args.personas)}), "
+          f"repeat {args.repeat}, warmup {args.warmup}")
+    print(f"{'case/input':<52} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'kchars/s':>10} {'peak KB':>9} {'kept KB':>8}")
+
+    results: dict[str, dict] = {}
+    try:
+        for case in args.cases:
+            if case == "html_to_text":
+                for key, r in run_fixtures(args.repeat, args.warmup).items():
+                    results[key] = r
+                    _print(key, r, base.get(key))
+                continue
+            for p in postings:
+                if case not in PERSONA_CASES and p.persona != args.personas[0]:
+                    continue
+                key = f"{case}/{p.name}" if case in PERSONA_CASES else f"{case}/{p.size // 1000}k-{p.density}"
+                chars = 0 if case in SCORE_INPUT_CASES else len(p.text)
+                r = measure(CASES[case](p), chars, args.repeat, args.warmup)
+                results[key] = r
+                _print(key, r, base.get(key))
+    finally:
+        if _CLIENT is not None:
+            _CLIENT.close()
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"baseline saved: {args.save_baseline}")
+
+    failed = []
+    for key, r in results.items():
+        b = base.get(key)
+        if not b:
+            continue
+        if r["p50_ms"] > b["p50_ms"] * (1 + args.tolerance):
+            failed.append(f"{key}: p50 {b['p50_ms']:.3f} -> {r['p50_ms']:.3f} ms")
+        # 小さい確保量の揺れで落ちないよう 16KB の余裕を見る
+        if r["peak_kb"] > b["peak_kb"] * (1 + args.tolerance) + 16:
+            failed.append(f"{key}: peak {b['peak_kb']:.1f} -> {r['peak_kb']:.1f} KB")
+    if base:
+        print(f"compared with {args.baseline}: {sum(1 for k in results if k in base)} cases, tolerance {args.tolerance:.0%}")
+    if failed:
+        print("REGRESSION:")
+        for line in failed:
+            print(f"  {line}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
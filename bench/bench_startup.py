@@ -0,0 +1,177 @@
+"""
+bench/bench_startup.py
+起動時間のベンチマーク: api_app の import 時間(モジュール別)と、uvicorn を起動してから
+最初の /analyze が 200 を返すまでの時間(time-to-first-response)を測り、上限と比べる。
+
+  python bench/bench_startup.py
+  python bench/bench_startup.py --repeat 5 --max-import-ms 1200 --max-ttfr-ms 5000
+  python bench/bench_startup.py --save-baseline bench/startup_baseline.json   # 基準値を保存
+  python bench/bench_startup.py --baseline bench/startup_baseline.json        # 基準値 + tolerance と比較
+  YABASA_WARMUP=0 python bench/bench_startup.py                               # 起動時の準備なし
+
+  import      : python -X importtime -c "import api_app" を別プロセスで実行(毎回まっさらな状態)。
+                api_app が直接読み込むモジュールごとの累計(ms、中央値)と、重い依存
+                (matplotlib / bs4 / requests / httpx)が import 時点で読み込まれていないかを出す
+  first resp  : uvicorn api_app:app を起動し、POST /analyze(chart=none)が 200 になるまでの ms
+                (起動時のルールセット準備を含む)と、続く2件目の応答時間
+
+上限(--max-import-ms / --max-ttfr-ms)か、基準値 × (1 + --tolerance) を超えたら終了コード 1。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+HEAVY = ("matplotlib", "bs4", "requests", "httpx")
+TEXT = "未経験大歓迎。固定残業45時間を含む。アットホームな職場です。"
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("ENABLE_LOG", "0")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+# ------------------------------------------------------------------ #
+#  import 時間
+# ------------------------------------------------------------------ #
+
+def import_once() -> tuple[float, dict[str, float], list[str]]:
+    """(api_app の累計 ms, 直接読み込むモジュール → 累計 ms, 読み込まれた重い依存)"""
+    code = f"import api_app, sys; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                         cwd=ROOT, env=_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((len(m.group(3)) // 2, m.group(4), int(m.group(2)) / 1000))
+    # importtime は子 → 親の順に出る。api_app の行より前で1段深いものが直接の子
+    idx = next(i for i, r in enumerate(rows) if r[1] == "api_app")
+    depth = rows[idx][0]
+    children: dict[str, float] = {}
+    for d, name, cum in reversed(rows[:idx]):
+        if d <= depth:
+            break
+        if d == depth + 1:
+            children[name] = cum
+    heavy = [m for m in out.stdout.strip().split(",") if m]
+    return rows[idx][2], children, heavy
+
+
+# ------------------------------------------------------------------ #
+#  time-to-first-response
+# ------------------------------------------------------------------ #
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _post(port: int) -> int:
+    import http.client
+    c = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        c.request("POST", "/analyze", json.dumps({"text": TEXT, "chart": "none"}),
+                  {"Content-Type": "application/json"})
+        return c.getresponse().status
+    finally:
+        c.close()
+
+
+def first_response_once(timeout: float = 60.0) -> tuple[float, float]:
+    """(起動から最初の 200 までの ms, 2件目の応答 ms)"""
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn が終了しました")
+            if time.perf_counter() - t0 > timeout:
+                raise RuntimeError(f"{timeout:g} 秒以内に応答しませんでした")
+            try:
+                if _post(port) == 200:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.01)
+        ttfr = (time.perf_counter() - t0) * 1000
+        t1 = time.perf_counter()
+        _post(port)
+        return ttfr, (time.perf_counter() - t1) * 1000
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ------------------------------------------------------------------ #
+#  本体
+# ------------------------------------------------------------------ #
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--top", type=int, default=12, help="表示するモジュール数")
+    ap.add_argument("--max-import-ms", type=float, default=1500)
+    ap.add_argument("--max-ttfr-ms", type=float, default=8000)
+    ap.add_argument("--baseline", help="基準値の JSON(--save-baseline で作る)")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="基準値からの許容増加率")
+    ap.add_argument("--save-baseline", help="今回の結果を基準値として保存する")
+    args = ap.parse_args()
+
+    imports = [import_once() for _ in range(args.repeat)]
+    import_ms = statistics.median(t for t, _, _ in imports)
+    names = set().union(*(c for _, c, _ in imports))
+    per_mod = {n: statistics.median(c.get(n, 0.0) for _, c, _ in imports) for n in names}
+    heavy = sorted(set().union(*(h for _, _, h in imports)))
+
+    print(f"import api_app: {import_ms:.0f} ms (median of {args.repeat})")
+    for name, ms in sorted(per_mod.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {name:<24}{ms:>9.1f} ms")
+    print(f"heavy modules loaded at import: {', '.join(heavy) or 'none'}")
+
+    runs = [first_response_once() for _ in range(args.repeat)]
+    ttfr = statistics.median(r[0] for r in runs)
+    second = statistics.median(r[1] for r in runs)
+    print(f"time to first response: {ttfr:.0f} ms  (2nd request {second:.1f} ms, "
+          f"YABASA_WARMUP={os.environ.get('YABASA_WARMUP', '1')})")
+
+    result = {"import_ms": round(import_ms, 1), "ttfr_ms": round(ttfr, 1)}
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline saved: {args.save_baseline}")
+
+    limits = {"import_ms": args.max_import_ms, "ttfr_ms": args.max_ttfr_ms}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        for k in limits:
+            if k in base:
+                limits[k] = min(limits[k], base[k] * (1 + args.tolerance))
+    failed = [f"{k}={result[k]:.0f} > {limits[k]:.0f}" for k in limits if result[k] > limits[k]]
+    print("REGRESSION: " + ", ".join(failed) if failed else "OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+bench/concurrency_chart.py
+/analyze の同時実行試験: 多数の並列リクエストで返ったレーダーチャート PNG が、
+それぞれのスコアから単独で描いた画像と画素単位で一致することを確かめる
+(描画が混ざる・別リクエストの図が返る、といった並列時の不具合を検出する)。
+
+  python bench/concurrency_chart.py
+  python bench/concurrency_chart.py --requests 300 --concurrency 48
+  python bench/concurrency_chart.py --strict            # 図なし(混雑時のフォールバック)も失敗とする
+  YABASA_CHART_WORKERS=0 python bench/concurrency_chart.py   # 描画プロセスを使わない場合
+
+構成:
+  - アプリを uvicorn でローカルに起動する(同期エンドポイントが実際のスレッドプールで並列に動く)
+  - 結果キャッシュ・チャートキャッシュは無効にして、毎回採点・描画させる
+  - 本文は求人票によくある文言の組み合わせで、スコアの形がばらけるようにする
+出力: 件数・ステータス別件数・図あり / 図なし(chart_unavailable)・不一致件数・p50 / p99(ms)。
+不一致があれば(--strict なら図なしがあっても)終了コード 1
+"""
+
+import io
+import os
+import sys
+import time
+import socket
+import random
+import base64
+import logging
+import warnings
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("YABASA_CACHE_SIZE", "0")
+os.environ.setdefault("YABASA_CHART_CACHE_SIZE", "0")
+os.environ.setdefault("ENABLE_LOG", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+PHRASES = [
+    "固定残業45時間を含む", "未経験大歓迎", "年収300万〜1000万", "アットホームな職場です",
+    "IPOを目指して急成長中", "有給取得実績あり", "月給25万円〜", "土日祝休み", "転勤なし",
+    "評価制度なし", "育休なし", "残業代は込み", "完全週休2日制", "夢を叶える仲間募集",
+    "若手が活躍中", "社員旅行あり", "みなし残業", "シフト制", "全国転勤あり", "歩合給",
+]
+
+
+def make_texts(n: int, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    return ["。".join(rnd.sample(PHRASES, rnd.randint(1, 8))) + "。" for _ in range(n)]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pct(xs, p):
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def _raw(res: dict) -> tuple[dict, dict]:
+    """レスポンス(表示名)からカテゴリ内部名のスコア・測定可否を戻す"""
+    from rules import DISPLAY_NAME_MAP
+    inv = {v: k for k, v in DISPLAY_NAME_MAP.items()}
+    scores = {inv.get(k, k): v for k, v in res["category_scores"].items()}
+    flags = {inv.get(k, k): v for k, v in res["measured_flags"].items()}
+    return scores, flags
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=120)
+    ap.add_argument("--concurrency", type=int, default=24)
+    ap.add_argument("--strict", action="store_true", help="図なしの応答も失敗とする")
+    args = ap.parse_args()
+    logging.getLogger("matplotlib.font_manager").setLevel(logging.ERROR)
+    warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+
+    import httpx
+    import uvicorn
+    import numpy as np
+    import matplotlib.image as mpimg
+    import api_app
+    import chart
+    from chartpool import CHART_POOL
+
+    api_app.limiter.enabled = False
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(api_app.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    # 起動時に立ち上げた描画ワーカーの準備を待つ(1枚描けるまで)
+    CHART_POOL.render(chart.render_radar_png, {"x": 1}, {}, timeout=60)
+
+    texts = make_texts(args.requests)
+    url = f"http://127.0.0.1:{port}/analyze"
+
+    def call(text):
+        t0 = time.perf_counter()
+        with httpx.Client(timeout=60) as c:
+            r = c.post(url, json={"text": text, "chart": "png"})
+        return r, (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        got = list(ex.map(call, texts))
+    wall = time.perf_counter() - t0
+    server.should_exit = True
+
+    status: dict[int, int] = {}
+    with_chart = fallback = mismatch = 0
+    for r, _ in got:
+        status[r.status_code] = status.get(r.status_code, 0) + 1
+        if r.status_code != 200:
+            continue
+        res = r.json()
+        if res.get("chart_unavailable"):
+            fallback += 1
+            continue
+        with_chart += 1
+        scores, flags = _raw(res)
+        a = mpimg.imread(io.BytesIO(base64.b64decode(res["chart_png_base64"])))
+        b = mpimg.imread(io.BytesIO(chart.render_radar_png(scores, flags)))
+        if a.shape != b.shape or float(np.abs(a - b).max()) != 0.0:
+            mismatch += 1
+
+    lat = [ms for _, ms in got]
+    print(f"requests={args.requests} concurrency={args.concurrency} wall={wall:.1f}s "
+          f"chart_workers={CHART_POOL.workers} queue={CHART_POOL.queue}")
+    print(f"status={status} with_chart={with_chart} fallback={fallback} mismatch={mismatch}")
+    print(f"p50={_pct(lat, 50):.0f}ms p99={_pct(lat, 99):.0f}ms  pool={CHART_POOL.stats()}")
+    CHART_POOL.shutdown()
+    ok = mismatch == 0 and status.get(200, 0) == args.requests and not (args.strict and fallback)
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+bench/job_corpus.py
+ベンチマーク用の合成求人票(日本語)を作る。bench_scoring.py などから共通で使う。
+
+  make_posting(size, density, persona, seed) : 本文テキスト(size 文字ちょうど)
+  make_html(text, seed)                      : 求人サイトの詳細ページ風 HTML(script / JSON-LD / ナビ / フッタつき)
+  corpus(sizes, densities, personas)         : 上の組み合わせをすべて作る → [Posting, ...]
+
+  python bench/job_corpus.py --write bench/fixtures   # 保存用の HTML fixture を書き出す
+  python bench/job_corpus.py --check bench/fixtures   # 保存済み fixture と今の生成結果が一致するか
+
+  - 大きさは 1k〜80k 文字(80k は fetch_text_from_url が返す本文の上限 MAX_TEXT_CHARS)
+  - density はルールにヒットする文の割合(clean=0 / typical / dense)。ヒットする文は rules.py・
+    rules_ilora.py・rules_v48.py のルールに実際に当たる言い回し、それ以外は当たらない定型文
+  - persona=lifecycle ではライフステージ適合のルールに当たる文も混ぜる
+  - 乱数の種は (size, density, persona, seed) から決まるので、同じ引数からは常に同じ本文ができる
+"""
+
+import os
+import sys
+import random
+import argparse
+from dataclasses import dataclass
+
+SIZES = (1_000, 4_000, 16_000, 48_000, 80_000)
+DENSITIES = {"clean": 0.0, "typical": 0.06, "dense": 0.3}
+PERSONAS = ("standard", "lifecycle")
+
+# 保存する HTML fixture(大きさ, density, persona)
+FIXTURES = ((1_000, "clean", "standard"), (16_000, "typical", "standard"), (80_000, "dense", "lifecycle"))
+
+JOBS = ["法人営業", "Webエンジニア", "施工管理", "介護スタッフ", "経理", "カスタマーサポート", "店舗運営", "データアナリスト"]
+COMPANIES = ["みらい商事", "青葉システムズ", "東西建設", "さくらケアサービス", "北斗ロジスティクス", "いろは食品"]
+PLACES = ["東京都千代田区", "大阪府大阪市北区", "愛知県名古屋市中区", "福岡県福岡市博多区", "宮城県仙台市青葉区"]
+
+SECTIONS = {
+    "仕事内容": [
+        "{job}として、既存顧客へのご提案と社内関係部署との調整をお任せします。",
+        "入社後はOJTで先輩社員と業務を進め、半年を目安に担当案件を持っていただきます。",
+        "使用ツールは社内の業務システムと一般的なオフィスソフトです。",
+        "チームは5名で、週に一度の定例会議で進捗を共有しています。",
+        "お客様からのお問い合わせ対応や資料作成も担当していただきます。",
+    ],
+    "応募資格": [
+        "{job}の実務経験が2年以上ある方を歓迎します。",
+        "普通自動車免許をお持ちの方は優遇します。",
+        "基本的なPC操作ができる方。",
+    ],
+    "給与": [
+        "月給{pay}万円〜(経験・能力を考慮のうえ決定します)。",
+        "基本給{pay}万円、賞与年2回(前年度実績4.0か月分)。",
+        "通勤手当は全額支給、住宅手当は月2万円まで支給します。",
+        "残業代は1分単位で全額支給します。",
+    ],
+    "勤務時間・休日": [
+        "勤務時間は9:00〜18:00(休憩60分)です。",
+        "完全週休2日制(土日)、祝日、年末年始休暇、夏季休暇があります。",
+        "年間休日は125日です。",
+    ],
+    "勤務地": [
+        "{place}の本社オフィス。最寄り駅から徒歩5分です。",
+        "屋内は原則禁煙(喫煙室あり)です。",
+    ],
+    "福利厚生": [
+        "各種社会保険完備。",
+        "退職金制度、資格取得支援制度、社員食堂があります。",
+        "健康診断は年1回、インフルエンザ予防接種の費用補助があります。",
+    ],
+}
+
+# ルールにヒットする言い回し(カテゴリを問わず混ぜる)
+HITS = [
+    "未経験大歓迎、学歴不問です。",
+    "固定残業45時間分を含みます(超過分は別途支給)。",
+    "残業代は月給に込みとなります。",
+    "年収300万〜1000万円も可能です。",
+    "アットホームな職場で、社員は家族のような存在です。",
+    "若手活躍中!入社1年でリーダーになった先輩もいます。",
+    "ノルマ はありますが、やる気さえあれば大丈夫です。",
+    "裁量労働制を採用しています。",
+    "繁忙期は土曜日の休日出勤があります。",
+    "全国各地に拠点があり、転勤あり。",
+    "100名以上の大量募集です。",
+    "毎週飲み会があり、社員旅行やイベント多数。",
+    "平均年齢20代の若い組織です。",
+    "歩合のみの給与体系の職種もあります。",
+    "急成長フェーズ中のため、何でもやる姿勢が求められます。",
+    "月平均の残業は60時間程度です。",
+]
+
+# persona=lifecycle のときだけ混ぜる(ライフステージ適合)
+LIFECYCLE_HITS = [
+    "産休・育休の取得実績は記載なし。",
+    "正社員はフルタイム勤務が前提です。",
+    "出張が多い部署です。深夜の対応もあり。",
+    "体育会系の雰囲気で、根性のある方を求めています。",
+]
+
+
+@dataclass(frozen=True)
+class Posting:
+    size: int
+    density: str
+    persona: str
+    seed: int
+    text: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.size // 1000}k-{self.density}-{self.persona}"
+
+
+def make_posting(size: int, density: str = "typical", persona: str = "standard", seed: int = 0) -> str:
+    """size 文字の求人票本文。同じ引数なら常に同じ結果"""
+    rate = DENSITIES[density]
+    rnd = random.Random(f"{size}:{density}:{persona}:{seed}")
+    hits = HITS + (LIFECYCLE_HITS if persona == "lifecycle" else [])
+    fill = {"job": rnd.choice(JOBS), "place": rnd.choice(PLACES), "pay": rnd.randrange(22, 40)}
+
+    lines = [f"【正社員】{fill['job']}募集 / 株式会社{rnd.choice(COMPANIES)}"]
+    n = len(lines[0])
+    while n < size:
+        # 長い求人票は同じ見出しが繰り返される(複数職種・複数拠点の募集)
+        for heading, sentences in SECTIONS.items():
+            lines.append(f"■{heading}")
+            for _ in range(rnd.randint(2, 5)):
+                if rate and rnd.random() < rate:
+                    lines.append(rnd.choice(hits))
+                else:
+                    lines.append(rnd.choice(sentences).format(**fill))
+            n = sum(len(x) + 1 for x in lines)
+            if n >= size:
+                break
+    return "\n".join(lines)[:size]
+
+
+def make_html(text: str, seed: int = 0) -> str:
+    """求人サイトの詳細ページ風 HTML。本文の各行を見出し / 段落に入れ、前後に本文以外の要素を置く"""
+    rnd = random.Random(f"html:{seed}:{len(text)}")
+    title = text.split("\n", 1)[0]
+    body = []
+    for line in text.split("\n")[1:]:
+        body.append(f"<h2>{line[1:]}</h2>" if line.startswith("■") else f"<p>{line}</p>")
+    nav = "".join(f'<li><a href="/jobs/{rnd.randrange(10**6)}">{rnd.choice(JOBS)}の求人</a></li>' for _ in range(30))
+    state = ",".join(f'{{"id":{rnd.randrange(10**6)},"title":"{rnd.choice(JOBS)}","area":"{rnd.choice(PLACES)}"}}'
+                     for _ in range(40))
+    return (
+        "<!DOCTYPE html>\n<html lang=\"ja\"><head><meta charset=\"utf-8\">"
+        f"<title>{title} | 求人サイト</title>"
+        "<style>body{font-family:sans-serif}.job h2{font-size:1.2em}</style>"
+        f"<script>window.__STATE__={{\"related\":[{state}]}};</script>"
+        '<script type="application/ld+json">{"@type":"JobPosting","title":"' + title + '"}</script>'
+        f"</head><body><header><nav><ul>{nav}</ul></nav></header>"
+        f"<main><article class=\"job\"><h1>{title}</h1>\n" + "\n".join(body) + "\n</article></main>"
+        "<footer><p>&copy; 求人サイト</p><script>console.log('tracking')</script></footer></body></html>\n"
+    )
+
+
+def corpus(sizes=SIZES, densities=tuple(DENSITIES), personas=PERSONAS, seed: int = 0) -> list[Posting]:
+    return [Posting(size, d, p, seed, make_posting(size, d, p, seed))
+            for size in sizes for d in densities for p in personas]
+
+
+def fixture_name(size: int, density: str, persona: str) -> str:
+    return f"posting-{size // 1000}k-{density}-{persona}.html"
+
+
+def fixtures() -> dict[str, str]:
+    """保存用の HTML fixture: ファイル名 → HTML"""
+    return {fixture_name(s, d, p): make_html(make_posting(s, d, p), seed=i) for i, (s, d, p) in enumerate(FIXTURES)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--write", help="HTML fixture を書き出すディレクトリ")
+    ap.add_argument("--check", help="保存済み fixture と今の生成結果を比べるディレクトリ")
+    args = ap.parse_args()
+
+    if args.write:
+        os.makedirs(args.write, exist_ok=True)
+        for name, html in fixtures().items():
+            with open(os.path.join(args.write, name), "w", encoding="utf-8", newline="\n") as f:
+                f.write(html)
+            print(f"{name}: {len(html.encode('utf-8')) / 1024:.0f} KB")
+    if args.check:
+        bad = []
+        for name, html in fixtures().items():
+            path = os.path.join(args.check, name)
+            if not os.path.exists(path) or open(path, encoding="utf-8").read() != html:
+                bad.append(name)
+        print("OK" if not bad else f"MISMATCH: {', '.join(bad)}")
+        sys.exit(1 if bad else 0)
+    if not args.write and not args.check:
+        for p in corpus(densities=("typical",), personas=("standard",)):
+            print(f"{p.name}: {len(p.text)} chars  {p.text[:40]!r}")
+
+
+if __name__ == "__main__":
+    main()
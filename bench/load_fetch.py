@@ -0,0 +1,136 @@
+"""
+bench/load_fetch.py
+/ilora/concerns の負荷試験: 一部の求人サイトが遅いときに、他のリクエストの遅延(p99)が
+引きずられないことを確かめる。
+
+  python bench/load_fetch.py                     # 非同期取得(fetcher.py)
+  python bench/load_fetch.py --blocking          # 比較用: 従来の同期取得をイベントループ上で実行
+  python bench/load_fetch.py --requests 400 --concurrency 32 --slow-ratio 0.2 --slow-delay 3
+
+構成:
+  - ローカルに上流サーバを立てる。/slow/* は --slow-delay 秒待ってから、/fast/* はすぐ返す
+    (遅いサイトは "localhost"、速いサイトは "127.0.0.1" として別ホストに見せる)
+  - アプリは ASGI で直接呼ぶ(uvicorn の1ワーカー・1イベントループと同じ条件)
+  - 結果キャッシュ・URL キャッシュ・ディスクの取得キャッシュ、ホストごとの最小間隔は無効にして、毎回取得・採点させる
+出力: 種類別(遅いURL / 速いURL / テキスト直接)の件数と p50 / p95 / p99 / max(ms)
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ.setdefault("YABASA_CACHE_SIZE", "0")
+os.environ.setdefault("YABASA_URL_CACHE_SIZE", "0")
+os.environ.setdefault("ENABLE_LOG", "0")
+# 速いサイト役は1ホストで多数のサイトを代表させるので、ホストごとの最小間隔・キャッシュは外す
+os.environ.setdefault("YABASA_FETCH_MIN_INTERVAL", "0")
+os.environ.setdefault("YABASA_FETCH_CACHE_MAX_ENTRIES", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx
+
+POSTING = (
+    "<html><head><meta charset='utf-8'><title>求人</title><script>var x=1;</script></head><body>"
+    "<h1>営業スタッフ募集</h1><p>未経験大歓迎！固定残業45時間を含む。年収300万〜1000万。"
+    "アットホームな職場です。IPOを目指して急成長中。有給取得実績あり。</p>"
+    + "<p>当社は地域のお客様に製品を届けています。月給は経験により決定。</p>" * 40
+    + "</body></html>"
+).encode("utf-8")
+
+
+def _start_upstream(slow_delay: float) -> int:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/slow/"):
+                time.sleep(slow_delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(POSTING)))
+            self.end_headers()
+            self.wfile.write(POSTING)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv.server_address[1]
+
+
+def _pct(xs, p):
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+async def _run(args):
+    import api_app
+    import ilora_endpoint
+    from rules import fetch_text_from_url
+
+    api_app.limiter.enabled = False
+    if args.blocking:
+        # 従来の挙動: async ハンドラ内で requests による同期取得(イベントループを止める)
+        async def blocking_fetch(url):
+            return fetch_text_from_url(url)
+        ilora_endpoint.fetch_text_async = blocking_fetch
+
+    port = _start_upstream(args.slow_delay)
+    rnd = random.Random(1)
+    plan = []
+    for i in range(args.requests):
+        r = rnd.random()
+        if r < args.slow_ratio:
+            plan.append(("slow", {"url": f"http://localhost:{port}/slow/{i}"}))
+        elif r < args.slow_ratio + (1 - args.slow_ratio) / 2:
+            plan.append(("fast", {"url": f"http://127.0.0.1:{port}/fast/{i}"}))
+        else:
+            plan.append(("text", {"text": POSTING.decode("utf-8")[:2000] + f" #{i}"}))
+
+    lat: dict[str, list[float]] = {"slow": [], "fast": [], "text": []}
+    errors = 0
+    todo = iter(plan)
+    transport = httpx.ASGITransport(app=api_app.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+        async def worker():
+            nonlocal errors
+            for kind, body in todo:
+                t0 = time.perf_counter()
+                r = await client.post("/ilora/concerns", json=body)
+                lat[kind].append((time.perf_counter() - t0) * 1000)
+                if r.status_code != 200:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - t0
+
+    mode = "blocking(requests)" if args.blocking else "async(httpx)"
+    print(f"mode={mode} requests={args.requests} concurrency={args.concurrency} "
+          f"slow_ratio={args.slow_ratio} slow_delay={args.slow_delay}s wall={wall:.1f}s errors={errors}")
+    print(f"{'kind':<6}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for kind, xs in lat.items():
+        print(f"{kind:<6}{len(xs):>6}{_pct(xs, 50):>10.1f}{_pct(xs, 95):>10.1f}"
+              f"{_pct(xs, 99):>10.1f}{max(xs, default=0):>10.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--slow-ratio", type=float, default=0.1)
+    ap.add_argument("--slow-delay", type=float, default=2.0)
+    ap.add_argument("--blocking", action="store_true")
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+bench/redos_corpus.py
+ルールごとの最悪ケース(ReDoS)入力を作る。
+
+各ルールの必須リテラル(matcher.required_literals)を使い、
+  - プリフィルタを通過するよう、2番目以降の必須リテラルを先頭に一度だけ置く
+  - 先頭のリテラル(アンカー)を本文全体に繰り返し並べる
+  - アンカーの後ろには、マッチを完成させる語が現れないようにする
+ことで「A.*B」型のパターンが出現ごとに末尾まで走査・後戻りする入力にする。
+乱数は使わないので、同じルール・長さからは常に同じテキストができる。
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from matcher import first_literals, required_literals
+
+# マッチを完成させにくい、ルール語彙と無関係なつなぎ
+FILLER = "ああ、"
+
+
+def adversarial_text(rule, size: int) -> str:
+    """rule(CompiledRule)に対して、長さ size 程度の最悪ケース入力を返す。"""
+    anchors = first_literals(rule.pattern, rule.regex.flags)
+    clauses = required_literals(rule.pattern, rule.regex.flags)
+
+    if anchors:
+        head = min(anchors, key=len)
+    elif clauses:
+        head = min(clauses[0], key=len)
+    else:
+        head = ""
+
+    # 2番目以降の必須リテラルは、アンカーより前に一度だけ置く(後ろには置かない)
+    prefix = "".join(min(c, key=len) + FILLER for c in clauses if head not in c)
+    unit = head + FILLER
+    reps = max(1, (size - len(prefix)) // len(unit))
+    return (prefix + unit * reps)[:size]
+
+
+def corpus(rules, sizes=(1000, 4000, 16000)):
+    """{rule_id: {size: text}}"""
+    return {r.rule_id: {n: adversarial_text(r, n) for n in sizes} for r in rules}
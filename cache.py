@@ -0,0 +1,203 @@
+"""
+cache.py
+解析結果のプロセス内キャッシュ(LRU + TTL)。
+
+  RESULT_CACHE : 前処理後テキストのハッシュ + persona / mode / sector + ルールセットの
+                 fingerprint をキーにした結果
+                   - "analyze" : /analyze のレスポンス(レーダーPNGを含む)
+                   - "v48"     : score_text_v48 の戻り値(/ilora/concerns 用)
+  URL_CACHE    : 正規化した URL → 取得済み本文(ヒットすれば再取得しない)
+  CHART_CACHE  : (形式, カテゴリ, スコア列, 測定可否列) → レーダーチャートの画像(PNG / SVG のバイト列)。chart.py が使う
+
+キャッシュに無いときの取得・計算は singleflight.py で合流させる(同時に来た同じ URL・
+同じ本文のリクエストは、最初の1件の取得・採点を待って結果を共有する)。
+
+ルールを変えると RuleSet.fingerprint が変わるため、古いキーには当たらなくなる
+(古いエントリは LRU / TTL で自然に追い出される)。
+
+環境変数:
+  YABASA_CACHE_SIZE     : 結果キャッシュの最大件数(既定: 1024、0 で無効)
+  YABASA_CACHE_TTL      : 結果キャッシュの有効秒数(既定: 3600)
+  YABASA_URL_CACHE_SIZE : URL キャッシュの最大件数(既定: 256、0 で無効)
+  YABASA_URL_CACHE_TTL  : URL キャッシュの有効秒数(既定: 600)
+  YABASA_CHART_CACHE_SIZE : チャートキャッシュの最大件数(既定: 256、0 で無効)
+  YABASA_CHART_CACHE_TTL  : チャートキャッシュの有効秒数(既定: 86400)
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from rules import preprocess_text
+from mpmetrics import CACHE_EVENTS
+from singleflight import URL_FLIGHTS, RESULT_FLIGHTS, normalize_url
+
+
+class TTLCache:
+    """
+    件数上限つき LRU + TTL のスレッドセーフなキャッシュ。
+    hits / misses / evictions(件数超過)/ expirations(期限切れ)を数える。
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """ヒットすれば値、無ければ None"""
+        if self.maxsize <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                CACHE_EVENTS["misses"].inc(cache=self.name)
+                return None
+            expires, value = item
+            if expires < now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                CACHE_EVENTS["expirations"].inc(cache=self.name)
+                CACHE_EVENTS["misses"].inc(cache=self.name)
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            CACHE_EVENTS["hits"].inc(cache=self.name)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                CACHE_EVENTS["evictions"].inc(cache=self.name)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+RESULT_CACHE = TTLCache(
+    "results",
+    int(os.environ.get("YABASA_CACHE_SIZE", "1024")),
+    float(os.environ.get("YABASA_CACHE_TTL", "3600")),
+)
+URL_CACHE = TTLCache(
+    "urls",
+    int(os.environ.get("YABASA_URL_CACHE_SIZE", "256")),
+    float(os.environ.get("YABASA_URL_CACHE_TTL", "600")),
+)
+CHART_CACHE = TTLCache(
+    "charts",
+    int(os.environ.get("YABASA_CHART_CACHE_SIZE", "256")),
+    float(os.environ.get("YABASA_CHART_CACHE_TTL", "86400")),
+)
+
+
+def text_digest(text: str) -> str:
+    """前処理後テキストのハッシュ(空白・全角半角の揺れは同じキーになる)"""
+    return hashlib.sha256(preprocess_text(text or "").encode("utf-8")).hexdigest()
+
+
+def result_key(kind: str, text: str, fingerprint: str, **params) -> tuple:
+    """結果キャッシュのキー。params は persona / mode / sector など結果に影響する値。"""
+    return (kind, text_digest(text), fingerprint, tuple(sorted(params.items())))
+
+
+def cached_fetch(url: str, fetch) -> str:
+    """
+    URL キャッシュ経由で本文を取得する(取得失敗="" はキャッシュしない)。
+    同じ URL の取得が実行中ならそれに合流する(singleflight.py)。
+    """
+    key = normalize_url(url)
+    body = URL_CACHE.get(key)
+    if body is None:
+        def run():
+            got = fetch(url)
+            if got:
+                URL_CACHE.set(key, got)
+            return got
+        try:
+            body = URL_FLIGHTS.do(key, run)
+        except TimeoutError:
+            body = ""
+    return body
+
+
+async def cached_fetch_async(url: str, fetch) -> str:
+    """cached_fetch の非同期版(fetch はコルーチン関数)"""
+    key = normalize_url(url)
+    body = URL_CACHE.get(key)
+    if body is None:
+        async def run():
+            got = await fetch(url)
+            if got:
+                URL_CACHE.set(key, got)
+            return got
+        try:
+            body = await URL_FLIGHTS.do_async(key, run)
+        except TimeoutError:
+            body = ""
+    return body
+
+
+def cached_result(key: tuple, compute, cacheable=None):
+    """
+    結果キャッシュ経由で compute() の結果を得る。
+    同じキー(本文ハッシュ + パラメータ)の計算が実行中ならそれに合流する。
+    cacheable(結果) が偽なら保存しない(図を描けなかった応答など、一時的に欠けた結果)。
+    """
+    value = RESULT_CACHE.get(key)
+    if value is None:
+        def run():
+            got = compute()
+            if cacheable is None or cacheable(got):
+                RESULT_CACHE.set(key, got)
+            return got
+        value = RESULT_FLIGHTS.do(key, run)
+    return value
+
+
+async def cached_result_async(key: tuple, compute, cacheable=None):
+    """cached_result の非同期版(compute はコルーチン関数)"""
+    value = RESULT_CACHE.get(key)
+    if value is None:
+        async def run():
+            got = await compute()
+            if cacheable is None or cacheable(got):
+                RESULT_CACHE.set(key, got)
+            return got
+        value = await RESULT_FLIGHTS.do_async(key, run)
+    return value
+
+
+def all_stats() -> dict[str, dict]:
+    return {c.name: c.stats() for c in (RESULT_CACHE, URL_CACHE, CHART_CACHE)}
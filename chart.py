@@ -0,0 +1,313 @@
+"""
+chart.py
+/analyze のレーダーチャートの描画。リクエストの chart で形式を選ぶ(CHART_FORMATS)。
+
+  chart_url(scores, measured_flags)   -> /chart/{fingerprint}.png(既定。画像は GET /chart/... で配信)
+  radar_png64(scores, measured_flags) -> PNG の base64 文字列(matplotlib。レスポンスに埋め込む従来形式)
+  radar_svg(scores, measured_flags)   -> SVG 文字列(純 Python。matplotlib を読み込まない)
+  radar_data(scores, measured_flags)  -> 軸ラベルと値だけ(クライアント側で描く用)
+
+fingerprint はスコアの形そのもの(描画の版 - カテゴリ順のスコア - 測定可否)で、例えば
+"1-1520110-1110101"。どのワーカーでも(キャッシュに無くても)URL だけから同じ画像を描ける。
+画像の中身は fingerprint で決まるので、GET /chart/... は fingerprint から作る強い ETag
+(chart_etag。描かずに 304 を返せる)と長期の Cache-Control で返す
+(描画を変えたら CHART_VERSION を上げて URL・ETag ごと変える)。
+
+PNG と SVG は同じキャッシュ(cache.CHART_CACHE)に形式ごとに保存する。
+
+PNG について:
+
+  - カテゴリ数は少なく(7)スコアも 0〜5 の整数なので、同じ形のチャートが繰り返し出る。
+    (カテゴリ並び, スコア列, 測定可否列) をキーに cache.CHART_CACHE(件数上限つき LRU)へ保存する
+  - キャッシュに無いときも figure は作り直さない。カテゴリ数ごとに作っておいたテンプレート
+    (Figure + 極座標 Axes + 折れ線 + 塗り)の多角形データとラベルだけ差し替えて保存する
+  - bbox_inches='tight' の外枠計算は描画がもう一度必要で重いので、ラベル(測定可否)と
+    半径の表示範囲が同じなら前回の外枠を使い回す(出力は従来と画素単位で同じ)
+  - pyplot(グローバル状態を持ち、スレッド安全でない)は使わず Figure + Agg で描く。
+    テンプレートは1つを共有するのでロックで直列化する
+  - 描画は chartpool.CHART_POOL の専用プロセスで行う(API のスレッドで GIL を握らない)。
+    混雑・タイムアウト時は '' を返し(キャッシュしない)、呼び出し側は図なしで応答する。
+    同じ形の描画が実行中ならそれに合流する
+
+matplotlib は最初の PNG 描画時に import する(url / svg / data / none だけなら読み込まない。
+YABASA_CHART_WORKERS=0 でなければ API のプロセスでは読み込まない)。
+"""
+
+import io
+import re
+import math
+import html
+import base64
+import threading
+
+from rules import MAX_PER_CATEGORY, DISPLAY_NAME_MAP, RULES_BASE
+from cache import CHART_CACHE
+from chartpool import CHART_POOL, CHART_TIMEOUT, ChartUnavailable
+from singleflight import SingleFlight
+from reqprof import active as profiling
+
+CHART_FORMATS = ('url', 'png', 'svg', 'data', 'none')
+IMAGE_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+CHART_VERSION = '1'
+_FINGERPRINT = re.compile(r'(\w+)-(\d+)-([01]+)')
+
+DPI = 160
+FIGSIZE = (6, 6)
+UNMEASURED_SUFFIX = ' (測定不能)'
+
+
+def radar_labels(cats, measured_flags: dict) -> list[str]:
+    return [DISPLAY_NAME_MAP.get(c, c) + (UNMEASURED_SUFFIX if not measured_flags.get(c, True) else '') for c in cats]
+
+
+# ------------------------------------------------------------------ #
+#  テンプレート
+# ------------------------------------------------------------------ #
+
+class _Template:
+    """カテゴリ数 n のレーダー1枚分(データだけ差し替えて使い回す)"""
+
+    def __init__(self, n: int):
+        import matplotlib
+        matplotlib.use('Agg')
+        # 日本語フォント（無くてもエラーにしない）
+        matplotlib.rcParams['font.family'] = ['Noto Sans CJK JP', 'Noto Sans JP', 'Hiragino Sans', 'MS Gothic', 'sans-serif']
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.pad = matplotlib.rcParams['savefig.pad_inches']
+        self.ang = [i / float(n) * 2 * math.pi for i in range(n)]
+        self.ang_closed = self.ang + self.ang[:1]
+        self.fig = Figure(figsize=FIGSIZE, dpi=DPI)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(polar=True)
+        zeros = [0] * (n + 1)
+        self.line, = self.ax.plot(self.ang_closed, zeros, linewidth=2)
+        self.poly, = self.ax.fill(self.ang_closed, zeros, alpha=.25)
+        self.ax.set_xticks(self.ang)
+        self.ax.grid(True)
+        self.bboxes: dict = {}
+
+    def render(self, vals: list, labels: list[str]) -> bytes:
+        ax = self.ax
+        closed = vals + vals[:1]
+        self.line.set_data(self.ang_closed, closed)
+        self.poly.set_xy(list(zip(self.ang_closed, closed)))
+        # 半径の表示範囲は従来どおりデータから自動で決め、目盛り 0〜MAX が入るよう広げる
+        ax.relim()
+        ax.autoscale_view()
+        ax.set_yticks(range(0, MAX_PER_CATEGORY + 1))
+        ax.set_yticklabels([str(i) for i in range(0, MAX_PER_CATEGORY + 1)])
+        ax.set_xticklabels(labels, fontsize=10)
+
+        key = (tuple(labels), ax.get_ylim())
+        bbox = self.bboxes.get(key)
+        if bbox is None:
+            bbox = self.fig.get_tightbbox(self.fig.canvas.get_renderer()).padded(self.pad)
+            self.bboxes[key] = bbox
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format='png', dpi=DPI, bbox_inches=bbox)
+        return buf.getvalue()
+
+
+_templates: dict[int, _Template] = {}
+_lock = threading.Lock()
+
+# 同じ形のチャートの描画を合流させる(待ち手も描画のタイムアウトまでで諦める)
+CHART_FLIGHTS = SingleFlight("chart", timeout=CHART_TIMEOUT)
+
+
+def warm_templates():
+    """カテゴリ数 len(RULES_BASE) のテンプレートを作り、フォント探索まで済ませる(描画ワーカーの起動時)"""
+    render_radar_png({c: 0 for c in RULES_BASE}, {})
+
+
+# ------------------------------------------------------------------ #
+#  公開API
+# ------------------------------------------------------------------ #
+
+def chart_format(chart) -> str:
+    """リクエストの chart を形式名にそろえる(None → url、True → png、False → none。旧来の真偽値指定も受ける)"""
+    if chart is None:
+        return 'url'
+    if chart is True:
+        return 'png'
+    if chart is False:
+        return 'none'
+    if chart not in CHART_FORMATS:
+        raise ValueError(f"chart は {' / '.join(CHART_FORMATS)} のいずれかを指定してください: {chart!r}")
+    return chart
+
+
+def chart_key(scores: dict, measured_flags: dict) -> tuple:
+    """チャートの見た目を決める値だけのキー"""
+    cats = tuple(scores.keys())
+    return (cats, tuple(scores[c] for c in cats), tuple(bool(measured_flags.get(c, True)) for c in cats))
+
+
+def render_radar_png(scores: dict, measured_flags: dict) -> bytes:
+    """レーダーチャートの PNG(キャッシュを使わない)"""
+    cats = list(scores.keys())
+    if not cats:
+        return b''
+    vals = [scores[c] for c in cats]
+    labels = radar_labels(cats, measured_flags)
+    with _lock:
+        tpl = _templates.get(len(cats))
+        if tpl is None:
+            tpl = _templates[len(cats)] = _Template(len(cats))
+        return tpl.render(vals, labels)
+
+
+def chart_fingerprint(scores: dict, measured_flags: dict) -> str | None:
+    """スコアの形を URL に使える文字列に(カテゴリが標準の並びでなければ None)"""
+    if list(scores) != list(RULES_BASE) or any(not 0 <= scores[c] <= 9 for c in scores):
+        return None
+    return '-'.join((
+        CHART_VERSION,
+        ''.join(str(int(scores[c])) for c in scores),
+        ''.join('1' if measured_flags.get(c, True) else '0' for c in scores),
+    ))
+
+
+def parse_fingerprint(fingerprint: str) -> tuple[dict, dict]:
+    """chart_fingerprint の逆。形が合わなければ ValueError"""
+    m = _FINGERPRINT.fullmatch(fingerprint or '')
+    cats = list(RULES_BASE)
+    if (not m or m.group(1) != CHART_VERSION or len(m.group(2)) != len(cats) or len(m.group(3)) != len(cats)
+            or any(int(d) > MAX_PER_CATEGORY for d in m.group(2))):
+        raise ValueError(f'チャートの指定が正しくありません: {fingerprint!r}')
+    scores = {c: int(d) for c, d in zip(cats, m.group(2))}
+    flags = {c: f == '1' for c, f in zip(cats, m.group(3))}
+    return scores, flags
+
+
+def chart_url(scores: dict, measured_flags: dict, fmt: str = 'png') -> str:
+    """GET /chart/{fingerprint}.{fmt} の URL(カテゴリが標準の並びでなければ '')"""
+    fp = chart_fingerprint(scores, measured_flags)
+    return f'/chart/{fp}.{fmt}' if fp else ''
+
+
+def chart_etag(fingerprint: str, fmt: str) -> str:
+    """GET /chart/{fingerprint}.{fmt} の強い ETag(中身は fingerprint と形式で決まる)"""
+    return f'"{fingerprint}.{fmt}"'
+
+
+def chart_image(fmt: str, scores: dict, measured_flags: dict) -> bytes:
+    """
+    png / svg の本体。同じ形なら CHART_CACHE から返す。
+    PNG は描画プロセスで描き、同じ形の描画が実行中なら合流する。
+    混雑・タイムアウトで描けなければ ChartUnavailable(遅れて描き終わった分はキャッシュに入る)
+    計測中のリクエスト(reqprof.py)はキャッシュも描画プロセスも使わず、このスレッドで描く
+    """
+    if profiling():
+        if fmt == 'svg':
+            return render_radar_svg(scores, measured_flags).encode('utf-8')
+        return render_radar_png(scores, measured_flags)
+    key = (fmt,) + chart_key(scores, measured_flags)
+    body = CHART_CACHE.get(key)
+    if body is None:
+        if fmt == 'svg':
+            body = render_radar_svg(scores, measured_flags).encode('utf-8')
+            CHART_CACHE.set(key, body)
+            return body
+        store = lambda png: CHART_CACHE.set(key, png)
+        try:
+            body = CHART_FLIGHTS.do(key, lambda: CHART_POOL.render(
+                render_radar_png, dict(scores), dict(measured_flags), on_result=store))
+        except TimeoutError as e:
+            raise ChartUnavailable(str(e)) from None
+    return body
+
+
+def radar_png64(scores: dict, measured_flags: dict) -> str:
+    """レーダーチャートの PNG を base64 で。混雑・タイムアウトで描けなかったときは ''"""
+    if not scores:
+        return ''
+    try:
+        png = chart_image('png', scores, measured_flags)
+    except ChartUnavailable as e:
+        print(f"[CHART] 図なしで返します: {e}")
+        return ''
+    return base64.b64encode(png).decode('ascii')
+
+
+def radar_data(scores: dict, measured_flags: dict) -> dict:
+    """クライアント側で描くための軸ラベル・値・測定可否"""
+    cats = list(scores.keys())
+    return {
+        'labels': [DISPLAY_NAME_MAP.get(c, c) for c in cats],
+        'values': [scores[c] for c in cats],
+        'measured': [bool(measured_flags.get(c, True)) for c in cats],
+        'max': MAX_PER_CATEGORY,
+    }
+
+
+# ------------------------------------------------------------------ #
+#  SVG(純 Python)
+# ------------------------------------------------------------------ #
+
+SVG_W, SVG_H = 640, 540
+SVG_R = 180
+SVG_FONT = "'Noto Sans CJK JP','Noto Sans JP','Hiragino Sans','MS Gothic',sans-serif"
+SVG_COLOR = '#1f77b4'
+
+
+def _f(x: float) -> str:
+    return f'{x:.1f}'.rstrip('0').rstrip('.')
+
+
+def render_radar_svg(scores: dict, measured_flags: dict) -> str:
+    """PNG と同じ配置(0度が右、反時計回り、目盛り 0〜MAX)の SVG(キャッシュを使わない)"""
+    cats = list(scores.keys())
+    if not cats:
+        return ''
+    n = len(cats)
+    vals = [scores[c] for c in cats]
+    labels = radar_labels(cats, measured_flags)
+    rmax = max([MAX_PER_CATEGORY] + vals) or 1
+    cx, cy = SVG_W / 2, SVG_H / 2
+    ang = [i / float(n) * 2 * math.pi for i in range(n)]
+
+    def pt(a: float, r: float) -> tuple[float, float]:
+        return cx + r * math.cos(a), cy - r * math.sin(a)
+
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {SVG_W} {SVG_H}" '
+        f'width="{SVG_W}" height="{SVG_H}" font-family="{html.escape(SVG_FONT)}" font-size="13">',
+        f'<rect width="{SVG_W}" height="{SVG_H}" fill="#fff"/>',
+        '<g fill="none" stroke="#b0b0b0" stroke-width="0.8">',
+    ]
+    for k in range(1, MAX_PER_CATEGORY + 1):
+        out.append(f'<circle cx="{_f(cx)}" cy="{_f(cy)}" r="{_f(SVG_R * k / rmax)}"/>')
+    for a in ang:
+        x, y = pt(a, SVG_R)
+        out.append(f'<line x1="{_f(cx)}" y1="{_f(cy)}" x2="{_f(x)}" y2="{_f(y)}"/>')
+    out.append('</g>')
+    out.append(f'<circle cx="{_f(cx)}" cy="{_f(cy)}" r="{SVG_R}" fill="none" stroke="#000" stroke-width="1"/>')
+
+    # 目盛りの数字(PNG と同じく 22.5 度の位置)
+    ra = math.radians(22.5)
+    for k in range(0, MAX_PER_CATEGORY + 1):
+        x, y = pt(ra, SVG_R * k / rmax)
+        out.append(f'<text x="{_f(x)}" y="{_f(y)}" text-anchor="middle" dominant-baseline="middle">{k}</text>')
+
+    poly = ' '.join(f'{_f(x)},{_f(y)}' for x, y in (pt(a, SVG_R * v / rmax) for a, v in zip(ang, vals)))
+    out.append(f'<polygon points="{poly}" fill="{SVG_COLOR}" fill-opacity="0.25" '
+               f'stroke="{SVG_COLOR}" stroke-width="2" stroke-linejoin="round"/>')
+
+    for a, label in zip(ang, labels):
+        x, y = pt(a, SVG_R + 14)
+        c = math.cos(a)
+        anchor = 'start' if c > 0.1 else 'end' if c < -0.1 else 'middle'
+        out.append(f'<text x="{_f(x)}" y="{_f(y)}" text-anchor="{anchor}" dominant-baseline="middle">'
+                   f'{html.escape(label)}</text>')
+    out.append('</svg>')
+    return ''.join(out)
+
+
+def radar_svg(scores: dict, measured_flags: dict) -> str:
+    """レーダーチャートの SVG(同じ形なら CHART_CACHE から返す)"""
+    if not scores:
+        return ''
+    return chart_image('svg', scores, measured_flags).decode('utf-8')
@@ -0,0 +1,178 @@
+"""
+chartpool.py
+レーダーチャート PNG を描く専用のプロセスプール。chart.chart_image がキャッシュに無いときに使う。
+
+  - matplotlib の描画は GIL を握ったまま重い処理をするため、API ワーカーのスレッドではなく
+    別プロセス(spawn)で描く。各ワーカーは起動時に matplotlib の読み込みとテンプレート生成を済ませる
+  - 受け付ける描画は CHART_QUEUE 件まで(実行中 + 待ち)。超えた分は待たずに ChartUnavailable
+  - CHART_TIMEOUT 秒で描けなければ ChartUnavailable(描画そのものは続け、終われば on_result で
+    結果を受け取れる。chart.py はそれをキャッシュに入れ、次のリクエストで使う)
+  - ワーカーが落ちた(BrokenProcessPool)らプールを作り直す
+  - YABASA_CHART_WORKERS=0 ならプロセスプールを使わず呼び出し元のスレッドで描く(開発・テスト用)
+
+ChartUnavailable のとき /analyze(chart=png)は図なし(chart_png_base64="" と chart_unavailable=true)、
+GET /chart/... は 503 で返す。
+
+  png = CHART_POOL.render(fn, scores, flags, on_result=store)   # ChartUnavailable を送出しうる
+
+ワーカーは spawn で起動するため、スクリプトから使うときは if __name__ == "__main__": の中で呼ぶこと。
+
+環境変数:
+  YABASA_CHART_WORKERS : 描画プロセス数(既定: min(2, CPU コア数)。0 で呼び出し元のスレッドで描く)
+  YABASA_CHART_QUEUE   : 同時に受け付ける描画の上限(実行中 + 待ち。既定: ワーカー数 × 8)
+  YABASA_CHART_TIMEOUT : 1枚を待つ上限秒(既定: 5)
+"""
+
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+CHART_WORKERS = int(os.environ.get("YABASA_CHART_WORKERS", str(min(2, os.cpu_count() or 1))))
+CHART_QUEUE = int(os.environ.get("YABASA_CHART_QUEUE", "0")) or max(1, CHART_WORKERS) * 8
+CHART_TIMEOUT = float(os.environ.get("YABASA_CHART_TIMEOUT", "5"))
+
+
+class ChartUnavailable(Exception):
+    """混雑・タイムアウト・ワーカー異常で図を描けなかった"""
+
+
+def _warmup():
+    # ワーカー起動時に matplotlib の読み込み・フォント探索・テンプレート生成を済ませる
+    import logging
+    import warnings
+    logging.getLogger("matplotlib.font_manager").setLevel(logging.ERROR)
+    warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+    from chart import warm_templates
+    warm_templates()
+
+
+class RenderPool:
+    def __init__(self, workers: int = CHART_WORKERS, queue: int = CHART_QUEUE, timeout: float = CHART_TIMEOUT):
+        self.workers = workers
+        self.queue = max(1, queue)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pool: ProcessPoolExecutor | None = None
+        self.pending = 0
+        self.rendered = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    # ---- プール(遅延生成・使い回し) ---- #
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # API サーバ(スレッドあり)から fork すると危険なので spawn で起動する
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warmup,
+                )
+            return self._pool
+
+    def _reset(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """ワーカーを先に起動しておく(起動直後の数リクエストがタイムアウトしないように)"""
+        if self.workers > 0:
+            pool = self._get_pool()
+            for _ in range(self.workers):
+                pool.submit(_warmup)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # ---- 描画 ---- #
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.queue:
+                self.rejected += 1
+                raise ChartUnavailable(f"描画待ちが上限({self.queue} 件)に達しています")
+            self.pending += 1
+
+    def _done(self, fut, on_result):
+        with self._lock:
+            self.pending -= 1
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        with self._lock:
+            self.rendered += 1
+        if on_result is not None:
+            on_result(fut.result())
+
+    def render(self, fn, *args, timeout: float | None = None, on_result=None):
+        """
+        fn(*args) をワーカーで実行して結果を返す(fn・引数・結果は pickle できること)。
+        on_result は成功時に結果を渡して呼ぶ(タイムアウトで呼び出し元が諦めた後に終わった場合も)。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self._acquire()
+        if self.workers <= 0:
+            try:
+                value = fn(*args)
+            except Exception as e:
+                with self._lock:
+                    self.pending -= 1
+                    self.errors += 1
+                raise ChartUnavailable(f"描画に失敗しました: {e}") from e
+            with self._lock:
+                self.pending -= 1
+                self.rendered += 1
+            if on_result is not None:
+                on_result(value)
+            return value
+
+        pool = self._get_pool()
+        try:
+            fut = pool.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError) as e:
+            with self._lock:
+                self.pending -= 1
+                self.errors += 1
+            self._reset(pool)
+            raise ChartUnavailable(f"描画ワーカーを使えません: {e}") from e
+        fut.add_done_callback(lambda f: self._done(f, on_result))
+        try:
+            return fut.result(timeout)
+        except FutureTimeout:
+            fut.cancel()  # 待ち行列にあるだけなら取り消す(実行中なら最後まで描く)
+            with self._lock:
+                self.timeouts += 1
+            raise ChartUnavailable(f"描画が {timeout:g} 秒以内に終わりませんでした") from None
+        except BrokenProcessPool as e:
+            with self._lock:
+                self.errors += 1
+            self._reset(pool)
+            raise ChartUnavailable(f"描画ワーカーが停止しました: {e}") from e
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            raise ChartUnavailable(f"描画に失敗しました: {e}") from e
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue": self.queue,
+            "pending": self.pending,
+            "rendered": self.rendered,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+
+CHART_POOL = RenderPool()
+atexit.register(CHART_POOL.shutdown)
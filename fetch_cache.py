@@ -0,0 +1,205 @@
+"""
+fetch_cache.py
+URL 取得結果のディスクキャッシュ(条件付き GET 用)。
+
+1 URL につき1ファイル({YABASA_DATA_DIR}/fetch_cache/<sha256(url)>.json)に、
+抽出・前処理済みの本文と検証子(ETag / Last-Modified)、取得時刻を保存する。
+
+  - 取得から FETCH_CACHE_FRESH 秒以内 → 通信せずに保存済み本文を使う
+  - それより古い → If-None-Match / If-Modified-Since 付きで取得し、304 なら保存済み本文を使う
+  - 200 なら本文を抽出し直して上書き保存
+
+書き込みは一時ファイル + os.replace で行うため、複数ワーカーが同じディレクトリを共有してよい。
+件数・合計サイズの上限を超えたら、最後に使われた時刻(mtime)の古いものから削除する
+(上限の確認は FETCH_CACHE_EVICT_EVERY 回の保存ごと。一時的に少し超えることはある)。
+
+rules.fetch_text_from_url(同期)と fetcher.fetch_text_async(非同期)の両方から使う。
+ここではネットワークにも rules にも依存しない(保存と検証子の管理だけ)。
+
+環境変数:
+  YABASA_DATA_DIR                : データ保存先(既定: data)
+  YABASA_FETCH_CACHE_DIR         : キャッシュの置き場所(既定: {YABASA_DATA_DIR}/fetch_cache)
+  YABASA_FETCH_CACHE_FRESH       : 再検証せずに使う秒数(既定: 300、0 で毎回再検証)
+  YABASA_FETCH_CACHE_MAX_ENTRIES : 最大件数(既定: 5000、0 でキャッシュ無効)
+  YABASA_FETCH_CACHE_MAX_MB      : 合計サイズの上限 MB(既定: 200)
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from email.utils import formatdate
+
+DATA_DIR = Path(os.environ.get("YABASA_DATA_DIR", "data"))
+FETCH_CACHE_DIR = Path(os.environ.get("YABASA_FETCH_CACHE_DIR", str(DATA_DIR / "fetch_cache")))
+FETCH_CACHE_FRESH = float(os.environ.get("YABASA_FETCH_CACHE_FRESH", "300"))
+FETCH_CACHE_MAX_ENTRIES = int(os.environ.get("YABASA_FETCH_CACHE_MAX_ENTRIES", "5000"))
+FETCH_CACHE_MAX_BYTES = int(float(os.environ.get("YABASA_FETCH_CACHE_MAX_MB", "200")) * 1024 * 1024)
+FETCH_CACHE_EVICT_EVERY = 16
+
+
+class FetchCache:
+    """
+    URL → {url, text, etag, last_modified, fetched_at} のディスクキャッシュ。
+    hits(新鮮で通信なし)/ revalidated(304)/ misses / stores / evictions を数える。
+    """
+
+    def __init__(self, root: Path, fresh: float, max_entries: int, max_bytes: int):
+        self.root = Path(root)
+        self.fresh = fresh
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _path(self, url: str) -> Path:
+        return self.root / (hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    # ---- 参照 ---- #
+
+    def get(self, url: str) -> dict | None:
+        """保存済みエントリ(無ければ None)。読んだら mtime を更新して LRU の順番に反映する"""
+        if not self.enabled:
+            return None
+        path = self._path(url)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url:
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry.get("fetched_at", 0) < self.fresh
+
+    @staticmethod
+    def conditional_headers(entry: dict | None) -> dict:
+        """再検証用のリクエストヘッダ"""
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            elif not entry.get("etag") and entry.get("fetched_at"):
+                # 検証子が無いサーバでも取得時刻で条件付きにしておく(無視されれば 200 が返るだけ)
+                headers["If-Modified-Since"] = formatdate(entry["fetched_at"], usegmt=True)
+        return headers
+
+    def lookup(self, url: str) -> tuple[str | None, dict | None]:
+        """
+        取得前に呼ぶ。戻り値: (そのまま使える本文 or None, 再検証に使うエントリ or None)
+        本文が返ったら通信は不要。
+        """
+        entry = self.get(url)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+        if self.is_fresh(entry):
+            with self._lock:
+                self.hits += 1
+            return entry["text"], entry
+        return None, entry
+
+    # ---- 更新 ---- #
+
+    def not_modified(self, url: str, entry: dict, etag: str | None = None,
+                     last_modified: str | None = None) -> str:
+        """304 を受けたとき。取得時刻(と新しい検証子)を更新して保存済み本文を返す"""
+        with self._lock:
+            self.revalidated += 1
+        entry = dict(entry, fetched_at=time.time())
+        if etag:
+            entry["etag"] = etag
+        if last_modified:
+            entry["last_modified"] = last_modified
+        self._write(url, entry)
+        return entry["text"]
+
+    def put(self, url: str, text: str, etag: str | None = None, last_modified: str | None = None):
+        """200 で取得・抽出した本文を保存する(空の本文は保存しない)"""
+        if not self.enabled or not text:
+            return
+        self._write(url, {
+            "url": url,
+            "text": text,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+        })
+        with self._lock:
+            self.stores += 1
+            self._puts += 1
+            due = self._puts % FETCH_CACHE_EVICT_EVERY == 1
+        if due:
+            self.evict()
+
+    def _write(self, url: str, entry: dict):
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            path = self._path(url)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[FETCH_CACHE] 保存に失敗しました: {e}")
+
+    def evict(self) -> int:
+        """件数・合計サイズの上限を超えた分を、使われていない順に削除する。削除件数を返す"""
+        try:
+            files = []
+            for de in os.scandir(self.root):
+                if de.name.endswith(".json"):
+                    st = de.stat()
+                    files.append((st.st_mtime, st.st_size, de.path))
+        except OSError:
+            return 0
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        removed = 0
+        while files and (len(files) > self.max_entries or total > self.max_bytes):
+            _, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            with self._lock:
+                self.evictions += removed
+        return removed
+
+    def clear(self):
+        try:
+            for de in os.scandir(self.root):
+                if de.name.endswith(".json"):
+                    os.remove(de.path)
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+FETCH_CACHE = FetchCache(FETCH_CACHE_DIR, FETCH_CACHE_FRESH, FETCH_CACHE_MAX_ENTRIES, FETCH_CACHE_MAX_BYTES)
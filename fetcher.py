@@ -0,0 +1,141 @@
+"""
+fetcher.py
+求人票 URL の非同期取得(httpx.AsyncClient を共有するコネクションプール)。
+
+rules.fetch_text_from_url(requests による同期取得)は async なエンドポイントから呼ぶと
+イベントループを最大 timeout 秒止めてしまうため、非同期エンドポイントはこちらを使う。
+
+  - keep-alive 付きの AsyncClient をプロセス内で共有(イベントループごとに1つ)
+  - ホストごとの同時接続数・間隔・サーキットブレーカーは hostsched.py(同期の取得と共通)
+  - レスポンス本体は上限バイト数まで読んで打ち切る(巨大ページでメモリを使い切らない)
+  - HTML → 本文の抽出(htmltext.py)は CPU を使うのでワーカースレッドで行う
+  - 取得結果は fetch_cache.py のディスクキャッシュに保存し、次回は条件付き GET で再検証する
+
+失敗時は rules.fetch_text_from_url と同じく "" を返す。
+
+環境変数:
+  YABASA_FETCH_TIMEOUT        : 全体のタイムアウト秒(既定: 20)
+  YABASA_FETCH_MAX_BYTES      : 読み込む本体の上限バイト数(既定: 2MB。htmltext.py で定義)
+  YABASA_FETCH_MAX_CONNS      : プール全体の最大接続数(既定: 100)
+"""
+
+import os
+import asyncio
+from typing import NamedTuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from rules import stream_to_text
+from htmltext import FETCH_MAX_BYTES
+from fetch_cache import FETCH_CACHE
+from hostsched import HOST_SCHEDULER
+
+FETCH_TIMEOUT = float(os.environ.get("YABASA_FETCH_TIMEOUT", "20"))
+FETCH_MAX_CONNS = int(os.environ.get("YABASA_FETCH_MAX_CONNS", "100"))
+
+USER_AGENT = "Mozilla/5.0"
+
+
+# ------------------------------------------------------------------ #
+#  共有クライアント
+# ------------------------------------------------------------------ #
+
+class _LoopState:
+    """イベントループに紐づく資源(AsyncClient)"""
+
+    def __init__(self, loop):
+        import httpx
+        self.loop = loop
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=httpx.Timeout(FETCH_TIMEOUT, connect=min(5.0, FETCH_TIMEOUT)),
+            limits=httpx.Limits(
+                max_connections=FETCH_MAX_CONNS,
+                max_keepalive_connections=max(1, FETCH_MAX_CONNS // 5),
+            ),
+            follow_redirects=True,
+        )
+
+
+_state: _LoopState | None = None
+
+
+def _get_state() -> _LoopState:
+    global _state
+    loop = asyncio.get_running_loop()
+    if _state is None or _state.loop is not loop:
+        # ループが変わった(テスト等)ときは作り直す。古いクライアントはそのループと共に破棄される
+        _state = _LoopState(loop)
+    return _state
+
+
+async def aclose():
+    """アプリ終了時に呼ぶ(keep-alive 接続を閉じる)"""
+    global _state
+    if _state is not None and _state.loop is asyncio.get_running_loop():
+        await _state.client.aclose()
+    _state = None
+
+
+# ------------------------------------------------------------------ #
+#  取得
+# ------------------------------------------------------------------ #
+
+def _to_text(raw: bytes, charset: str | None) -> str:
+    # 本文が十分集まった時点で残りの HTML は解析しない(htmltext.py)
+    return stream_to_text((raw,), charset)
+
+
+class FetchResult(NamedTuple):
+    status: int
+    body: bytes
+    charset: str | None
+    etag: str | None
+    last_modified: str | None
+
+
+async def fetch_html(url: str, headers: dict | None = None) -> FetchResult:
+    """
+    URL の本体を最大 FETCH_MAX_BYTES まで読む。304(条件付き GET)は本体なしで返す。
+    それ以外の HTTP エラー・接続エラーは例外のまま送出する。
+    """
+    st = _get_state()
+    # ホストごとの同時数・間隔・ブレーカー(hostsched.py)。open 中は FetchRejected で即失敗
+    async with HOST_SCHEDULER.aslot(url) as slot:
+        async with st.client.stream("GET", url, headers=headers) as r:
+            slot.status = r.status_code
+            meta = (r.headers.get("ETag"), r.headers.get("Last-Modified"))
+            if r.status_code == 304:
+                return FetchResult(304, b"", None, *meta)
+            r.raise_for_status()
+            chunks = []
+            size = 0
+            async for chunk in r.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= FETCH_MAX_BYTES:
+                    break
+            return FetchResult(r.status_code, b"".join(chunks)[:FETCH_MAX_BYTES], r.charset_encoding, *meta)
+
+
+def _extract_and_store(url: str, res: FetchResult) -> str:
+    text = _to_text(res.body, res.charset)
+    FETCH_CACHE.put(url, text, res.etag, res.last_modified)
+    return text
+
+
+async def fetch_text_async(url: str) -> str:
+    """rules.fetch_text_from_url の非同期版(失敗時は ""、ディスクの取得キャッシュも同じものを使う)"""
+    try:
+        # キャッシュファイルの読み書き・本文抽出はワーカースレッドで行う
+        text, entry = await run_in_threadpool(FETCH_CACHE.lookup, url)
+        if text is not None:
+            return text
+        res = await fetch_html(url, FETCH_CACHE.conditional_headers(entry))
+        if res.status == 304 and entry:
+            return await run_in_threadpool(FETCH_CACHE.not_modified, url, entry, res.etag, res.last_modified)
+        if res.status == 304:
+            return ""
+        return await run_in_threadpool(_extract_and_store, url, res)
+    except Exception:
+        return ""
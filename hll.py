@@ -0,0 +1,60 @@
+"""
+hll.py
+HyperLogLog(ユニーク数の推定)。レジスタ 2^p 個(各1バイト)の固定サイズで、件数によらず
+add は O(1)、マージはレジスタごとの max。p=12 で 4KB、誤差は標準誤差でおよそ 1.6%。
+
+  h = HyperLogLog()
+  h.add("visitor-id")
+  h.merge(HyperLogLog.from_bytes(blob))
+  round(h.count())
+"""
+
+import math
+import hashlib
+
+DEFAULT_P = 12
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    __slots__ = ("p", "m", "registers")
+
+    def __init__(self, p: int = DEFAULT_P, registers: bytes | None = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f"レジスタ数が p={p} と合いません: {len(self.registers)}")
+
+    @classmethod
+    def from_bytes(cls, blob: bytes, p: int = DEFAULT_P) -> "HyperLogLog":
+        return cls(p, blob)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    def add(self, value: str):
+        h = _hash64(value)
+        idx = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if other.p != self.p:
+            raise ValueError("p の違う HyperLogLog はマージできません")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> float:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        est = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5 * m and zeros:
+            # 少数のときは線形カウンティング
+            return m * math.log(m / zeros)
+        return est
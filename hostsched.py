@@ -0,0 +1,330 @@
+"""
+hostsched.py
+求人サイト(ホスト)ごとの取得スケジューラ。rules.fetch_text_from_url(同期)と
+fetcher.fetch_html(非同期)の両方がここを通ってから接続する。
+
+  - 同時接続数の上限(ホストごと)。空きが無ければ到着順に待つ
+  - リクエスト開始の最小間隔(ホストごと。大手サイトに連打しない)
+  - サーキットブレーカー: 連続 BREAKER_FAILURES 回の失敗(接続エラー・タイムアウト・5xx・429)で
+    open にし、BREAKER_COOLDOWN 秒は取得せずに即失敗させる。経過後は half_open で1件だけ試し、
+    成功すれば closed に戻す(失敗すれば再び open)
+  - open 中の URL は fetch_failure_detail() が「本文を貼り付けてください」の案内を返す
+
+  with HOST_SCHEDULER.slot(url) as h:        # 同期
+      r = requests.get(...); h.status = r.status_code
+  async with HOST_SCHEDULER.aslot(url) as h: # 非同期
+      ...
+
+例外: HostUnavailable(open 中)/ HostBusy(空き待ちが FETCH_QUEUE_TIMEOUT 秒を超えた)。
+どちらも FetchRejected のサブクラス。
+
+環境変数:
+  YABASA_FETCH_PER_HOST      : ホストあたりの同時リクエスト数(既定: 4)
+  YABASA_FETCH_MIN_INTERVAL  : 同じホストへのリクエスト開始の最小間隔秒(既定: 0.2)
+  YABASA_FETCH_QUEUE_TIMEOUT : 空き待ちの上限秒(既定: 10)
+  YABASA_BREAKER_FAILURES    : open にする連続失敗回数(既定: 5)
+  YABASA_BREAKER_COOLDOWN    : open を続ける秒数(既定: 60)
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+FETCH_PER_HOST = int(os.environ.get("YABASA_FETCH_PER_HOST", "4"))
+FETCH_MIN_INTERVAL = float(os.environ.get("YABASA_FETCH_MIN_INTERVAL", "0.2"))
+FETCH_QUEUE_TIMEOUT = float(os.environ.get("YABASA_FETCH_QUEUE_TIMEOUT", "10"))
+BREAKER_FAILURES = int(os.environ.get("YABASA_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("YABASA_BREAKER_COOLDOWN", "60"))
+MAX_TRACKED_HOSTS = 1000
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class FetchRejected(Exception):
+    """スケジューラが取得を行わなかった"""
+
+
+class HostUnavailable(FetchRejected):
+    """サーキットブレーカーが open(そのホストへの取得を一時停止中)"""
+
+
+class HostBusy(FetchRejected):
+    """同時接続数の空き待ちがタイムアウトした"""
+
+
+def host_of(url: str) -> str:
+    try:
+        return (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+def is_failure_status(status: int | None) -> bool:
+    """ブレーカーが数える HTTP ステータス(ホスト側の不調・制限)。404 等はホストの問題としない"""
+    return status is not None and (status >= 500 or status == 429)
+
+
+class _HostState:
+    __slots__ = ("host", "inflight", "next_start", "waiters", "state", "failures",
+                 "opened_at", "trial", "requests", "errors", "rejected", "opens", "last_used")
+
+    def __init__(self, host: str):
+        self.host = host
+        self.inflight = 0
+        self.next_start = 0.0
+        self.waiters: deque = deque()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.opens = 0
+        self.last_used = 0.0
+
+
+class _Slot:
+    """
+    slot() / aslot() が返す。応答を受け取ったら HTTP ステータスを status に入れる。
+    成否は status があればそれで判定し(5xx・429 が失敗)、無ければ例外の有無で判定する
+    (応答後の 404 の raise_for_status や本文抽出の失敗はホストの不調に数えない)。
+    """
+    __slots__ = ("host", "status")
+
+    def __init__(self, host: str):
+        self.host = host
+        self.status: int | None = None
+
+    def outcome(self, exc_type) -> bool | None:
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            return None
+        if self.status is not None:
+            return not is_failure_status(self.status)
+        return exc_type is None
+
+
+class HostScheduler:
+    def __init__(self, per_host: int = FETCH_PER_HOST, min_interval: float = FETCH_MIN_INTERVAL,
+                 queue_timeout: float = FETCH_QUEUE_TIMEOUT, failures: int = BREAKER_FAILURES,
+                 cooldown: float = BREAKER_COOLDOWN):
+        self.per_host = max(1, per_host)
+        self.min_interval = min_interval
+        self.queue_timeout = queue_timeout
+        self.max_failures = max(1, failures)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._hosts: dict[str, _HostState] = {}
+
+    # ---- 状態 ---- #
+
+    def _state(self, host: str) -> _HostState:
+        st = self._hosts.get(host)
+        if st is None:
+            if len(self._hosts) >= MAX_TRACKED_HOSTS:
+                self._prune()
+            st = self._hosts[host] = _HostState(host)
+        return st
+
+    def _prune(self):
+        # 使われていない closed のホストから古い順に半分捨てる
+        idle = sorted(
+            (st for st in self._hosts.values()
+             if st.state == CLOSED and not st.inflight and not st.waiters),
+            key=lambda st: st.last_used,
+        )
+        for st in idle[:max(1, len(idle) // 2)]:
+            del self._hosts[st.host]
+
+    def _check_breaker(self, st: _HostState, now: float):
+        if st.state == OPEN:
+            if now - st.opened_at < self.cooldown:
+                st.rejected += 1
+                raise HostUnavailable(st.host)
+            st.state = HALF_OPEN
+            st.trial = False
+        if st.state == HALF_OPEN and st.trial:
+            # 試行中の1件が終わるまで他は通さない
+            st.rejected += 1
+            raise HostUnavailable(st.host)
+
+    def _try_acquire(self, st: _HostState) -> float | None:
+        """枠を取れたら開始までの待ち秒、取れなければ None(ロック内で呼ぶ)"""
+        now = time.monotonic()
+        self._check_breaker(st, now)
+        if st.inflight >= self.per_host:
+            return None
+        st.inflight += 1
+        st.requests += 1
+        st.last_used = now
+        if st.state == HALF_OPEN:
+            st.trial = True
+        start = max(now, st.next_start)
+        st.next_start = start + self.min_interval
+        return start - now
+
+    def _wake_one(self, st: _HostState):
+        while st.waiters:
+            w = st.waiters.popleft()
+            if isinstance(w, threading.Event):
+                w.set()
+                return
+            loop, fut = w
+            if not fut.done():
+                loop.call_soon_threadsafe(_resolve, fut)
+                return
+
+    def _release(self, st: _HostState, ok: bool | None):
+        """ok=None は成否を数えない(呼び出し側の取り消し)"""
+        with self._lock:
+            st.inflight -= 1
+            if ok is None:
+                pass
+            elif ok:
+                st.failures = 0
+                st.state = CLOSED
+            else:
+                st.errors += 1
+                st.failures += 1
+                if st.state == HALF_OPEN or st.failures >= self.max_failures:
+                    if st.state != OPEN:
+                        print(f"[FETCH] {st.host} への取得を {self.cooldown:g} 秒停止します(連続失敗 {st.failures} 回)")
+                        st.opens += 1
+                    st.state = OPEN
+                    st.opened_at = time.monotonic()
+            st.trial = False
+            if st.state == OPEN:
+                # 待っている分もすぐ失敗させる
+                while st.waiters:
+                    self._wake_one(st)
+            else:
+                self._wake_one(st)
+
+    # ---- 同期 ---- #
+
+    def _acquire(self, host: str) -> _HostState:
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            with self._lock:
+                st = self._state(host)
+                delay = self._try_acquire(st)
+                if delay is None:
+                    ev = threading.Event()
+                    st.waiters.append(ev)
+            if delay is not None:
+                if delay > 0:
+                    time.sleep(delay)
+                return st
+            if not ev.wait(max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    if ev in st.waiters:
+                        st.waiters.remove(ev)
+                    else:
+                        self._wake_one(st)  # 起こされた直後にタイムアウトした: 次の待ち手に譲る
+                    st.rejected += 1
+                raise HostBusy(host)
+
+    def slot(self, url: str):
+        return _SyncSlot(self, host_of(url))
+
+    # ---- 非同期 ---- #
+
+    async def _aacquire(self, host: str) -> _HostState:
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            with self._lock:
+                st = self._state(host)
+                delay = self._try_acquire(st)
+                if delay is None:
+                    fut = loop.create_future()
+                    st.waiters.append((loop, fut))
+            if delay is not None:
+                if delay > 0:
+                    try:
+                        await asyncio.sleep(delay)
+                    except asyncio.CancelledError:
+                        self._release(st, ok=None)
+                        raise
+                return st
+            try:
+                await asyncio.wait_for(fut, max(0.0, deadline - time.monotonic()))
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                with self._lock:
+                    if (loop, fut) in st.waiters:
+                        st.waiters.remove((loop, fut))
+                    else:
+                        self._wake_one(st)
+                    if isinstance(e, asyncio.TimeoutError):
+                        st.rejected += 1
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise HostBusy(host) from None
+
+    def aslot(self, url: str):
+        return _AsyncSlot(self, host_of(url))
+
+    # ---- 参照 ---- #
+
+    def is_open(self, url: str) -> bool:
+        st = self._hosts.get(host_of(url))
+        return st is not None and st.state == OPEN and time.monotonic() - st.opened_at < self.cooldown
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                st.host: {
+                    "state": st.state,
+                    "inflight": st.inflight,
+                    "waiting": len(st.waiters),
+                    "requests": st.requests,
+                    "errors": st.errors,
+                    "rejected": st.rejected,
+                    "opens": st.opens,
+                }
+                for st in self._hosts.values()
+            }
+
+
+def _resolve(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class _SyncSlot:
+    def __init__(self, sched: HostScheduler, host: str):
+        self.sched = sched
+        self.slot = _Slot(host)
+        self.st = None
+
+    def __enter__(self) -> _Slot:
+        self.st = self.sched._acquire(self.slot.host)
+        return self.slot
+
+    def __exit__(self, exc_type, exc, tb):
+        self.sched._release(self.st, self.slot.outcome(exc_type))
+        return False
+
+
+class _AsyncSlot(_SyncSlot):
+    async def __aenter__(self) -> _Slot:
+        self.st = await self.sched._aacquire(self.slot.host)
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # 呼び出し側の取り消し(クライアント切断)はホストの成否に数えない
+        self.sched._release(self.st, self.slot.outcome(exc_type))
+        return False
+
+
+HOST_SCHEDULER = HostScheduler()
+
+
+def fetch_failure_detail(url: str | None) -> str | None:
+    """URL の取得に失敗したときの案内。ホストが一時停止中なら専用の文言、それ以外は None"""
+    if url and HOST_SCHEDULER.is_open(url):
+        return "この求人サイトは現在応答が不安定なため、取得を一時停止しています。求人票のテキストを直接貼り付けてください。"
+    return None
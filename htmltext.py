@@ -0,0 +1,210 @@
+"""
+htmltext.py
+HTML → 本文テキストの逐次抽出(html.parser のイベントで処理し、木は作らない)。
+
+従来の BeautifulSoup(html, "html.parser") → script/style/noscript を decompose → get_text("\n")
+と同じ文字列の区切り方で本文を集めるが、
+
+  - script / style / noscript の中身は解析中に捨てる(木を作ってから消すのではなく)
+  - 集めた本文が十分な量(MAX_TEXT_CHARS の TEXT_MARGIN 倍の非空白文字)になったら打ち切る
+  - バイト列は HtmlTextStream に少しずつ渡せる(ダウンロードしながら抽出し、
+    本文が集まった時点・FETCH_MAX_BYTES に達した時点で読むのをやめられる)
+
+前処理(preprocess_text)と 80,000 文字への切り詰めは rules.html_to_text / rules.stream_to_text 側で行う。
+
+環境変数:
+  YABASA_FETCH_MAX_BYTES : 読み込む本体の上限バイト数(既定: 2MB。fetcher.py と共通)
+"""
+
+import os
+import re
+import codecs
+from html.parser import HTMLParser
+
+FETCH_MAX_BYTES = int(os.environ.get("YABASA_FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+MAX_TEXT_CHARS = 80000
+# 前処理で空白の圧縮・NFKC 正規化・ノイズ語の除去があっても MAX_TEXT_CHARS を割らないだけ集める
+TEXT_MARGIN = 2
+CHUNK_CHARS = 64 * 1024
+
+SKIP_TAGS = frozenset(("script", "style", "noscript"))
+PRESERVE_WS_TAGS = frozenset(("pre", "textarea"))
+_ASCII_SPACES = str.maketrans("", "", "\x20\x0a\x09\x0c\x0d")
+
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_\-]+)""", re.IGNORECASE)
+_HEADER_CHARSET = re.compile(r"""charset=["']?([^;"'\s]+)""", re.IGNORECASE)
+
+
+# ------------------------------------------------------------------ #
+#  文字列 → 本文
+# ------------------------------------------------------------------ #
+
+class TextExtractor(HTMLParser):
+    """
+    html.parser のイベントから本文の文字列を集める。
+    連続するテキストは1つの文字列にまとめ、空白だけの文字列は "\\n" か " " に縮める
+    (BeautifulSoup の NavigableString と同じ単位)。コメント・宣言は含めない。
+    """
+
+    def __init__(self, limit: int = MAX_TEXT_CHARS * TEXT_MARGIN):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.parts: list[str] = []
+        self.collected = 0
+        self.done = False
+        self._buf: list[str] = []
+        self._skip = 0
+        self._pre = 0
+
+    # ---- 入力 ---- #
+
+    def feed(self, data: str):
+        # 大きな文字列も CHUNK_CHARS ずつ渡し、十分集まったらそこで止める
+        for i in range(0, len(data), CHUNK_CHARS):
+            if self.done:
+                return
+            super().feed(data[i:i + CHUNK_CHARS])
+            if self.collected >= self.limit:
+                self.done = True
+
+    def text(self) -> str:
+        """集めた文字列を "\\n" で連結して返す(BeautifulSoup の get_text("\\n") 相当)"""
+        if not self.done:
+            self.close()
+        self._flush()
+        return "\n".join(self.parts)
+
+    # ---- イベント ---- #
+
+    def _flush(self):
+        if not self._buf:
+            return
+        s = "".join(self._buf)
+        self._buf.clear()
+        if self._skip:
+            return
+        if not self._pre and not s.translate(_ASCII_SPACES):
+            s = "\n" if "\n" in s else " "
+        else:
+            self.collected += len("".join(s.split()))
+        self.parts.append(s)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in PRESERVE_WS_TAGS:
+            self._pre += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in PRESERVE_WS_TAGS:
+            self._pre = max(0, self._pre - 1)
+
+    def handle_data(self, data):
+        self._buf.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        # <![CDATA[...]]> は本文として扱う(BeautifulSoup の CData と同じ)
+        self._flush()
+        if data.startswith("CDATA["):
+            self._buf.append(data[6:])
+            self._flush()
+
+
+def extract_text(html: str) -> str:
+    """HTML 文字列から前処理前の本文を取り出す"""
+    ex = TextExtractor()
+    ex.feed(html or "")
+    return ex.text()
+
+
+# ------------------------------------------------------------------ #
+#  バイト列(ストリーム)→ 本文
+# ------------------------------------------------------------------ #
+
+def header_charset(content_type: str | None) -> str | None:
+    """Content-Type ヘッダに明示された charset(無ければ None。既定値は補わない)"""
+    m = _HEADER_CHARSET.search(content_type or "")
+    return m.group(1) if m else None
+
+
+def sniff_charset(head: bytes) -> str | None:
+    m = _META_CHARSET.search(head[:4096])
+    return m.group(1).decode("ascii", "ignore") if m else None
+
+
+def _decoder(charset: str | None):
+    try:
+        return codecs.getincrementaldecoder(charset or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class HtmlTextStream:
+    """
+    HTML のバイト列を少しずつ受け取って本文を抽出する。
+
+      st = HtmlTextStream(header_charset(r.headers.get("Content-Type")))
+      for chunk in r.iter_content(65536):
+          if st.feed(chunk):
+              break          # 本文が十分集まった / 上限バイト数に達した
+      raw_text = st.text()
+
+    文字コードはヘッダの charset → 先頭 4KB の <meta charset> → UTF-8 の順に決める。
+    """
+
+    def __init__(self, charset: str | None = None, max_bytes: int = FETCH_MAX_BYTES):
+        self.charset = charset
+        self.max_bytes = max_bytes
+        self.received = 0
+        self._head = b""
+        self._decoder = _decoder(charset) if charset else None
+        self._ex = TextExtractor()
+
+    @property
+    def done(self) -> bool:
+        return self._ex.done or self.received >= self.max_bytes
+
+    def feed(self, chunk: bytes) -> bool:
+        """chunk を処理する。これ以上読む必要が無ければ True"""
+        if self.done or not chunk:
+            return self.done
+        chunk = chunk[:self.max_bytes - self.received]
+        self.received += len(chunk)
+        if self._decoder is None:
+            # 文字コード未確定: <meta charset> を探せるだけ溜めてから決める
+            self._head += chunk
+            if len(self._head) < 4096 and self.received < self.max_bytes:
+                return False
+            chunk, self._head = self._head, b""
+            self._start(chunk)
+        self._ex.feed(self._decoder.decode(chunk))
+        return self.done
+
+    def _start(self, head: bytes):
+        self.charset = sniff_charset(head)
+        self._decoder = _decoder(self.charset)
+
+    def text(self) -> str:
+        if self._decoder is None:
+            head, self._head = self._head, b""
+            self._start(head)
+            self._ex.feed(self._decoder.decode(head))
+        if not self._ex.done:
+            self._ex.feed(self._decoder.decode(b"", final=True))
+        return self._ex.text()
@@ -29,11 +29,20 @@ import json
 import datetime
 from typing import Optional
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
 from rules import label_total
 from rules_ilora import fetch_text_from_url
 from rules_v48 import score_text_v48, pick_questions_v48, DISPLAY_NAME_MAP_V48
+from batch import score_many, fetch_bodies, score_async, stream_ndjson, PoolUnavailable, STREAM_MAX_ITEMS
+from cache import RESULT_CACHE, result_key, cached_fetch, cached_fetch_async, cached_result_async
+from fetcher import fetch_text_async
+from hostsched import fetch_failure_detail
+from ruleset import get_ruleset
+from mpmetrics import endpoint as metrics_endpoint, stage, json_response
+from reqprof import REQUEST_PROFILER, profiled_response
 from aggregation import (
     aggregate_to_radar_axes,
     compute_axis_matches,
@@ -44,6 +53,9 @@ from aggregation import (
 
 router = APIRouter(prefix="/ilora", tags=["ilora-phase15"])
 
+# /ilora/concerns/batch の1リクエストあたりの上限件数
+BATCH_MAX_ITEMS = int(os.environ.get("YABASA_BATCH_MAX_ITEMS", "500"))
+
 
 # ================================================================== #
 #  Google Sheets クライアント(起動時に一度だけ初期化)
@@ -212,19 +224,68 @@ async def get_concerns(request: Request, inp: IloraConcernRequest):
     """
     求人票テキストorURLを受け取り、懸念点・問い文・レーダー8軸・マッチ判定を返す。
     """
+    # X-Yabasa-Profile / ?profile= があればこのリクエストを計測する(YABASA_PROFILE=1 のときのみ。reqprof.py)
+    fmt = REQUEST_PROFILER.requested(request)
+    with metrics_endpoint("ilora_concerns"):
+        if fmt is not None:
+            return await run_in_threadpool(
+                profiled_response, fmt, "ilora_concerns", lambda: _get_concerns_inline(inp))
+        return await _get_concerns(inp)
+
+
+def _fetch_failed(url: str) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=fetch_failure_detail(url)
+        or "URLの取得に失敗しました。求人票のテキストを直接貼り付けてください。"
+    )
+
+
+async def _get_concerns(inp: IloraConcernRequest):
     # --- 入力の取り込み ---
     body = (inp.text or "").strip()
     source = "text"
 
     if not body and inp.url:
-        body = fetch_text_from_url(inp.url)
+        # 非同期取得(イベントループを止めない)
+        with stage("fetch"):
+            body = await cached_fetch_async(inp.url, fetch_text_async)
         source = "url"
         if not body:
-            raise HTTPException(
-                status_code=400,
-                detail="URLの取得に失敗しました。求人票のテキストを直接貼り付けてください。"
-            )
+            raise _fetch_failed(inp.url)
+
+    _check_input(inp, body)
+
+    # --- スコアリング(同じ本文・persona・ルールなら結果キャッシュを使い、実行中の同じ採点には合流する) ---
+    # 正規表現の照合は CPU を使うのでイベントループの外(ワーカー)で行う
+    key = _score_key(body, inp.persona)
+    try:
+        scored = await cached_result_async(
+            key, lambda: score_async(body, persona=inp.persona, with_spans=True), _complete)
+    except (TimeoutError, PoolUnavailable):
+        raise HTTPException(status_code=503, detail="処理が混み合っています。しばらくしてから再度お試しください。")
+    return json_response(build_concerns_response(inp, body, source, scored))
+
+
+def _get_concerns_inline(inp: IloraConcernRequest):
+    """
+    計測用(reqprof.py): キャッシュ・合流・プロセスプールを使わず、
+    取得・採点・レスポンスの組み立てをすべてこのスレッドで行う
+    """
+    body = (inp.text or "").strip()
+    source = "text"
+    if not body and inp.url:
+        with stage("fetch"):
+            body = fetch_text_from_url(inp.url)
+        source = "url"
+        if not body:
+            raise _fetch_failed(inp.url)
+    _check_input(inp, body)
+    scored = score_text_v48(body, persona=inp.persona, with_spans=True)
+    return json_response(build_concerns_response(inp, body, source, scored))
+
 
+def _check_input(inp: IloraConcernRequest, body: str):
     if not body:
         raise HTTPException(
             status_code=400,
@@ -237,52 +298,68 @@ async def get_concerns(request: Request, inp: IloraConcernRequest):
             detail="persona は 'standard' または 'lifecycle' を指定してください。"
         )
 
-    # --- スコアリング ---
-    cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured = \
-        score_text_v48(body, persona=inp.persona)
 
-    # --- 既存出力(v4.7互換)の生成 ---
-    risk_level = label_total(total)
+def _score_key(body: str, persona: str) -> tuple:
+    """score_text_v48 の結果キャッシュのキー(ルール変更で fingerprint が変わる)"""
+    return result_key("v48", body, get_ruleset("v48", persona).fingerprint, persona=persona)
 
-    # 懸念リスト(スコア>0のカテゴリ)
-    concerns = []
-    for cat, score in sorted(cat_scores.items(), key=lambda x: -x[1]):
-        if score == 0:
-            continue
-        disp = DISPLAY_NAME_MAP_V48.get(cat, cat)
-        hits = cat_hits.get(cat, [])
-        summary = hits[0]["reason"] if hits else f"{disp}に懸念が検出されました"
-        ev = [e for e in cat_evidence.get(cat, []) if e]
-        concerns.append({
-            "category": disp,
-            "score": score,
-            "summary": summary,
-            "evidence": ev[:2],
-        })
 
-    # 問い文候補
-    raw_questions = pick_questions_v48(
-        cat_hits, cat_scores, max_questions=inp.max_questions
-    )
-    questions = [
-        {**q, "selected": q["score"] >= 3}
-        for q in raw_questions
-    ]
-
-    # ポジティブシグナル
-    positive = []
-    for cat, guards in cat_safe_hits.items():
-        for g in guards:
-            note = g.get("note", "")
-            if note:
-                positive.append(note)
-    positive = list(set(positive))
+def _complete(scored: tuple) -> bool:
+    """時間予算切れで一部のルールしか評価していない結果(budget_skipped あり)は結果キャッシュに入れない"""
+    return not scored[7]
+
+
+def build_concerns_response(inp: IloraConcernRequest, body: str, source: str, scored: tuple) -> dict:
+    """
+    score_text_v48(with_spans=True) の結果から /ilora/concerns のレスポンスを組み立てる。
+    単発・バッチ・ストリーミングで共通。
+    """
+    cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured, spans, budget_skipped = scored
+
+    with stage("concerns"):
+        # --- 既存出力(v4.7互換)の生成 ---
+        risk_level = label_total(total)
+
+        # 懸念リスト(スコア>0のカテゴリ)
+        concerns = []
+        for cat, score in sorted(cat_scores.items(), key=lambda x: -x[1]):
+            if score == 0:
+                continue
+            disp = DISPLAY_NAME_MAP_V48.get(cat, cat)
+            hits = cat_hits.get(cat, [])
+            summary = hits[0]["reason"] if hits else f"{disp}に懸念が検出されました"
+            ev = [e for e in cat_evidence.get(cat, []) if e]
+            concerns.append({
+                "category": disp,
+                "score": score,
+                "summary": summary,
+                "evidence": ev[:2],
+            })
+
+        # 問い文候補
+        raw_questions = pick_questions_v48(
+            cat_hits, cat_scores, max_questions=inp.max_questions
+        )
+        questions = [
+            {**q, "selected": q["score"] >= 3}
+            for q in raw_questions
+        ]
+
+        # ポジティブシグナル
+        positive = []
+        for cat, guards in cat_safe_hits.items():
+            for g in guards:
+                note = g.get("note", "")
+                if note:
+                    positive.append(note)
+        positive = list(set(positive))
 
     # --- v4.8 拡張:レーダー8軸スコア ---
-    radar_axes = aggregate_to_radar_axes(cat_scores)
+    with stage("radar"):
+        radar_axes = aggregate_to_radar_axes(cat_scores)
 
-    # --- v4.8 拡張:カテゴリ別スコア(画面下部バー用) ---
-    category_scores_display = build_category_scores_for_display(cat_scores)
+        # --- v4.8 拡張:カテゴリ別スコア(画面下部バー用) ---
+        category_scores_display = build_category_scores_for_display(cat_scores)
 
     # --- v4.8 拡張:レスポンス組み立て ---
     response = {
@@ -291,6 +368,8 @@ async def get_concerns(request: Request, inp: IloraConcernRequest):
         "persona": inp.persona,
         "risk_level": risk_level,
         "total_score": total,
+        # YABASA_REGEX_MODE=bounded で時間予算が尽き、一部のルールを評価していない結果(スコアは低めに出る)
+        "partial": bool(budget_skipped),
         "concerns": concerns,
         "questions": questions,
         "positive_signals": positive,
@@ -299,6 +378,12 @@ async def get_concerns(request: Request, inp: IloraConcernRequest):
         "radar_axes": radar_axes,
         "radar_display_names": get_radar_display_names(),
         "category_scores": category_scores_display,
+
+        # ハイライト用のヒット位置(前処理後テキストに対するオフセット。match は短いプレビュー、件数は上限つき)
+        "evidence_spans": [
+            {**sp, "category": DISPLAY_NAME_MAP_V48.get(sp["category"], sp["category"])}
+            for sp in spans
+        ],
     }
 
     # --- ILORA耐性データあり → マッチ判定を追加 ---
@@ -309,7 +394,8 @@ async def get_concerns(request: Request, inp: IloraConcernRequest):
             else (tol_score.dict() if hasattr(tol_score, 'dict') else tol_score)
             for axis_key, tol_score in inp.user_tolerance.items()
         }
-        response["axis_matches"] = compute_axis_matches(radar_axes, user_tol_dict)
+        with stage("radar"):
+            response["axis_matches"] = compute_axis_matches(radar_axes, user_tol_dict)
 
     # --- hard_limits あり → 違反チェックを追加 ---
     if inp.hard_limits:
@@ -327,6 +413,136 @@ async def get_concerns(request: Request, inp: IloraConcernRequest):
     return response
 
 
+# ================================================================== #
+#  バッチ: /ilora/concerns/batch
+# ================================================================== #
+
+class IloraConcernBatchRequest(BaseModel):
+    """
+    /ilora/concerns/batch のリクエスト。items の各要素は /ilora/concerns と同じ形。
+    """
+    items: list[IloraConcernRequest]
+
+
+def _concerns_batch(items: list[IloraConcernRequest]) -> list[dict]:
+    with stage("fetch"):
+        bodies = fetch_bodies(
+            items, lambda url: cached_fetch(url, fetch_text_from_url),
+            "url または text のどちらかを指定してください。",
+            "URLの取得に失敗しました。求人票のテキストを直接貼り付けてください。",
+        )
+
+    results: list = [None] * len(items)
+    scored: dict = {}
+    keys = {}
+    for i, (body, _, err) in enumerate(bodies):
+        if err is None and items[i].persona not in ("standard", "lifecycle"):
+            err = {"status": 400, "detail": "persona は 'standard' または 'lifecycle' を指定してください。"}
+        if err is not None:
+            results[i] = {"index": i, "ok": False, "error": err}
+            continue
+        keys[i] = _score_key(body, items[i].persona)
+        hit = RESULT_CACHE.get(keys[i])
+        if hit is not None:
+            scored[i] = hit
+
+    # キャッシュに無いものだけ採点
+    todo = [i for i in keys if i not in scored]
+    fresh = score_many(
+        [bodies[i][0] for i in todo],
+        persona=[items[i].persona for i in todo],
+        with_spans=True, return_exceptions=True,
+    )
+    for i, sc in zip(todo, fresh):
+        if not isinstance(sc, Exception) and _complete(sc):
+            RESULT_CACHE.set(keys[i], sc)
+        scored[i] = sc
+
+    for i in keys:
+        sc = scored[i]
+        try:
+            if isinstance(sc, Exception):
+                raise sc
+            body, source, _ = bodies[i]
+            res = build_concerns_response(items[i], body, source, sc)
+        except Exception as e:
+            results[i] = {"index": i, "ok": False, "error": {"status": 500, "detail": f"サーバーエラー: {e}"}}
+            continue
+        results[i] = {"index": i, "ok": True, "result": res}
+    return results
+
+
+@router.post("/concerns/batch")
+async def get_concerns_batch(request: Request, inp: IloraConcernBatchRequest):
+    """
+    複数の求人票をまとめて診断する。結果は入力順に
+    {index, ok: true, result} / {index, ok: false, error: {status, detail}} で返す(1件の失敗で全体は失敗しない)。
+    """
+    if len(inp.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"1バッチの上限は {BATCH_MAX_ITEMS} 件です。"
+        )
+
+    with metrics_endpoint("ilora_concerns_batch"):
+        # URL取得・採点はブロッキングなのでイベントループの外で実行する
+        try:
+            results = await run_in_threadpool(_concerns_batch, inp.items)
+        except PoolUnavailable:
+            raise HTTPException(status_code=503, detail="処理が混み合っています。しばらくしてから再度お試しください。")
+        return json_response({
+            "count": len(results),
+            "ok_count": sum(1 for r in results if r["ok"]),
+            "results": results,
+        })
+
+
+# ================================================================== #
+#  ストリーミング: /ilora/concerns/stream
+# ================================================================== #
+
+async def _concerns_item(i: int, item: IloraConcernRequest) -> dict:
+    """1件分の /ilora/concerns 処理(取得 → score_text_v48 → build_concerns_response)"""
+    body = (item.text or "").strip()
+    source = "text"
+    if not body and item.url:
+        body = await cached_fetch_async(item.url, fetch_text_async)
+        source = "url"
+        if not body:
+            return {"index": i, "ok": False, "error": {
+                "status": 400,
+                "detail": fetch_failure_detail(item.url)
+                or "URLの取得に失敗しました。求人票のテキストを直接貼り付けてください。"}}
+    if not body:
+        return {"index": i, "ok": False, "error": {
+            "status": 400, "detail": "url または text のどちらかを指定してください。"}}
+    if item.persona not in ("standard", "lifecycle"):
+        return {"index": i, "ok": False, "error": {
+            "status": 400, "detail": "persona は 'standard' または 'lifecycle' を指定してください。"}}
+
+    key = _score_key(body, item.persona)
+    scored = await cached_result_async(
+        key, lambda: score_async(body, persona=item.persona, with_spans=True), _complete)
+    return {"index": i, "ok": True, "result": build_concerns_response(item, body, source, scored)}
+
+
+@router.post("/concerns/stream")
+async def get_concerns_stream(request: Request, inp: IloraConcernBatchRequest):
+    """
+    /ilora/concerns/batch と同じ入力を受け取り、終わった順に1件1行の NDJSON で返す。
+    各行は {index, ok, result | error}。送信待ちの結果は一定数までしか溜めない(batch.stream_ndjson)。
+    """
+    if len(inp.items) > STREAM_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"1リクエストの上限は {STREAM_MAX_ITEMS} 件です。"
+        )
+    return StreamingResponse(
+        stream_ndjson(inp.items, _concerns_item),
+        media_type="application/x-ndjson",
+    )
+
+
 # ================================================================== #
 #  メインエンドポイント: /ilora/inquiry
 # ================================================================== #
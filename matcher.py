@@ -0,0 +1,550 @@
+"""
+matcher.py
+RuleSet 内の全ルール(リスク・セーフガード)のマッチ位置を、テキストの一回の走査で
+まとめて求めるマッチングエンジン。
+
+仕組み:
+  1. 各パターンを構文解析し、「マッチの先頭に必ず現れるリテラル(アンカー)」の集合を求める
+     例: IPO.{0,20}(目指|準備|予定)          → {"ipo"}
+         (社名変更|再編|ホールディングス化)     → {"社名変更", "再編", "ホールディン"}
+  2. 全アンカーを1本のトライ形正規表現にまとめ、テキストを一度だけ走査して
+     現れたアンカーの集合を得る
+  3. アンカーが1つも現れないルールは正規表現を実行せずスキップし、
+     現れたルールだけ regex.finditer でヒット位置を確認する
+     (マッチの先頭には必ずアンカーがあるので、スキップしても結果は変わらない)
+  4. アンカーを決められないパターン(先頭が \\s* や . など)は常に finditer
+  5. 先頭以外も含め「マッチ内に必ず現れるリテラル」(必須リテラル)の節も求め、
+     どれか1つの節でも欠けていればそのルールは評価しない(プリフィルタ)
+     例: (月|平均)?\\s*(残業|時間外).*(60|70|80)\\s*時間
+         → 先頭は決まらないが {"残業","時間外"} と {"時間"} が必須
+
+戻り値は rule_id → [(start, end), ...] のヒット一覧で、スコアリングとエビデンス抽出の
+両方がこれを使う(エビデンスのために正規表現を再実行しない)。
+"""
+
+import re
+import time
+
+import _sre
+
+try:
+    from re import _parser as _sre_parse, _constants as _sre_c, _casefix
+    _FIXES = _casefix._EXTRA_CASES
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_c
+    import sre_compile
+    _FIXES = getattr(sre_compile, "_ignorecase_fixes", {})
+
+
+# アンカーは先頭からこの文字数までで十分(候補位置の絞り込みにしか使わない)
+MAX_ANCHOR_LEN = 6
+# 1ルールあたりのアンカー数上限(超える場合は先頭1文字に縮める)
+MAX_ANCHORS = 64
+# 文字クラスを展開してアンカーにする上限文字数
+MAX_CLASS_EXPAND = 16
+
+
+# ------------------------------------------------------------------ #
+#  大文字小文字の畳み込み(re.IGNORECASE と同じ同値関係)
+# ------------------------------------------------------------------ #
+
+_FOLD_CACHE: dict[str, str] = {}
+
+
+def _fold(ch: str) -> str:
+    f = _FOLD_CACHE.get(ch)
+    if f is None:
+        lo = _sre.unicode_tolower(ord(ch))
+        f = chr(min((lo, *_FIXES.get(lo, ()))))
+        _FOLD_CACHE[ch] = f
+    return f
+
+
+def _fold_str(s: str) -> str:
+    return "".join(_fold(c) for c in s)
+
+
+# ------------------------------------------------------------------ #
+#  先頭リテラル(アンカー)抽出
+# ------------------------------------------------------------------ #
+
+def _class_chars(items) -> list[str] | None:
+    chars = []
+    for op, av in items:
+        if op is _sre_c.LITERAL:
+            chars.append(chr(av))
+        elif op is _sre_c.RANGE:
+            lo, hi = av
+            if hi - lo + 1 > MAX_CLASS_EXPAND:
+                return None
+            chars.extend(chr(c) for c in range(lo, hi + 1))
+        else:
+            return None
+        if len(chars) > MAX_CLASS_EXPAND:
+            return None
+    return chars
+
+
+def _prefixes(items: list, budget: int) -> set[str] | None:
+    """
+    items(構文木の列)にマッチする文字列の先頭リテラル候補を返す。
+      None      : 先頭が特定できない(任意文字・\\s・否定クラス等で始まりうる)
+      "" を含む : 空文字列にマッチしうる(続く要素で先頭が決まる)
+    """
+    if budget <= 0 or not items:
+        return {""}
+
+    op, av = items[0]
+    rest = items[1:]
+
+    if op is _sre_c.LITERAL or op is _sre_c.IN:
+        chars = [chr(av)] if op is _sre_c.LITERAL else _class_chars(av)
+        if chars is None:
+            return None
+        tail = _prefixes(rest, budget - 1)
+        if tail is None:
+            return set(chars)
+        return {c + t for c in chars for t in tail}
+
+    if op is _sre_c.SUBPATTERN:
+        return _prefixes(list(av[-1]) + rest, budget)
+
+    if op is _sre_c.BRANCH:
+        out = set()
+        for alt in av[1]:
+            p = _prefixes(list(alt) + rest, budget)
+            if p is None:
+                return None
+            out |= p
+        return out
+
+    if op is _sre_c.MAX_REPEAT or op is _sre_c.MIN_REPEAT:
+        lo, hi, sub = av
+        if hi == 1:
+            out = _prefixes(list(sub) + rest, budget)
+        else:
+            # 2回目以降の繰り返しと続きは区別しない(sub の先頭だけ使う)
+            out = _prefixes(list(sub), budget)
+        if out is None:
+            return None
+        if lo == 0 or "" in out:
+            after = _prefixes(rest, budget)
+            if after is None:
+                return None
+            out = (out - {""}) | after
+        return out
+
+    if op is _sre_c.AT:
+        # \b ^ などの幅ゼロ表明は先頭文字を消費しない
+        return _prefixes(rest, budget)
+
+    return None
+
+
+def first_literals(pattern: str, flags: int = 0) -> frozenset[str] | None:
+    """
+    パターンの全マッチが必ずいずれかで始まるリテラル集合(_fold で畳み込み済み)。
+    特定できない場合は None。
+    """
+    try:
+        tree = _sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    out = _prefixes(list(tree), MAX_ANCHOR_LEN)
+    if not out or "" in out:
+        return None
+    if len(out) > MAX_ANCHORS:
+        out = {p[:1] for p in out}
+        if len(out) > MAX_ANCHORS:
+            return None
+    return frozenset(_fold_str(p) for p in out)
+
+
+# ------------------------------------------------------------------ #
+#  必須リテラル(プリフィルタ用)
+# ------------------------------------------------------------------ #
+
+# これより短いリテラルしか持たない節は捨てる(1文字は本文のほぼどこにでも現れ、走査を重くするだけ)
+MIN_REQUIRED_LEN = 2
+
+
+def _clauses(items: list) -> list[frozenset[str]]:
+    """
+    items にマッチする文字列が必ず含む「節」の列を返す。
+    各節はリテラル集合で、マッチはその中の少なくとも1つを含む(節同士は AND)。
+    """
+    out: list[frozenset[str]] = []
+    run: list[str] = []
+
+    def flush():
+        if run:
+            out.append(frozenset({"".join(run)}))
+            run.clear()
+
+    for op, av in items:
+        if op is _sre_c.LITERAL:
+            run.append(chr(av))
+            continue
+        if op is _sre_c.AT:
+            # 幅ゼロ表明は連続するリテラルを分断しない
+            continue
+        flush()
+
+        if op is _sre_c.SUBPATTERN:
+            out.extend(_clauses(list(av[-1])))
+        elif op is _sre_c.BRANCH:
+            # 各選択肢から最も強い節を1つずつ選び、その和集合を1つの節にする
+            merged = set()
+            for alt in av[1]:
+                best = _strongest(_clauses(list(alt)))
+                if best is None:
+                    merged = None
+                    break
+                merged |= best
+            if merged:
+                out.append(frozenset(merged))
+        elif op is _sre_c.MAX_REPEAT or op is _sre_c.MIN_REPEAT:
+            lo, _hi, sub = av
+            if lo >= 1:
+                out.extend(_clauses(list(sub)))
+        # IN / ANY / CATEGORY / ASSERT など: 必須リテラルなし(連続を切るだけ)
+
+    flush()
+    return out
+
+
+def _strongest(clauses: list[frozenset[str]]) -> frozenset[str] | None:
+    """最短リテラルが最も長い節(同点なら選択肢の少ない方)。"""
+    best = None
+    best_key = None
+    for c in clauses:
+        key = (min(len(x) for x in c), -len(c))
+        if best_key is None or key > best_key:
+            best, best_key = c, key
+    return best
+
+
+def required_literals(pattern: str, flags: int = 0) -> tuple[frozenset[str], ...]:
+    """
+    パターンの全マッチが必ず含むリテラル節の列(_fold で畳み込み・MAX_ANCHOR_LEN で切り詰め済み)。
+    空タプルなら絞り込み不可。リテラルの一部もまたマッチに含まれるので、切り詰めても安全。
+    """
+    try:
+        tree = _sre_parse.parse(pattern, flags)
+    except Exception:
+        return ()
+    out = []
+    for c in _clauses(list(tree)):
+        if len(c) > MAX_ANCHORS or min(len(x) for x in c) < MIN_REQUIRED_LEN:
+            continue
+        folded = frozenset(_fold_str(x[:MAX_ANCHOR_LEN]) for x in c)
+        if folded not in out:
+            out.append(folded)
+    return tuple(out)
+
+
+# ------------------------------------------------------------------ #
+#  ReDoS 対策(bounded モード)
+# ------------------------------------------------------------------ #
+
+# エスケープされていない . と否定文字クラス [^...] の無制限繰り返し(.* / .*? / .+ / [^0-9]* など)
+_GAP_RE = re.compile(r"(?<!\\)(\.|\[\^(?:\\.|[^\]\\])*\])([*+])(\??)")
+
+
+def has_unbounded_gap(pattern: str) -> bool:
+    return _GAP_RE.search(pattern) is not None
+
+
+def bound_gaps(pattern: str, gap: int) -> str:
+    """
+    無制限の .* / .*? / .+ / [^...]* などを {0,gap} / {1,gap} の上限付き繰り返しに置き換える。
+    「A.*B」型のルールは A の出現ごとに本文末尾まで走査・後戻りするため、
+    A が多い長文では入力長の2乗に比例して遅くなる。上限を付けると1出現あたり gap 文字で済む。
+    """
+    def repl(m):
+        lo = "0" if m.group(2) == "*" else "1"
+        return f"{m.group(1)}{{{lo},{gap}}}{m.group(3)}"
+    return _GAP_RE.sub(repl, pattern)
+
+
+# ------------------------------------------------------------------ #
+#  リテラル索引(1回の走査で現れるリテラルの集合を求める)
+# ------------------------------------------------------------------ #
+
+def _case_class(c: str) -> str:
+    """c と re.IGNORECASE で同一視される文字の文字クラス(c は _fold 済み)。"""
+    variants = {c, c.upper(), c.lower(), *(chr(x) for x in _FIXES.get(ord(c), ()))}
+    variants |= set(_TOLOWER_PREIMAGES.get(c, ""))
+    variants = sorted(v for v in variants if len(v) == 1 and _fold(v) == c)
+    if len(variants) == 1:
+        return re.escape(c)
+    return "[" + "".join(re.escape(v) for v in variants) + "]"
+
+
+# 小文字化すると ASCII になる非 ASCII 文字(İ→i, K(ケルビン)→k)。upper() では辿れない
+_TOLOWER_PREIMAGES = {"i": "\u0130", "k": "\u212a"}
+
+
+def _trie_pattern(words) -> str:
+    """
+    リテラル集合を先頭文字で枝分かれするトライ形の正規表現にする。
+    フラットな a|b|c... より1位置あたりの試行が少ない。
+    IGNORECASE は先頭文字による高速スキップが効かなくなるので使わず、
+    大文字小文字のある文字だけ文字クラスに展開する。
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for c in w:
+            node = node.setdefault(c, {})
+        node[""] = {}
+
+    def emit(node) -> str:
+        alts = [_case_class(c) + emit(node[c]) for c in sorted(k for k in node if k)]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # 終端を含むノードは長い方を優先しつつ省略可にする
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+class LiteralIndex:
+    """
+    リテラル集合を1本のトライ形正規表現にまとめ、テキストを一度だけ走査して
+    「どのリテラルが現れるか」を返す。
+
+    正規表現の走査は非重複なので、他のリテラルのマッチに隠れる出現がありうる:
+      - 完全に内側に含まれる(例: "固定残業" の中の "残業") → 外側が現れれば内側も現れる
+      - 別の走査に分かれたリテラル同士は隠れ合わない(それぞれ独立に走査する)
+      - 末尾と先頭が部分的に重なる                         → そのリテラルだけ個別に再検索
+    """
+
+    def __init__(self, literals):
+        lits = sorted(set(literals), key=lambda a: (-len(a), a))
+        self.literals = tuple(lits)
+        self._known = frozenset(lits)
+        self._inside: dict[str, tuple[str, ...]] = {}
+        self._partial: dict[str, tuple[str, ...]] = {}
+        self._exact: dict[str, re.Pattern] = {}
+
+        for a in lits:
+            inside = []
+            partial = []
+            for b in lits:
+                if a == b:
+                    continue
+                if b in a:
+                    inside.append(b)
+                elif any(b.startswith(a[k:]) for k in range(1, len(a))):
+                    partial.append(b)
+                    self._exact.setdefault(b, re.compile(re.escape(b), re.IGNORECASE))
+            if inside:
+                self._inside[a] = tuple(inside)
+            if partial:
+                self._partial[a] = tuple(partial)
+
+        # 大文字小文字のある文字を文字クラスに展開すると、sre の先頭文字による
+        # 高速スキップが全体で効かなくなるため、そうしたリテラルは別の走査に分ける
+        # (日本語中心の本文では、小さい走査を2回する方が速い)
+        uncased = [a for a in lits if _case_class(a[0]) == re.escape(a[0])]
+        cased = [a for a in lits if _case_class(a[0]) != re.escape(a[0])]
+        self._scanners = tuple(re.compile(_trie_pattern(g)) for g in (uncased, cased) if g)
+
+    def present(self, text: str) -> set[str]:
+        """テキストに現れるリテラルの集合(_fold 済みの表記)"""
+        known = self._known
+        direct = set()
+        for scanner in self._scanners:
+            direct.update(a if a in known else _fold_str(a) for a in set(scanner.findall(text)))
+
+        found = set(direct)
+        for a in direct:
+            found.update(self._inside.get(a, ()))
+        for a in direct:
+            for b in self._partial.get(a, ()):
+                if b not in found and self._exact[b].search(text):
+                    found.add(b)
+        return found
+
+
+# ------------------------------------------------------------------ #
+#  マルチパターンマッチャ
+# ------------------------------------------------------------------ #
+
+class MultiMatcher:
+    """
+    ルール列(CompiledRule)をまとめて照合する。RuleSet ごとに一度だけ構築する。
+
+    1. 各ルールの第1節(アンカー、なければ最も強い必須リテラル節)のリテラルを
+       LiteralIndex で一度に走査し、リテラルごとのビットを立てた出現ビットマップを作る
+    2. 第1節のマスクと交わらないルールは評価しない
+    3. 通過したルールは残りの必須リテラル節を部分文字列検索で確かめる(結果はテキスト単位でメモ)
+    4. 残ったルールだけ finditer でヒット位置を集める
+
+    bounded=True のときは CompiledRule.bounded(ギャップ上限付き)の正規表現を使い、
+    match_all に budget を渡すとルール単位・リクエスト単位の時間予算を課す。
+
+    evaluated / skipped などのカウンタはプロセス起動からの累計(/metrics 用)。
+    """
+
+    def __init__(self, rules, bounded: bool = False):
+        self.rules = tuple(rules)
+        self.bounded = bounded
+        self.regexes = [r.bounded if bounded else r.regex for r in self.rules]
+        self.anchors: list[frozenset[str] | None] = []
+        self.clauses: list[tuple[frozenset[str], ...]] = []
+        for r in self.rules:
+            anchors = first_literals(r.pattern, r.regex.flags)
+            cs = list(required_literals(r.pattern, r.regex.flags))
+            if anchors is not None:
+                cs = [anchors] + [c for c in cs if c != anchors]
+            elif cs:
+                best = _strongest(cs)
+                cs = [best] + [c for c in cs if c != best]
+            self.anchors.append(anchors)
+            self.clauses.append(tuple(cs))
+
+        self.index = LiteralIndex(x for cs in self.clauses if cs for x in cs[0])
+        self.bits = {a: 1 << i for i, a in enumerate(self.index.literals)}
+        self.masks = [
+            (self._mask(cs[0]) if cs else 0) for cs in self.clauses
+        ]
+        self.unfiltered = [r.rule_id for r, cs in zip(self.rules, self.clauses) if not cs]
+
+        # 第2節以降のリテラルの存在確認(大文字小文字のないものは str の in で足りる)
+        self._search: dict[str, re.Pattern | None] = {}
+        for cs in self.clauses:
+            for c in cs[1:]:
+                for a in c:
+                    if a not in self._search:
+                        cased = any(_case_class(ch) != re.escape(ch) for ch in a)
+                        self._search[a] = re.compile(re.escape(a), re.IGNORECASE) if cased else None
+
+        # 予算ありのときの評価順: ギャップを含む(重くなりうる)ルールを後回しにする
+        self._cost = [1 if has_unbounded_gap(r.pattern) else 0 for r in self.rules]
+
+        self.evaluated = 0
+        self.skipped = 0
+        self.over_budget: dict[str, int] = {}
+        self.budget_exhausted = 0
+        self.budget_skipped = 0
+
+    def _mask(self, literals) -> int:
+        m = 0
+        for a in literals:
+            m |= self.bits[a]
+        return m
+
+    def presence(self, text: str) -> int:
+        """テキストの出現ビットマップ(第1節のリテラルのみ)"""
+        bits = self.bits
+        bitmap = 0
+        for a in self.index.present(text):
+            bitmap |= bits[a]
+        return bitmap
+
+    def _contains(self, text: str, a: str, memo: dict[str, bool]) -> bool:
+        hit = memo.get(a)
+        if hit is None:
+            rx = self._search[a]
+            hit = (rx.search(text) is not None) if rx is not None else (a in text)
+            memo[a] = hit
+        return hit
+
+    def candidates(self, text: str) -> list[int]:
+        """プリフィルタを通過したルールの添字"""
+        bitmap = self.presence(text)
+        memo: dict[str, bool] = {}
+        out = []
+        for i, (mask, cs) in enumerate(zip(self.masks, self.clauses)):
+            if not cs:
+                out.append(i)
+                continue
+            if not mask & bitmap:
+                continue
+            if all(any(self._contains(text, a, memo) for a in c) for c in cs[1:]):
+                out.append(i)
+        return out
+
+    def match_all(self, text: str, limits: dict[str, int],
+                  budget: tuple[float, float] | None = None,
+                  report: list | None = None,
+                  profile: list | None = None) -> dict[str, list[tuple[int, int]]]:
+        """
+        limits: rule_id → 最大ヒット数(re.finditer と同じ非重複・左から順)。
+        budget: (ルールあたり ms, リクエストあたり ms)。None なら無制限。
+          re の照合は途中で中断できないため、予算は協調的に扱う:
+            - 1ルールの所要時間が予算を超えたら over_budget として記録する
+            - 累計がリクエスト予算を超えたら、残りのルールは評価せずに打ち切る
+        report: リストを渡すと予算超過・打ち切りの明細
+          ({"rule_id", "status": "over_budget"|"skipped", "elapsed_ms"})を追記する。
+        profile: リストを渡すと評価したルールごとに (rule_id, 秒, ヒットしたか) を追記する(ruleprof.py)。
+        戻り値: ヒットしたルールの rule_id → [(start, end), ...]
+        """
+        idx = self.candidates(text)
+        self.evaluated += len(idx)
+        self.skipped += len(self.rules) - len(idx)
+
+        if budget is not None:
+            idx.sort(key=self._cost.__getitem__)
+            rule_ms, request_ms = budget
+            t_start = time.perf_counter()
+
+        timed = budget is not None or profile is not None
+        spans: dict[str, list[tuple[int, int]]] = {}
+        for n, i in enumerate(idx):
+            r = self.rules[i]
+            limit = limits.get(r.rule_id, 1)
+            found = []
+            if timed:
+                t0 = time.perf_counter()
+            for m in self.regexes[i].finditer(text):
+                found.append(m.span())
+                if len(found) >= limit:
+                    break
+            if found:
+                spans[r.rule_id] = found
+
+            if timed:
+                t1 = time.perf_counter()
+                if profile is not None:
+                    profile.append((r.rule_id, t1 - t0, bool(found)))
+            if budget is not None:
+                elapsed = (t1 - t0) * 1000
+                if elapsed > rule_ms:
+                    self._over_budget(r.rule_id, elapsed, report)
+                if (t1 - t_start) * 1000 > request_ms and n + 1 < len(idx):
+                    self._exhausted([self.rules[j].rule_id for j in idx[n+1:]], report)
+                    break
+
+        return spans
+
+    def _over_budget(self, rule_id: str, elapsed: float, report: list | None):
+        first = rule_id not in self.over_budget
+        self.over_budget[rule_id] = self.over_budget.get(rule_id, 0) + 1
+        if first:
+            print(f"[RULES] ルール {rule_id} が時間予算を超過: {elapsed:.2f}ms")
+        if report is not None:
+            report.append({"rule_id": rule_id, "status": "over_budget", "elapsed_ms": round(elapsed, 2)})
+
+    def _exhausted(self, rest: list[str], report: list | None):
+        self.budget_exhausted += 1
+        self.budget_skipped += len(rest)
+        if report is not None:
+            report.extend({"rule_id": rid, "status": "skipped", "elapsed_ms": 0.0} for rid in rest)
+
+    def stats(self) -> dict:
+        total = self.evaluated + self.skipped
+        return {
+            "rules": len(self.rules),
+            "unfiltered_rules": len(self.unfiltered),
+            "evaluated": self.evaluated,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / total, 4) if total else 0.0,
+            "over_budget": dict(self.over_budget),
+            "budget_exhausted": self.budget_exhausted,
+            "budget_skipped": self.budget_skipped,
+        }
@@ -1,31 +1,157 @@
+"""
+metrics.py
+ページビューの集計(SQLite)。record() はメモリ上の差分に足すだけで、ファイルへは
+METRICS_FLUSH_EVERY 件ごとか METRICS_FLUSH_SEC 秒ごとにまとめて書く(1件あたりの処理は履歴の量によらず一定)。
 
-import os, json, hashlib
+  metrics_day  : 日付(UTC)ごとの views と訪問者の HyperLogLog
+  metrics_path : パスごとの views と訪問者の HyperLogLog
+
+  - 訪問者は匿名化した IP で数える。日ごと・パスごとに 4KB 固定の HyperLogLog(hll.py)で、
+    ユニーク数は推定値(誤差 1〜2% 程度)
+  - 書き込みは差分の足し込み(views は UPSERT、HyperLogLog はレジスタの max)なので、
+    複数ワーカーが同じファイルに書いても失われない
+  - 書くたびに WAL をチェックポイントし、ファイルが伸び続けないようにする
+  - 旧形式の data/metrics.json があれば初回に取り込む
+  - 終了時(atexit)に残りを書く。summary() は自プロセスの未書き込み分を書いてから読む
+
+環境変数:
+  YABASA_DATA_DIR            : データ保存先(既定: data)
+  YABASA_METRICS_DB          : SQLite ファイル(既定: {YABASA_DATA_DIR}/metrics.sqlite3)
+  YABASA_METRICS_FLUSH_EVERY : この件数たまったら書く(既定: 500)
+  YABASA_METRICS_FLUSH_SEC   : 前回から この秒数たったら書く(既定: 2)
+"""
+
+import os, json, time, atexit, sqlite3, hashlib, threading
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 
-DATA_DIR = Path(os.environ.get("YABASA_DATA_DIR","data")); DATA_DIR.mkdir(parents=True, exist_ok=True)
-DB_PATH = DATA_DIR/'metrics.json'
+from hll import HyperLogLog
 
-def _load():
-  if DB_PATH.exists():
-    try: return json.loads(DB_PATH.read_text(encoding='utf-8'))
-    except Exception: return {'by_day':{},'by_path':{}}
-  return {'by_day':{},'by_path':{}}
+DATA_DIR = Path(os.environ.get("YABASA_DATA_DIR","data"))
+DB_PATH = Path(os.environ.get("YABASA_METRICS_DB", str(DATA_DIR/'metrics.sqlite3')))
+LEGACY_PATH = DATA_DIR/'metrics.json'
+FLUSH_EVERY = int(os.environ.get("YABASA_METRICS_FLUSH_EVERY","500"))
+FLUSH_SEC = float(os.environ.get("YABASA_METRICS_FLUSH_SEC","2"))
 
-def _save(db): DB_PATH.write_text(json.dumps(db, ensure_ascii=False), encoding='utf-8')
-def _today(): return datetime.utcnow().strftime('%Y-%m-%d')
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics_day (day TEXT PRIMARY KEY, views INTEGER NOT NULL, hll BLOB NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metrics_path (path TEXT PRIMARY KEY, views INTEGER NOT NULL, hll BLOB NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+def _today(): return datetime.now(timezone.utc).strftime('%Y-%m-%d')
 def _anon(ip): return hashlib.sha256(('salt|'+(ip or '')).encode()).hexdigest()[:12]
 
-def record(page_path:str, ip:str='', user_agent:str='', ref:str=''):
-  db=_load(); day=_today()
-  by_day=db.setdefault('by_day',{}); by_path=db.setdefault('by_path',{})
-  day_entry=by_day.setdefault(day, {'views':0,'ips':[]}); day_entry['views']+=1
-  ips=set(day_entry.get('ips',[])); ips.add(_anon(ip)); day_entry['ips']=list(ips)
-  p=by_path.setdefault(page_path or '/', {'views':0}); p['views']+=1
-  _save(db)
-
-def summary():
-  db=_load(); out={'by_day':{},'by_path':db.get('by_path',{})}
-  for d,info in db.get('by_day',{}).items():
-    out['by_day'][d]={'views':info.get('views',0),'unique_ips':len(set(info.get('ips',[])))}
-  return out
+# ------------------------------------------------------------------ #
+#  ストア
+# ------------------------------------------------------------------ #
+
+class MetricsStore:
+  def __init__(self, path:Path=DB_PATH, flush_every:int=FLUSH_EVERY, flush_sec:float=FLUSH_SEC):
+    self.path = Path(path)
+    self.flush_every = max(1, flush_every)
+    self.flush_sec = flush_sec
+    self._lock = threading.Lock()
+    self._ready = False
+    self._days = {}    # day  -> [views, HyperLogLog]
+    self._paths = {}   # path -> [views, HyperLogLog]
+    self._pending = 0
+    self._last_flush = time.monotonic()
+
+  def _connect(self):
+    conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+  def open(self):
+    """テーブルを用意し、旧形式の metrics.json があれば一度だけ取り込む"""
+    if self._ready: return
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    conn = self._connect()
+    try:
+      conn.executescript(_SCHEMA)
+      conn.execute("BEGIN IMMEDIATE")
+      if conn.execute("SELECT value FROM meta WHERE key='legacy_imported'").fetchone() is None:
+        days, paths = _load_legacy(LEGACY_PATH)
+        _merge(conn, days, paths)
+        conn.execute("INSERT INTO meta VALUES ('legacy_imported', '1')")
+        if days or paths: print(f"[METRICS] {LEGACY_PATH} を取り込みました({len(days)} 日分)")
+      conn.execute("COMMIT")
+    finally:
+      conn.close()
+    self._ready = True
+
+  def record(self, page_path:str, ip:str='', user_agent:str='', ref:str=''):
+    day = _today(); visitor = _anon(ip); page_path = page_path or '/'
+    with self._lock:
+      for table, key in ((self._days, day), (self._paths, page_path)):
+        entry = table.get(key)
+        if entry is None: entry = table[key] = [0, HyperLogLog()]
+        entry[0] += 1; entry[1].add(visitor)
+      self._pending += 1
+      due = self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_sec
+    if due: self.flush()
+
+  def flush(self):
+    """たまった差分を1トランザクションで書く"""
+    with self._lock:
+      days, paths, self._days, self._paths = self._days, self._paths, {}, {}
+      self._pending = 0; self._last_flush = time.monotonic()
+    if not days and not paths: return
+    self.open()
+    conn = self._connect()
+    try:
+      conn.execute("BEGIN IMMEDIATE")
+      _merge(conn, days, paths)
+      conn.execute("COMMIT")
+      conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    except sqlite3.Error as e:
+      print(f"[METRICS] 書き込みに失敗しました: {e}")
+    finally:
+      conn.close()
+
+  def summary(self):
+    self.flush(); self.open()
+    conn = self._connect()
+    try:
+      days = conn.execute("SELECT day, views, hll FROM metrics_day ORDER BY day").fetchall()
+      paths = conn.execute("SELECT path, views, hll FROM metrics_path ORDER BY views DESC").fetchall()
+    finally:
+      conn.close()
+    est = lambda blob: round(HyperLogLog.from_bytes(blob).count())
+    return {
+      'by_day': {d:{'views':v,'unique_ips':est(h)} for d,v,h in days},
+      'by_path': {p:{'views':v,'unique_ips':est(h)} for p,v,h in paths},
+    }
+
+
+def _merge(conn, days:dict, paths:dict):
+  for table, col, entries in (('metrics_day','day',days), ('metrics_path','path',paths)):
+    for key, (views, sketch) in entries.items():
+      row = conn.execute(f"SELECT hll FROM {table} WHERE {col}=?", (key,)).fetchone()
+      if row is not None: sketch.merge(HyperLogLog.from_bytes(row[0]))
+      conn.execute(
+        f"INSERT INTO {table} VALUES (?,?,?) ON CONFLICT({col}) DO UPDATE SET views = views + excluded.views, hll = excluded.hll",
+        (key, views, sketch.to_bytes()))
+
+
+def _load_legacy(path:Path):
+  """旧形式(日ごとの IP 一覧を持つ JSON)→ (days, paths)。パスごとの訪問者は無いので空の HyperLogLog"""
+  if not path.exists(): return {}, {}
+  try: db = json.loads(path.read_text(encoding='utf-8'))
+  except Exception: return {}, {}
+  days = {}
+  for d, info in db.get('by_day', {}).items():
+    sketch = HyperLogLog()
+    for v in set(info.get('ips', [])): sketch.add(v)
+    days[d] = [int(info.get('views', 0)), sketch]
+  paths = {p: [int(info.get('views', 0)), HyperLogLog()] for p, info in db.get('by_path', {}).items()}
+  return days, paths
+
+
+STORE = MetricsStore()
+atexit.register(STORE.flush)
+
+def record(page_path:str, ip:str='', user_agent:str='', ref:str=''): STORE.record(page_path, ip, user_agent, ref)
+def summary(): return STORE.summary()
@@ -0,0 +1,369 @@
+"""
+mpmetrics.py
+/metrics 用のカウンタ・ヒストグラム(Prometheus のテキスト形式)。uvicorn --workers N や
+採点・描画のプロセスプールのように複数プロセスで動いても、全プロセスの合計を返す。
+
+  - 各プロセスは自分のファイル(YABASA_METRICS_DIR/w<pid>.bin)に値を足していく。
+    ファイルは mmap した「キー → double」の追記式で、値の更新はそのプロセスだけが行う(ロックはプロセス内のみ)
+  - render() はディレクトリ内の全ファイルを読んで合計する(終了したワーカーの分も累計として残る)。
+    MaxGauge だけは合計ではなく全プロセスの最大値
+  - YABASA_METRICS_DIR が未設定なら、最初に読み込んだプロセスが起動ごとの一時ディレクトリを作って
+    環境変数に入れる(spawn した採点・描画プールのワーカーはそれを引き継ぐので、設定なしでも合計される)。
+    このディレクトリは終了時に消す。uvicorn --workers N ではワーカーごとに別になるので、明示的に設定すること
+  - 明示したディレクトリは起動のたびに空にしておくこと(start_yabasa.sh が行う)
+
+  REQUESTS.inc(endpoint="analyze", outcome="ok")
+  with endpoint("analyze"):          # yabasa_request_seconds{endpoint}
+      with stage("fetch"):           # yabasa_stage_seconds{endpoint, stage}
+          ...
+
+段階(stage): fetch / preprocess / rules / heuristics / radar / chart / concerns / serialize。
+採点の段階は rules.py・rules_v48.py・rules_ilora.py の中で測り、endpoint は contextvar で引き継ぐ
+(プロセスプールで採点するときは batch.py が endpoint を渡す)。
+
+環境変数:
+  YABASA_METRICS_DIR : プロセスごとの値を置くディレクトリ(既定: 未設定 = 起動ごとの一時ディレクトリ)
+"""
+
+import os
+import re
+import glob
+import atexit
+import shutil
+import tempfile
+import time
+import mmap
+import struct
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get("YABASA_METRICS_DIR", "")
+if not METRICS_DIR:
+    # 起動ごとの置き場。環境変数に入れておけば spawn した子プロセスも同じディレクトリに書く
+    METRICS_DIR = os.environ["YABASA_METRICS_DIR"] = tempfile.mkdtemp(prefix="yabasa-metrics-")
+    atexit.register(shutil.rmtree, METRICS_DIR, ignore_errors=True)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_INITIAL_SIZE = 1 << 16
+_SEP = "\t"
+
+
+# ------------------------------------------------------------------ #
+#  値の置き場(プロセスごと)
+# ------------------------------------------------------------------ #
+
+class _ValueFile:
+    """
+    1プロセス分の値。先頭 8 バイトが使用済みバイト数、その後に
+    [キー長 uint32][キー(8 バイト境界まで詰め物)][値 double] が並ぶ。
+    値を書いてから使用済みバイト数を進めるので、読む側は途中までのエントリを見ない。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "a+b")
+        if os.path.getsize(path) < _INITIAL_SIZE:
+            self._f.truncate(_INITIAL_SIZE)
+        self._mm = mmap.mmap(self._f.fileno(), 0)
+        self._used = struct.unpack_from("Q", self._mm, 0)[0] or 8
+        self._offsets: dict[str, int] = {k: off for k, off, _ in _entries(self._mm, self._used)}
+
+    def _add(self, key: str) -> int:
+        raw = key.encode("utf-8")
+        pad = (8 - (4 + len(raw)) % 8) % 8
+        need = 4 + len(raw) + pad + 8
+        if self._used + need > len(self._mm):
+            size = len(self._mm)
+            while self._used + need > size:
+                size *= 2
+            self._mm.close()
+            self._f.truncate(size)
+            self._mm = mmap.mmap(self._f.fileno(), 0)
+        pos = self._used
+        struct.pack_into(f"I{len(raw)}s", self._mm, pos, len(raw), raw)
+        off = pos + 4 + len(raw) + pad
+        struct.pack_into("d", self._mm, off, 0.0)
+        self._used = off + 8
+        struct.pack_into("Q", self._mm, 0, self._used)
+        self._offsets[key] = off
+        return off
+
+    def inc(self, key: str, amount: float):
+        off = self._offsets.get(key)
+        if off is None:
+            off = self._add(key)
+        struct.pack_into("d", self._mm, off, struct.unpack_from("d", self._mm, off)[0] + amount)
+
+    def set_max(self, key: str, value: float):
+        off = self._offsets.get(key)
+        if off is None:
+            off = self._add(key)
+        if value > struct.unpack_from("d", self._mm, off)[0]:
+            struct.pack_into("d", self._mm, off, value)
+
+
+def _entries(buf, used: int):
+    pos = 8
+    while pos + 4 <= used:
+        n = struct.unpack_from("I", buf, pos)[0]
+        key = bytes(buf[pos + 4:pos + 4 + n]).decode("utf-8")
+        off = pos + 4 + n + (8 - (4 + n) % 8) % 8
+        if off + 8 > used:
+            break
+        yield key, off, struct.unpack_from("d", buf, off)[0]
+        pos = off + 8
+
+
+def _read_file(path: str) -> dict[str, float]:
+    try:
+        with open(path, "rb") as f:
+            buf = f.read()
+    except OSError:
+        return {}
+    if len(buf) < 8:
+        return {}
+    used = min(struct.unpack_from("Q", buf, 0)[0], len(buf))
+    return {k: v for k, _, v in _entries(buf, used)}
+
+
+class _Store:
+    def __init__(self, directory: str = METRICS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file: _ValueFile | None = None
+        self._local: dict[str, float] = {}
+
+    def _own_file(self) -> _ValueFile:
+        if self._pid != os.getpid():
+            # spawn / fork した子プロセスは自分のファイルを作る
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = _ValueFile(os.path.join(self.directory, f"w{os.getpid()}.bin"))
+            self._pid = os.getpid()
+        return self._file
+
+    def inc(self, key: str, amount: float = 1.0):
+        with self._lock:
+            if not self.directory:
+                self._local[key] = self._local.get(key, 0.0) + amount
+                return
+            self._own_file().inc(key, amount)
+
+    def set_max(self, key: str, value: float):
+        with self._lock:
+            if not self.directory:
+                if value > self._local.get(key, 0.0):
+                    self._local[key] = value
+                return
+            self._own_file().set_max(key, value)
+
+    def collect(self) -> dict[str, float]:
+        """全プロセスの合計(MaxGauge は最大値)"""
+        if not self.directory:
+            with self._lock:
+                return dict(self._local)
+        total: dict[str, float] = {}
+        for path in glob.glob(os.path.join(self.directory, "w*.bin")):
+            for k, v in _read_file(path).items():
+                if k in total and _is_max(k):
+                    total[k] = max(total[k], v)
+                else:
+                    total[k] = total.get(k, 0.0) + v
+        return total
+
+
+STORE = _Store()
+
+
+# ------------------------------------------------------------------ #
+#  メトリクス
+# ------------------------------------------------------------------ #
+
+_FAMILIES: dict[str, "_Metric"] = {}
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _is_max(key: str) -> bool:
+    metric = _FAMILIES.get(key.split(_SEP, 1)[0])
+    return metric is not None and metric.kind == "gauge"
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._labels: dict[tuple, str] = {}
+        _FAMILIES[name] = self
+
+    def _labelstr(self, labels: dict) -> str:
+        values = tuple(labels.get(n, "") for n in self.labelnames)
+        s = self._labels.get(values)
+        if s is None:
+            s = self._labels[values] = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, values))
+        return s
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        STORE.inc(_SEP.join((self.name, "_total", self._labelstr(labels), "")), amount)
+
+
+class MaxGauge(_Metric):
+    """観測した最大値(プロセス起動からの。全プロセスの最大を返す)"""
+    kind = "gauge"
+
+    def observe(self, value: float, **labels):
+        STORE.set_max(_SEP.join((self.name, "", self._labelstr(labels), "")), value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        # バケットは「そのバケットに入った件数」で持ち、出力時に累積する(1回の観測で3つ足すだけ)
+        lb = self._labelstr(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        le = _fmt(self.buckets[i]) if i < len(self.buckets) else "+Inf"
+        STORE.inc(_SEP.join((self.name, "_bucket", lb, le)))
+        STORE.inc(_SEP.join((self.name, "_sum", lb, "")), value)
+        STORE.inc(_SEP.join((self.name, "_count", lb, "")))
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+
+def _fmt(v: float) -> str:
+    return repr(float(v)) if v != int(v) else f"{int(v)}.0"
+
+
+def _join(lb: str, extra: str) -> str:
+    inner = ",".join(x for x in (lb, extra) if x)
+    return "{" + inner + "}" if inner else ""
+
+
+def render() -> list[str]:
+    """全プロセスを合計した値を Prometheus のテキスト形式の行で返す"""
+    values = STORE.collect()
+    grouped: dict[str, list] = {}
+    for key, v in values.items():
+        name, suffix, lb, le = key.split(_SEP)
+        grouped.setdefault(name, []).append((suffix, lb, le, v))
+
+    lines = []
+    for name, metric in _FAMILIES.items():
+        samples = grouped.get(name)
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if metric.kind in ("counter", "gauge"):
+            for suffix, lb, _, v in sorted(samples):
+                lines.append(f"{name}{suffix}{_join(lb, '')} {v:g}")
+            continue
+        per_label: dict[str, dict] = {}
+        for suffix, lb, le, v in samples:
+            d = per_label.setdefault(lb, {"buckets": {}, "sum": 0.0, "count": 0.0})
+            if suffix == "_bucket":
+                d["buckets"][le] = v
+            else:
+                d[suffix[1:]] = v
+        for lb, d in sorted(per_label.items()):
+            acc = 0.0
+            for le in [_fmt(b) for b in metric.buckets] + ["+Inf"]:
+                acc += d["buckets"].get(le, 0.0)
+                le_label = f'le="{le}"'
+                lines.append(f"{name}_bucket{_join(lb, le_label)} {acc:g}")
+            lines.append(f"{name}_sum{_join(lb, '')} {d['sum']:.6f}")
+            lines.append(f"{name}_count{_join(lb, '')} {d['count']:g}")
+    return lines
+
+
+def samples(name: str) -> list[tuple[dict, float]]:
+    """カウンタ・MaxGauge の値をラベル(dict)ごとに(全プロセス分)"""
+    out = []
+    for key, v in STORE.collect().items():
+        fam, suffix, lb, _ = key.split(_SEP)
+        if fam == name and suffix in ("", "_total"):
+            out.append(({k: x.replace('\\"', '"').replace("\\\\", "\\") for k, x in _LABEL.findall(lb)}, v))
+    return out
+
+
+def total(name: str, **labels) -> float:
+    """カウンタの合計(labels で絞り込み。全プロセス分)"""
+    want = {k: str(v) for k, v in labels.items()}
+    return sum(v for lb, v in samples(name) if all(lb.get(k) == x for k, x in want.items()))
+
+
+# ------------------------------------------------------------------ #
+#  リクエスト・処理段階
+# ------------------------------------------------------------------ #
+
+REQUESTS = Counter("yabasa_http_requests", "エンドポイント・結果(ok / error)ごとのリクエスト数", ("endpoint", "outcome"))
+REQUEST_SECONDS = Histogram("yabasa_request_seconds", "エンドポイントごとの処理時間(秒)", ("endpoint",))
+STAGE_SECONDS = Histogram("yabasa_stage_seconds", "処理段階ごとの時間(秒)", ("endpoint", "stage"))
+CACHE_EVENTS = {
+    k: Counter(f"yabasa_cache_{k}", f"キャッシュの {k}(cache.py)", ("cache",))
+    for k in ("hits", "misses", "evictions", "expirations")
+}
+COALESCED = Counter("yabasa_coalesced_requests", "実行中の同じ処理に合流した件数(singleflight.py)", ("kind",))
+COALESCE_TIMEOUTS = Counter("yabasa_coalesce_timeouts", "合流先の処理を待ちきれなかった件数", ("kind",))
+
+_ENDPOINT: contextvars.ContextVar[str] = contextvars.ContextVar("yabasa_endpoint", default="other")
+
+
+def current_endpoint() -> str:
+    return _ENDPOINT.get()
+
+
+def set_endpoint(name: str):
+    """プロセスプールのワーカー側で、呼び出し元の endpoint を引き継ぐ"""
+    _ENDPOINT.set(name)
+
+
+@contextmanager
+def endpoint(name: str):
+    token = _ENDPOINT.set(name)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint=name)
+        _ENDPOINT.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - t0, endpoint=_ENDPOINT.get(), stage=name)
+
+
+def json_response(content):
+    """レスポンスの JSON 化を serialize 段階として測る(FastAPI が dict を返すときと同じ変換)"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    with stage("serialize"):
+        return JSONResponse(jsonable_encoder(content))
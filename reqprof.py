@@ -0,0 +1,217 @@
+"""
+reqprof.py
+1リクエスト分のプロファイル(/analyze・/ilora/concerns)。運用中に特定の求人票だけ遅いときの調査用。
+
+  curl -H "Authorization: Bearer $METRICS_TOKEN" -H "X-Yabasa-Profile: collapsed" \\
+       -H "Content-Type: application/json" -d '{"url": "..."}' http://host/analyze
+    → 通常のレスポンス + ヘッダ X-Yabasa-Profile-Id / X-Yabasa-Profile-Url
+  curl -H "Authorization: Bearer $METRICS_TOKEN" http://host/profiles/<id> > out.collapsed
+
+  - YABASA_PROFILE=1 のときだけ有効。無効なら要求のヘッダ・クエリも見ない
+  - 要求はヘッダ X-Yabasa-Profile かクエリ ?profile= に pstats / collapsed(1 は pstats)。
+    /metrics と同じ METRICS_TOKEN の Bearer が必要(無い・違うときは 401 / 403)
+  - 計測するリクエストは結果キャッシュ・URL キャッシュ・合流・プロセスプールを使わず、
+    取得・採点・図の描画をすべて呼び出し元のスレッドで行う(その求人票でかかる処理そのものを測る)
+  - pstats    : cProfile(全関数呼び出し。python -m pstats / snakeviz で見る)
+  - collapsed : PROFILE_INTERVAL_MS ごとのスタックのサンプリング。"a;b;c 回数" の1行1スタック
+                (flamegraph.pl / speedscope でそのまま読める)
+  - 同時に計測するのは PROFILE_MAX_CONCURRENT 件まで。超えたら 429(待たない)
+  - 成果物は PROFILE_DIR に置き、新しい方から PROFILE_KEEP 件を残す
+
+環境変数:
+  YABASA_PROFILE                : 1 で有効(既定: 0)
+  YABASA_PROFILE_DIR            : 保存先(既定: {YABASA_DATA_DIR}/profiles)
+  YABASA_PROFILE_MAX_CONCURRENT : 同時に計測する上限(既定: 1)
+  YABASA_PROFILE_KEEP           : 残す件数(既定: 50)
+  YABASA_PROFILE_INTERVAL_MS    : collapsed のサンプリング間隔(既定: 1)
+"""
+
+import os
+import re
+import sys
+import hmac
+import time
+import uuid
+import cProfile
+import threading
+import contextvars
+from pathlib import Path
+
+PROFILE_ENABLED = os.environ.get("YABASA_PROFILE", "0") == "1"
+DATA_DIR = Path(os.environ.get("YABASA_DATA_DIR", "data"))
+PROFILE_DIR = Path(os.environ.get("YABASA_PROFILE_DIR", str(DATA_DIR / "profiles")))
+PROFILE_MAX_CONCURRENT = int(os.environ.get("YABASA_PROFILE_MAX_CONCURRENT", "1"))
+PROFILE_KEEP = int(os.environ.get("YABASA_PROFILE_KEEP", "50"))
+PROFILE_INTERVAL_MS = float(os.environ.get("YABASA_PROFILE_INTERVAL_MS", "1"))
+
+PROFILE_HEADER = "X-Yabasa-Profile"
+FORMATS = {"1": "pstats", "pstats": "pstats", "collapsed": "collapsed"}
+_ID = re.compile(r"[0-9]{8}T[0-9]{6}-[a-z_]+-[0-9a-f]{8}\.(pstats|collapsed)")
+
+_ACTIVE: contextvars.ContextVar[bool] = contextvars.ContextVar("yabasa_profiling", default=False)
+
+
+class ProfileBusy(Exception):
+    """同時に計測できる上限に達している"""
+
+
+def active() -> bool:
+    """このリクエストを計測中か(キャッシュ・プロセスプールを使わずに処理する)"""
+    return _ACTIVE.get()
+
+
+# ------------------------------------------------------------------ #
+#  collapsed stacks(サンプリング)
+# ------------------------------------------------------------------ #
+
+class _StackSampler:
+    """対象スレッドのスタックを interval 秒ごとに採り、"a;b;c" → 回数 で数える"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profile", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in sorted(self.counts.items()):
+                f.write(f"{stack} {n}\n")
+
+
+# ------------------------------------------------------------------ #
+#  計測
+# ------------------------------------------------------------------ #
+
+class RequestProfiler:
+    def __init__(self, enabled: bool = PROFILE_ENABLED, directory: Path = PROFILE_DIR,
+                 max_concurrent: int = PROFILE_MAX_CONCURRENT, keep: int = PROFILE_KEEP,
+                 interval_ms: float = PROFILE_INTERVAL_MS):
+        self.enabled = enabled
+        self.directory = Path(directory)
+        self.keep = max(1, keep)
+        self.interval = max(0.0001, interval_ms / 1000)
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrent))
+        self._lock = threading.Lock()
+        self.profiled = 0
+        self.rejected = 0
+
+    def requested(self, request) -> str | None:
+        """
+        計測の要求があれば形式(pstats / collapsed)、無ければ None。
+        要求があるのにトークンが無い・違う・形式が不明なら HTTPException
+        """
+        if not self.enabled:
+            return None
+        value = request.headers.get(PROFILE_HEADER) or request.query_params.get("profile")
+        if not value:
+            return None
+        from fastapi import HTTPException
+        _check_token(request)
+        fmt = FORMATS.get(value.strip().lower())
+        if fmt is None:
+            raise HTTPException(status_code=400, detail=f"{PROFILE_HEADER} は pstats か collapsed を指定してください。")
+        return fmt
+
+    def run(self, fmt: str, name: str, fn):
+        """fn() を計測しながら実行する。戻り値: (fn の結果, プロファイル ID)。上限に達していれば ProfileBusy"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ProfileBusy(f"同時に計測できるのは {PROFILE_MAX_CONCURRENT} 件までです")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            profile_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{name}-{uuid.uuid4().hex[:8]}.{fmt}"
+            path = self.directory / profile_id
+            token = _ACTIVE.set(True)
+            try:
+                if fmt == "pstats":
+                    prof = cProfile.Profile()
+                    prof.enable()
+                    try:
+                        result = fn()
+                    finally:
+                        prof.disable()
+                    prof.dump_stats(path)
+                else:
+                    with _StackSampler(threading.get_ident(), self.interval) as sampler:
+                        result = fn()
+                    sampler.dump(path)
+            finally:
+                _ACTIVE.reset(token)
+            with self._lock:
+                self.profiled += 1
+            self._prune()
+            return result, profile_id
+        finally:
+            self._slots.release()
+
+    def _prune(self):
+        files = sorted(self.directory.glob("*.*"), key=lambda p: p.name, reverse=True)
+        for p in files[self.keep:]:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+
+    def path(self, profile_id: str) -> Path | None:
+        """保存済みの成果物のパス(ID の形でないもの・無いものは None)"""
+        if not _ID.fullmatch(profile_id):
+            return None
+        p = self.directory / profile_id
+        return p if p.is_file() else None
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "profiled": self.profiled, "rejected": self.rejected}
+
+
+def _check_token(request):
+    # /metrics と同じトークン(api_app._require_token と同じ判定)
+    from fastapi import HTTPException
+    expected = os.environ.get("METRICS_TOKEN", "")
+    if not expected:
+        raise HTTPException(status_code=401, detail="METRICS_TOKEN が未設定です")
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Authorization: Bearer <token> が必要です")
+    if not hmac.compare_digest(auth.split(" ", 1)[1].strip(), expected):
+        raise HTTPException(status_code=403, detail="無効なトークンです")
+
+
+REQUEST_PROFILER = RequestProfiler()
+
+
+def profiled_response(fmt: str, name: str, fn):
+    """
+    fn()(Response を返す)を計測して、レスポンスに X-Yabasa-Profile-Id / -Url を付ける。
+    上限に達していれば 429
+    """
+    from fastapi import HTTPException
+    try:
+        response, profile_id = REQUEST_PROFILER.run(fmt, name, fn)
+    except ProfileBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    response.headers["X-Yabasa-Profile-Id"] = profile_id
+    response.headers["X-Yabasa-Profile-Url"] = f"/profiles/{profile_id}"
+    return response
@@ -0,0 +1,135 @@
+"""
+ruleprof.py
+ルールごとの評価回数・ヒット数・所要時間の計測(抽出。既定は無効)。重いルールやヒットしないルールを探す用。
+
+  - RULE_PROFILE_RATE の割合のリクエストだけ、MultiMatcher.match_all でルールごとに時間を測る
+    (計測しないリクエストは乱数を1回引くだけ。0 なら何もしない)
+  - プリフィルタで落ちたルールは評価していないので数えない(評価回数 / 計測件数 = プリフィルタの通過率)
+  - 値は mpmetrics に入れる(全ワーカーの合計。/metrics の yabasa_rule_*)。採点プール(batch.py)の
+    ワーカーで測った分も、YABASA_METRICS_DIR を設定しなくても mpmetrics の起動ごとのディレクトリで合計される
+  - ウォームアップの照合(ruleset.warm_rulesets)は数えない
+  - 入力の長さ(前処理後の文字数)を 1k / 4k / 16k / 64k / inf の区分で分けて数える
+
+  /metrics                   : yabasa_rule_evaluations_total{rule_id, length}、yabasa_rule_matches_total{rule_id}、
+                               yabasa_rule_seconds_total{rule_id, length}、yabasa_rule_max_seconds{rule_id}、
+                               yabasa_rule_profile_samples_total{length}
+  POST /admin/rules          : report() の順位付きの一覧(api_app.py)
+
+環境変数:
+  YABASA_RULE_PROFILE_RATE : 計測するリクエストの割合(0〜1。既定: 0 = 計測しない)
+"""
+
+import os
+import random
+
+from mpmetrics import Counter, MaxGauge, samples
+
+RULE_PROFILE_RATE = float(os.environ.get("YABASA_RULE_PROFILE_RATE", "0"))
+
+LENGTH_BUCKETS = ((1024, "1k"), (4096, "4k"), (16384, "16k"), (65536, "64k"))
+LENGTH_LABELS = tuple(label for _, label in LENGTH_BUCKETS) + ("inf",)
+
+SORT_KEYS = ("seconds", "max_seconds", "mean_seconds", "evaluations", "matches", "hit_rate")
+
+PROFILE_SAMPLES = Counter("yabasa_rule_profile_samples", "ルールの計測をしたリクエスト数(入力の長さ別)", ("length",))
+RULE_EVALUATIONS = Counter("yabasa_rule_evaluations", "計測したリクエストでルールの正規表現を評価した回数", ("rule_id", "length"))
+RULE_MATCHES = Counter("yabasa_rule_matches", "計測したリクエストでルールがヒットした回数", ("rule_id",))
+RULE_SECONDS = Counter("yabasa_rule_seconds", "計測したリクエストでのルールの評価時間の累計(秒)", ("rule_id", "length"))
+RULE_MAX_SECONDS = MaxGauge("yabasa_rule_max_seconds", "ルール1回の評価時間の最大(秒)", ("rule_id",))
+
+
+def length_bucket(n: int) -> str:
+    for limit, label in LENGTH_BUCKETS:
+        if n < limit:
+            return label
+    return "inf"
+
+
+class RuleProfiler:
+    def __init__(self, rate: float = RULE_PROFILE_RATE):
+        self.rate = rate
+
+    def sample(self) -> list | None:
+        """このリクエストを計測するなら記録用の空リスト、しないなら None"""
+        if self.rate <= 0 or (self.rate < 1 and random.random() >= self.rate):
+            return None
+        return []
+
+    def record(self, text_len: int, entries: list):
+        """match_all(profile=...) が追記した (rule_id, 秒, ヒットしたか) を記録する"""
+        length = length_bucket(text_len)
+        PROFILE_SAMPLES.inc(length=length)
+        for rule_id, seconds, matched in entries:
+            RULE_EVALUATIONS.inc(rule_id=rule_id, length=length)
+            RULE_SECONDS.inc(seconds, rule_id=rule_id, length=length)
+            RULE_MAX_SECONDS.observe(seconds, rule_id=rule_id)
+            if matched:
+                RULE_MATCHES.inc(rule_id=rule_id)
+
+
+PROFILER = RuleProfiler()
+
+
+def _empty() -> dict:
+    return {"evaluations": 0, "matches": 0, "seconds": 0.0, "max_seconds": 0.0,
+            "by_length": {label: {"evaluations": 0, "seconds": 0.0} for label in LENGTH_LABELS}}
+
+
+def report(rules: dict, sort: str = "seconds", limit: int | None = None) -> dict:
+    """
+    rules(rule_id → CompiledRule)の計測結果を sort の降順で並べる(全ワーカー分)。
+    dead は計測中に一度もヒットしなかったルール(評価されなかったものを含む)。
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort は {' / '.join(SORT_KEYS)} のいずれかを指定してください: {sort!r}")
+
+    per_length = {label: 0 for label in LENGTH_LABELS}
+    for lb, v in samples("yabasa_rule_profile_samples"):
+        per_length[lb.get("length", "inf")] = int(v)
+    n_samples = sum(per_length.values())
+
+    stats = {rid: _empty() for rid in rules}
+
+    for lb, v in samples("yabasa_rule_evaluations"):
+        st = stats.setdefault(lb["rule_id"], _empty())
+        st["evaluations"] += int(v)
+        st["by_length"][lb["length"]]["evaluations"] += int(v)
+    for lb, v in samples("yabasa_rule_seconds"):
+        st = stats.setdefault(lb["rule_id"], _empty())
+        st["seconds"] += v
+        st["by_length"][lb["length"]]["seconds"] += v
+    for lb, v in samples("yabasa_rule_matches"):
+        stats.setdefault(lb["rule_id"], _empty())["matches"] += int(v)
+    for lb, v in samples("yabasa_rule_max_seconds"):
+        stats.setdefault(lb["rule_id"], _empty())["max_seconds"] = v
+
+    rows = []
+    for rid, st in stats.items():
+        r = rules.get(rid)
+        ev = st["evaluations"]
+        rows.append({
+            "rule_id": rid,
+            "category": r.category if r else None,
+            "kind": r.kind if r else None,
+            "pattern": r.pattern if r else None,
+            "evaluations": ev,
+            "matches": st["matches"],
+            "hit_rate": round(st["matches"] / ev, 4) if ev else 0.0,
+            "eval_rate": round(ev / n_samples, 4) if n_samples else 0.0,
+            "seconds": round(st["seconds"], 6),
+            "mean_seconds": round(st["seconds"] / ev, 9) if ev else 0.0,
+            "max_seconds": round(st["max_seconds"], 6),
+            "by_length": {k: {"evaluations": b["evaluations"], "seconds": round(b["seconds"], 6)}
+                          for k, b in st["by_length"].items() if b["evaluations"]},
+        })
+    rows.sort(key=lambda x: (-x[sort], x["rule_id"]))
+
+    return {
+        "enabled": PROFILER.rate > 0,
+        "sample_rate": PROFILER.rate,
+        "samples": n_samples,
+        "samples_by_length": per_length,
+        "sort": sort,
+        "rules": rows[:limit] if limit else rows,
+        "dead": sorted(x["rule_id"] for x in rows if x["matches"] == 0) if n_samples else [],
+    }
@@ -1,5 +1,9 @@
-from bs4 import BeautifulSoup
-import requests, re, unicodedata
+import re, unicodedata
+from ruleset import RULE_FLAGS, register_layer, build_variant, collect_evidence, span_preview, finish_spans
+from fetch_cache import FETCH_CACHE
+from hostsched import HOST_SCHEDULER
+from htmltext import extract_text, HtmlTextStream, header_charset, FETCH_MAX_BYTES, MAX_TEXT_CHARS
+from mpmetrics import stage
 
 MAX_PER_CATEGORY = 5
 
@@ -94,29 +98,51 @@ SAFE_GUARDS = {
   ],
 }
 
+# import 時に一度だけコンパイル（score_text はこの RuleSet 上で動く）
+register_layer("base", RULES_BASE, SAFE_GUARDS)
+RULESET_BASE = build_variant("base", "standard", ["base"])
+
 THRESHOLDS=[(0,6,"低（比較的安全）"),(7,12,"中（注意が必要）"),(13,999,"高（ブラックの可能性大）")]
 
+def _finish_text(raw:str)->str:
+  text=re.sub(r"\n{2,}","\n",raw)
+  return preprocess_text(text)[:MAX_TEXT_CHARS]
+
+def html_to_text(html:str)->str:
+  # HTML → 前処理済み本文（htmltext.py の逐次抽出。script/style/noscript は読み飛ばし、本文が集まったら打ち切る）
+  return _finish_text(extract_text(html))
+
+def stream_to_text(chunks, charset:str|None=None, max_bytes:int=FETCH_MAX_BYTES)->str:
+  # バイト列のチャンクを順に抽出する（本文が十分集まるか max_bytes に達したら残りは読まない）
+  st=HtmlTextStream(charset, max_bytes)
+  for chunk in chunks:
+    if st.feed(chunk):
+      break
+  return _finish_text(st.text())
+
 def fetch_text_from_url(url:str)->str:
+  # ディスクの取得キャッシュ(fetch_cache.py)を通す: 新鮮ならそのまま、古ければ条件付き GET
+  text, entry = FETCH_CACHE.lookup(url)
+  if text is not None:
+    return text
+  import requests  # 起動を軽くするため初回の取得時に読み込む
   try:
-    r=requests.get(url,headers={"User-Agent":"Mozilla/5.0"},timeout=20); r.raise_for_status()
-    soup=BeautifulSoup(r.text,"html.parser")
-    for t in soup(["script","style","noscript"]): t.decompose()
-    text=soup.get_text("\n")
-    text=re.sub(r"\n{2,}","\n",text)
-    return preprocess_text(text)[:80000]
+    headers={"User-Agent":"Mozilla/5.0", **FETCH_CACHE.conditional_headers(entry)}
+    # ホストごとの同時数・間隔・ブレーカー(hostsched.py)を通してから接続する
+    # 本体は全部読まずに少しずつ抽出する（巨大なページでもメモリは上限バイト数まで）
+    with HOST_SCHEDULER.slot(url) as slot, requests.get(url,headers=headers,timeout=20,stream=True) as r:
+      slot.status=r.status_code
+      if r.status_code==304 and entry:
+        return FETCH_CACHE.not_modified(url, entry, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+      r.raise_for_status()
+      text=stream_to_text(r.iter_content(64*1024), header_charset(r.headers.get("Content-Type")))
+    FETCH_CACHE.put(url, text, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+    return text
   except Exception:
     return ""
 
 def _collect_evidence(text: str, pattern: str, window: int = 40) -> list[str]:
-  out = []
-  for m in re.finditer(pattern, text, flags=re.IGNORECASE|re.DOTALL):
-    s = max(0, m.start()-window); e = min(len(text), m.end()+window)
-    snippet = text[s:e].replace("\n"," ")
-    matched = text[m.start():m.end()]
-    snippet = snippet.replace(matched, f"<mark style='color:#ff5d5d; font-weight:bold;'>{matched}</mark>")
-    out.append(snippet)
-    if len(out) >= 3: break
-  return out
+  return collect_evidence(text, re.compile(pattern, RULE_FLAGS), window)
 
 def _katakana_density(text: str) -> float:
   kat = len(re.findall(r"[ァ-ヴー]", text))
@@ -133,49 +159,49 @@ def _wide_salary_range(text: str):
     hits.append((300,1000,0,0))
   return hits
 
-def score_text(text: str, sector: str | None = None):
-  text = preprocess_text(text or "")
-  cat_scores = {}; cat_hits = {}; cat_safe_hits = {}; cat_evidence = {}; measured_flags = {}
-
-  for cat, rs in RULES_BASE.items():
-    score = 0; hits = []; evidence=[]; measured = False
-    for rule in rs:
-      if re.search(rule["pattern"], text, flags=re.IGNORECASE|re.DOTALL):
-        score += rule["weight"]
-        hits.append({"pattern": rule["pattern"], "weight": rule["weight"], "reason": rule["reason"]})
-        evidence.extend(_collect_evidence(text, rule["pattern"]))
-        measured = True
-    safe_hits=[]
-    for guard in SAFE_GUARDS.get(cat, []):
-      if re.search(guard["pattern"], text, flags=re.IGNORECASE|re.DOTALL):
-        score -= guard["negative_weight"]
-        safe_hits.append(guard)
-        measured = True
-
-    score = max(0, min(score, MAX_PER_CATEGORY))
-    cat_scores[cat]=score; cat_hits[cat]=hits; cat_safe_hits[cat]=safe_hits; cat_evidence[cat]=evidence[:3]; measured_flags[cat]=measured
+def _salary_spans(text: str, ranges, cat: str = "給与・待遇") -> list[dict]:
+  # (300,1000,0,0) は本文全体からの推定なので位置を持たない
+  return [{"start": s, "end": e, "category": cat, "rule_id": "SALARY_RANGE_WIDE", "match": span_preview(text, s, e)}
+          for _,_,s,e in ranges[:2] if e > s]
+
+def score_text(text: str, sector: str | None = None, with_spans: bool = False):
+  """
+  with_spans=True のときは末尾に evidence_spans([{start, end, category, rule_id, match}, ...]、
+  前処理後テキストに対するオフセット。出現順に先頭 MAX_EVIDENCE_SPANS 件、match は短いプレビュー)と budget_skipped(時間予算切れで
+  評価しなかったルール。空でなければ一部のルールだけの結果。ruleset.RuleSet.score)を加えた8要素を返す。
+  """
+  with stage("preprocess"):
+    text = preprocess_text(text or "")
+  with stage("rules"):
+    cat_scores, rule_hits, cat_safe_hits, cat_evidence, measured_flags, spans, skipped = RULESET_BASE.score(text, MAX_PER_CATEGORY)
+  cat_hits = {cat: [{"pattern": h["pattern"], "weight": h["weight"], "reason": h["reason"]} for h in hs]
+              for cat, hs in rule_hits.items()}
 
   # 追加ヒューリスティクス
-  dens = _katakana_density(text)
-  if dens >= 0.18:
-    cat = "求人票サイン"
-    cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat,0) + 1)
-    cat_hits.setdefault(cat, []).append({"pattern": "KATAKANA_DENSITY>=0.18", "weight": 1, "reason":"見慣れない横文字の職種が多い可能性"})
-    cat_evidence.setdefault(cat, []).append("… カタカナ語が多い（比率{:.0%}） …".format(dens))
-    measured_flags[cat] = True
-
-  ranges = _wide_salary_range(text)
-  if ranges:
-    cat = "給与・待遇"
-    add = 2 if any(hi-lo>=500 for lo,hi,_,_ in ranges) else 1
-    cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat,0) + add)
-    cat_hits.setdefault(cat, []).append({"pattern": "SALARY_RANGE_WIDE", "weight": add, "reason":"年収幅が広すぎる（例：300万〜1000万）"})
-    for _,_,s,e in ranges[:2]:
-      snippet = text[max(0,s-40):min(len(text),e+40)].replace("\n"," ")
-      cat_evidence.setdefault(cat, []).append("… " + snippet + " …")
-    measured_flags[cat] = True
+  with stage("heuristics"):
+    dens = _katakana_density(text)
+    if dens >= 0.18:
+      cat = "求人票サイン"
+      cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat,0) + 1)
+      cat_hits.setdefault(cat, []).append({"pattern": "KATAKANA_DENSITY>=0.18", "weight": 1, "reason":"見慣れない横文字の職種が多い可能性"})
+      cat_evidence.setdefault(cat, []).append("… カタカナ語が多い（比率{:.0%}） …".format(dens))
+      measured_flags[cat] = True
+
+    ranges = _wide_salary_range(text)
+    if ranges:
+      cat = "給与・待遇"
+      add = 2 if any(hi-lo>=500 for lo,hi,_,_ in ranges) else 1
+      cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat,0) + add)
+      cat_hits.setdefault(cat, []).append({"pattern": "SALARY_RANGE_WIDE", "weight": add, "reason":"年収幅が広すぎる（例：300万〜1000万）"})
+      for _,_,s,e in ranges[:2]:
+        snippet = text[max(0,s-40):min(len(text),e+40)].replace("\n"," ")
+        cat_evidence.setdefault(cat, []).append("… " + snippet + " …")
+      spans.extend(_salary_spans(text, ranges, cat))
+      measured_flags[cat] = True
 
   total = sum(cat_scores.values())
+  if with_spans:
+    return cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags, finish_spans(spans), skipped
   return cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags
 
 def label_total(total: int) -> str:
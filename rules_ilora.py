@@ -20,6 +20,8 @@ from rules import (
     RULES_BASE,
     SAFE_GUARDS,
 )
+from ruleset import register_layer, build_variant, get_ruleset, finish_spans
+from mpmetrics import stage
 import re
 
 # ------------------------------------------------------------------ #
@@ -76,6 +78,11 @@ SAFE_GUARDS_LIFECYCLE = {
     ]
 }
 
+# import 時に persona 別バリアントを合成しておく
+register_layer("lifecycle", RULES_LIFECYCLE, SAFE_GUARDS_LIFECYCLE)
+build_variant("ilora", "standard", ["base"])
+build_variant("ilora", "lifecycle", ["base", "lifecycle"])
+
 # DISPLAY_NAME_MAP を拡張
 DISPLAY_NAME_MAP_EX = {
     **DISPLAY_NAME_MAP,
@@ -202,83 +209,52 @@ QUESTION_BANK = {
 #  拡張スコアリング関数（ライフステージ込み）
 # ------------------------------------------------------------------ #
 
-def score_text_ilora(text: str, persona: str = "standard"):
+def score_text_ilora(text: str, persona: str = "standard", with_spans: bool = False):
     """
     persona: "standard" | "lifecycle"
       lifecycle = 35歳以上・子持ち女性向けに ライフステージ適合 カテゴリも評価
+    with_spans=True のときは末尾に evidence_spans と budget_skipped を加えた8要素を返す(rules.score_text と同じ。
+    evidence_spans には score_text_v48 と同じく年収幅のヒット位置も入る)。
     """
-    from rules import (
-        preprocess_text, _collect_evidence, _katakana_density, _wide_salary_range
-    )
-    import re
-
-    text = preprocess_text(text or "")
-
-    # --- 元の rules.py の RULES_BASE + 拡張カテゴリ ---
-    rules_all = dict(RULES_BASE)
-    safe_all = dict(SAFE_GUARDS)
-
-    if persona == "lifecycle":
-        rules_all.update(RULES_LIFECYCLE)
-        safe_all.update(SAFE_GUARDS_LIFECYCLE)
-
-    cat_scores = {}
-    cat_hits = {}
-    cat_safe_hits = {}
-    cat_evidence = {}
-    measured_flags = {}
-
-    for cat, rs in rules_all.items():
-        score = 0
-        hits = []
-        evidence = []
-        measured = False
-
-        for rule in rs:
-            if re.search(rule["pattern"], text, flags=re.IGNORECASE | re.DOTALL):
-                score += rule["weight"]
-                hits.append(rule)
-                evidence.extend(_collect_evidence(text, rule["pattern"]))
-                measured = True
-
-        safe_hits = []
-        for guard in safe_all.get(cat, []):
-            if re.search(guard["pattern"], text, flags=re.IGNORECASE | re.DOTALL):
-                score -= guard["negative_weight"]
-                safe_hits.append(guard)
-                measured = True
-
-        score = max(0, min(score, MAX_PER_CATEGORY))
-        cat_scores[cat] = score
-        cat_hits[cat] = hits
-        cat_safe_hits[cat] = safe_hits
-        cat_evidence[cat] = evidence[:3]
-        measured_flags[cat] = measured
-
-    # カタカナ密度
-    dens = _katakana_density(text)
-    if dens >= 0.18:
-        cat = "求人票サイン"
-        cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + 1)
-        cat_hits.setdefault(cat, []).append({
-            "pattern": "KATAKANA_DENSITY>=0.18", "weight": 1,
-            "reason": "見慣れない横文字の職種が多い可能性"
-        })
-        measured_flags[cat] = True
-
-    # 年収幅
-    ranges = _wide_salary_range(text)
-    if ranges:
-        cat = "給与・待遇"
-        add = 2 if any(hi - lo >= 500 for lo, hi, _, _ in ranges) else 1
-        cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + add)
-        cat_hits.setdefault(cat, []).append({
-            "pattern": "SALARY_RANGE_WIDE", "weight": add,
-            "reason": "年収幅が広すぎる（例：300万〜1000万）"
-        })
-        measured_flags[cat] = True
+    from rules import _katakana_density, _wide_salary_range, _salary_spans
+
+    with stage("preprocess"):
+        text = preprocess_text(text or "")
+
+    # --- 元の rules.py の RULES_BASE + 拡張カテゴリ(合成済み RuleSet) ---
+    ruleset = get_ruleset("ilora", persona)
+    with stage("rules"):
+        cat_scores, cat_hits, cat_safe_hits, cat_evidence, measured_flags, spans, skipped = \
+            ruleset.score(text, MAX_PER_CATEGORY)
+
+    with stage("heuristics"):
+        # カタカナ密度
+        dens = _katakana_density(text)
+        if dens >= 0.18:
+            cat = "求人票サイン"
+            cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + 1)
+            cat_hits.setdefault(cat, []).append({
+                "pattern": "KATAKANA_DENSITY>=0.18", "weight": 1,
+                "reason": "見慣れない横文字の職種が多い可能性"
+            })
+            measured_flags[cat] = True
+
+        # 年収幅
+        ranges = _wide_salary_range(text)
+        if ranges:
+            cat = "給与・待遇"
+            add = 2 if any(hi - lo >= 500 for lo, hi, _, _ in ranges) else 1
+            cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + add)
+            cat_hits.setdefault(cat, []).append({
+                "pattern": "SALARY_RANGE_WIDE", "weight": add,
+                "reason": "年収幅が広すぎる（例：300万〜1000万）"
+            })
+            spans.extend(_salary_spans(text, ranges, cat))
+            measured_flags[cat] = True
 
     total = sum(cat_scores.values())
+    if with_spans:
+        return cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags, finish_spans(spans), skipped
     return cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags
 
 
@@ -22,6 +22,8 @@ from rules_ilora import (
     DISPLAY_NAME_MAP_EX,
     QUESTION_BANK,
 )
+from ruleset import register_layer, build_variant, get_ruleset, finish_spans
+from mpmetrics import stage
 
 
 # ------------------------------------------------------------------ #
@@ -159,6 +161,17 @@ SAFE_GUARDS_EVAL_GROWTH = {
 }
 
 
+# ------------------------------------------------------------------ #
+#  RuleSet バリアント(import 時に一度だけ合成)
+#  組織フェーズ・評価・成長は persona 非依存で常に追加
+# ------------------------------------------------------------------ #
+
+register_layer("org_phase", RULES_ORG_PHASE, SAFE_GUARDS_ORG_PHASE)
+register_layer("eval_growth", RULES_EVAL_GROWTH, SAFE_GUARDS_EVAL_GROWTH)
+build_variant("v48", "standard", ["base", "org_phase", "eval_growth"])
+build_variant("v48", "lifecycle", ["base", "lifecycle", "org_phase", "eval_growth"])
+
+
 # ------------------------------------------------------------------ #
 #  DISPLAY_NAME_MAP を v4.8 用に拡張
 # ------------------------------------------------------------------ #
@@ -226,7 +239,7 @@ QUESTION_BANK_V48 = {
 #  統合スコアリング関数(v4.8)
 # ------------------------------------------------------------------ #
 
-def score_text_v48(text: str, persona: str = "standard"):
+def score_text_v48(text: str, persona: str = "standard", with_spans: bool = False):
     """
     v4.8: rules.py + rules_ilora.py(ライフステージ) + rules_v48.py の統合スコアリング。
 
@@ -235,94 +248,57 @@ def score_text_v48(text: str, persona: str = "standard"):
         "lifecycle" = 基本カテゴリ + ライフステージ + 組織フェーズ + 評価・成長
 
     戻り値: (cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags)
+    with_spans=True のときは末尾に evidence_spans([{start, end, category, rule_id, match}, ...]、
+    前処理後テキストに対するオフセット。出現順に先頭 MAX_EVIDENCE_SPANS 件、match は短いプレビュー)と budget_skipped(時間予算切れで
+    評価しなかったルール。ruleset.RuleSet.score)を加えた8要素。
     """
-    from rules import (
-        RULES_BASE, SAFE_GUARDS,
-        _collect_evidence, _katakana_density, _wide_salary_range,
-    )
-
-    text = preprocess_text(text or "")
-
-    # --- ルールセットの統合 ---
-    rules_all = dict(RULES_BASE)
-    safe_all = dict(SAFE_GUARDS)
-
-    # lifecycle persona時はライフステージ適合を追加
-    if persona == "lifecycle":
-        rules_all.update(RULES_LIFECYCLE)
-        safe_all.update(SAFE_GUARDS_LIFECYCLE)
-
-    # v4.8: 組織フェーズ・評価・成長は常に追加(persona非依存)
-    rules_all.update(RULES_ORG_PHASE)
-    rules_all.update(RULES_EVAL_GROWTH)
-    safe_all.update(SAFE_GUARDS_ORG_PHASE)
-    safe_all.update(SAFE_GUARDS_EVAL_GROWTH)
-
-    cat_scores = {}
-    cat_hits = {}
-    cat_safe_hits = {}
-    cat_evidence = {}
-    measured_flags = {}
-
-    for cat, rs in rules_all.items():
-        score = 0
-        hits = []
-        evidence = []
-        measured = False
-
-        for rule in rs:
-            if re.search(rule["pattern"], text, flags=re.IGNORECASE | re.DOTALL):
-                score += rule["weight"]
-                hits.append(rule)
-                evidence.extend(_collect_evidence(text, rule["pattern"]))
-                measured = True
-
-        safe_hits = []
-        for guard in safe_all.get(cat, []):
-            if re.search(guard["pattern"], text, flags=re.IGNORECASE | re.DOTALL):
-                score -= guard["negative_weight"]
-                safe_hits.append(guard)
-                measured = True
-
-        score = max(0, min(score, MAX_PER_CATEGORY))
-        cat_scores[cat] = score
-        cat_hits[cat] = hits
-        cat_safe_hits[cat] = safe_hits
-        cat_evidence[cat] = evidence[:3]
-        measured_flags[cat] = measured
-
-    # --- カタカナ密度(既存ロジック) ---
-    dens = _katakana_density(text)
-    if dens >= 0.18:
-        cat = "求人票サイン"
-        cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + 1)
-        cat_hits.setdefault(cat, []).append({
-            "pattern": "KATAKANA_DENSITY>=0.18",
-            "weight": 1,
-            "reason": "見慣れない横文字の職種が多い可能性"
-        })
-        cat_evidence.setdefault(cat, []).append(
-            "… カタカナ語が多い(比率{:.0%}) …".format(dens)
-        )
-        measured_flags[cat] = True
-
-    # --- 年収幅(既存ロジック) ---
-    ranges = _wide_salary_range(text)
-    if ranges:
-        cat = "給与・待遇"
-        add = 2 if any(hi - lo >= 500 for lo, hi, _, _ in ranges) else 1
-        cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + add)
-        cat_hits.setdefault(cat, []).append({
-            "pattern": "SALARY_RANGE_WIDE",
-            "weight": add,
-            "reason": "年収幅が広すぎる(例:300万〜1000万)"
-        })
-        for _, _, s, e in ranges[:2]:
-            snippet = text[max(0, s-40):min(len(text), e+40)].replace("\n", " ")
-            cat_evidence.setdefault(cat, []).append("… " + snippet + " …")
-        measured_flags[cat] = True
+    from rules import _katakana_density, _wide_salary_range, _salary_spans
+
+    with stage("preprocess"):
+        text = preprocess_text(text or "")
+
+    # --- ルールセット(persona 別に合成・コンパイル済み) ---
+    ruleset = get_ruleset("v48", persona)
+    with stage("rules"):
+        cat_scores, cat_hits, cat_safe_hits, cat_evidence, measured_flags, spans, skipped = \
+            ruleset.score(text, MAX_PER_CATEGORY)
+
+    with stage("heuristics"):
+        # --- カタカナ密度(既存ロジック) ---
+        dens = _katakana_density(text)
+        if dens >= 0.18:
+            cat = "求人票サイン"
+            cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + 1)
+            cat_hits.setdefault(cat, []).append({
+                "pattern": "KATAKANA_DENSITY>=0.18",
+                "weight": 1,
+                "reason": "見慣れない横文字の職種が多い可能性"
+            })
+            cat_evidence.setdefault(cat, []).append(
+                "… カタカナ語が多い(比率{:.0%}) …".format(dens)
+            )
+            measured_flags[cat] = True
+
+        # --- 年収幅(既存ロジック) ---
+        ranges = _wide_salary_range(text)
+        if ranges:
+            cat = "給与・待遇"
+            add = 2 if any(hi - lo >= 500 for lo, hi, _, _ in ranges) else 1
+            cat_scores[cat] = min(MAX_PER_CATEGORY, cat_scores.get(cat, 0) + add)
+            cat_hits.setdefault(cat, []).append({
+                "pattern": "SALARY_RANGE_WIDE",
+                "weight": add,
+                "reason": "年収幅が広すぎる(例:300万〜1000万)"
+            })
+            for _, _, s, e in ranges[:2]:
+                snippet = text[max(0, s-40):min(len(text), e+40)].replace("\n", " ")
+                cat_evidence.setdefault(cat, []).append("… " + snippet + " …")
+            spans.extend(_salary_spans(text, ranges, cat))
+            measured_flags[cat] = True
 
     total = sum(cat_scores.values())
+    if with_spans:
+        return cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags, finish_spans(spans), skipped
     return cat_scores, cat_hits, cat_safe_hits, cat_evidence, total, measured_flags
 
 
@@ -0,0 +1,343 @@
+"""
+ruleset.py
+rules.py / rules_ilora.py / rules_v48.py のルール定義(パターン文字列の dict)を
+import 時に一度だけコンパイルし、persona × ルールセットバージョンごとの
+合成済みバリアント(RuleSet)として保持する。
+
+照合器(MultiMatcher。組み立てが重い)はバリアントごとに最初の照合時に作る。
+API は起動時に warm_rulesets() で全バリアント分を作っておく(起動直後のリクエストが遅れない)。
+
+設計方針:
+  - ルール定義(RULES_BASE 等の dict)は従来どおり各 rules_*.py に置く
+  - 各 rules_*.py は import 時に register_layer() / build_variant() を呼ぶだけ
+  - スコア計算は RuleSet.score() に集約し、score_text / score_text_ilora /
+    score_text_v48 は出力形式とヒューリスティクスの差分だけを持つ
+
+ルールID:
+  "{レイヤ名}.{risk|safe}.{カテゴリ番号}.{ルール番号}" (例: "base.risk.1.3")
+  カテゴリ・ルールの末尾追加では既存IDは変わらない。
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+
+from matcher import MultiMatcher, bound_gaps
+from ruleprof import PROFILER
+
+RULE_FLAGS = re.IGNORECASE | re.DOTALL
+
+# マッチングエンジン側の変更でキャッシュ等を無効化したいときに上げる
+ENGINE_VERSION = "3"
+
+# エビデンスとして残す1ルールあたりの最大ヒット数
+EVIDENCE_PER_RULE = 3
+
+# evidence_spans の件数の上限(従来の evidence の一覧と同じ 12 件)と、match に入れるプレビューの最大文字数
+# (.* を含むルールは1件で本文のほとんどにかかることがある。全文は start / end で本文から取り出す)
+MAX_EVIDENCE_SPANS = 12
+SPAN_PREVIEW_CHARS = 40
+
+# 正規表現の実行モード
+#   exact   : ルール定義どおりに実行(既定・従来の挙動)
+#   bounded : 無制限の .* / .*? / .+ を REGEX_GAP 文字までに制限し(最悪でも入力長に線形)、
+#             ルール単位・リクエスト単位の時間予算を課す。予算超過は /metrics に出る
+REGEX_MODE = os.environ.get("YABASA_REGEX_MODE", "exact").lower()
+REGEX_GAP = int(os.environ.get("YABASA_REGEX_GAP", "300"))
+RULE_BUDGET_MS = float(os.environ.get("YABASA_RULE_BUDGET_MS", "50"))
+REQUEST_BUDGET_MS = float(os.environ.get("YABASA_REQUEST_BUDGET_MS", "500"))
+
+
+# ------------------------------------------------------------------ #
+#  コンパイル済みルール / レイヤ
+# ------------------------------------------------------------------ #
+
+class CompiledRule:
+    """1パターン分のコンパイル済みルール。rule は元の dict(ヒット時にそのまま返す)。"""
+
+    __slots__ = ("rule_id", "layer", "category", "kind", "regex", "bounded", "weight", "rule")
+
+    def __init__(self, rule_id: str, layer: str, category: str, kind: str, rule: dict):
+        self.rule_id = rule_id
+        self.layer = layer
+        self.category = category
+        self.kind = kind  # "risk" | "safe"
+        self.rule = rule
+        self.regex = re.compile(rule["pattern"], RULE_FLAGS)
+        bounded = bound_gaps(rule["pattern"], REGEX_GAP)
+        self.bounded = self.regex if bounded == rule["pattern"] else re.compile(bounded, RULE_FLAGS)
+        self.weight = rule["weight"] if kind == "risk" else rule["negative_weight"]
+
+    @property
+    def pattern(self) -> str:
+        return self.rule["pattern"]
+
+    def __repr__(self):
+        return f"CompiledRule({self.rule_id!r}, {self.pattern!r})"
+
+
+class RuleLayer:
+    """RULES_xxx / SAFE_GUARDS_xxx の1組をコンパイルしたもの。"""
+
+    def __init__(self, name: str, rules: dict, safe_guards: dict):
+        self.name = name
+        self.risk = {}
+        self.safe = {}
+        for ci, (cat, rs) in enumerate(rules.items()):
+            self.risk[cat] = tuple(
+                CompiledRule(f"{name}.risk.{ci}.{ri}", name, cat, "risk", r)
+                for ri, r in enumerate(rs)
+            )
+        for ci, (cat, gs) in enumerate(safe_guards.items()):
+            self.safe[cat] = tuple(
+                CompiledRule(f"{name}.safe.{ci}.{gi}", name, cat, "safe", g)
+                for gi, g in enumerate(gs)
+            )
+
+
+_LAYERS: dict[str, RuleLayer] = {}
+_VARIANTS: dict[tuple[str, str], "RuleSet"] = {}
+
+
+def register_layer(name: str, rules: dict, safe_guards: dict) -> RuleLayer:
+    """ルール定義を1レイヤとしてコンパイル・登録する(同名は上書き)。"""
+    layer = RuleLayer(name, rules, safe_guards)
+    _LAYERS[name] = layer
+    return layer
+
+
+def build_variant(version: str, persona: str, layer_names: list[str]) -> "RuleSet":
+    """登録済みレイヤを順に合成した RuleSet を作り、(version, persona) で登録する。"""
+    rs = RuleSet(version, persona, [_LAYERS[n] for n in layer_names])
+    _VARIANTS[(version, persona)] = rs
+    return rs
+
+
+def get_ruleset(version: str, persona: str = "standard") -> "RuleSet":
+    """
+    登録済みバリアントを返す。
+    未知の persona は従来の score_text_* と同じく standard 扱い。
+    """
+    rs = _VARIANTS.get((version, persona))
+    if rs is None:
+        rs = _VARIANTS[(version, "standard")]
+    return rs
+
+
+def list_variants() -> list[tuple[str, str]]:
+    return list(_VARIANTS.keys())
+
+
+def all_rules() -> dict[str, CompiledRule]:
+    """登録済みの全レイヤのルール: rule_id → CompiledRule(ルールの計測レポート用)"""
+    return {
+        r.rule_id: r
+        for layer in _LAYERS.values()
+        for group in (*layer.risk.values(), *layer.safe.values())
+        for r in group
+    }
+
+
+def prefilter_stats() -> dict[tuple[str, str], dict]:
+    """バリアントごとのプリフィルタ統計(評価したルール数・スキップしたルール数の累計。照合器を作ったものだけ)"""
+    return {key: rs.matcher.stats() for key, rs in _VARIANTS.items() if rs.compiled}
+
+
+def warm_rulesets(sample: str = "未経験歓迎。固定残業代を含む。") -> dict[tuple[str, str], float]:
+    """
+    登録済みの全バリアントの照合器を作り、sample を1回照合しておく(ルールの計測 ruleprof には数えない)。
+    戻り値: (version, persona) → かかった ms(作成済みのものは照合だけの時間)
+    """
+    out = {}
+    for key, rs in list(_VARIANTS.items()):
+        t0 = time.perf_counter()
+        rs.match(sample, profile=False)
+        out[key] = (time.perf_counter() - t0) * 1000
+    return out
+
+
+# ------------------------------------------------------------------ #
+#  エビデンス抽出
+# ------------------------------------------------------------------ #
+
+MARK_OPEN = "<mark style='color:#ff5d5d; font-weight:bold;'>"
+MARK_CLOSE = "</mark>"
+
+
+def _snippet(text: str, start: int, end: int, window: int) -> str:
+    """前後 window 文字のスニペット。ハイライトはマッチ位置そのものだけ(同じ語の別の出現は塗らない)"""
+    s = max(0, start-window); e = min(len(text), end+window)
+    return (text[s:start] + MARK_OPEN + text[start:end] + MARK_CLOSE + text[end:e]).replace("\n", " ")
+
+
+def evidence_from_spans(text: str, spans: list[tuple[int, int]], window: int = 40) -> list[str]:
+    """マッチ済みの (start, end) からスニペットを作る(正規表現は再実行しない)。"""
+    return [_snippet(text, s, e, window) for s, e in spans[:EVIDENCE_PER_RULE]]
+
+
+def span_preview(text: str, start: int, end: int) -> str:
+    """ヒット部分の先頭 SPAN_PREVIEW_CHARS 文字(超える分は … で省く)"""
+    if end - start <= SPAN_PREVIEW_CHARS:
+        return text[start:end]
+    return text[start:start + SPAN_PREVIEW_CHARS] + "…"
+
+
+def finish_spans(spans: list[dict]) -> list[dict]:
+    """
+    evidence_spans をテキスト内の出現順に並べ、先頭 MAX_EVIDENCE_SPANS 件に切り詰める。
+    RuleSet.score のルールのヒットにヒューリスティック(年収幅など)のヒットを足してから呼ぶ
+    """
+    spans.sort(key=lambda sp: (sp["start"], sp["end"]))
+    del spans[MAX_EVIDENCE_SPANS:]
+    return spans
+
+
+def collect_evidence(text: str, regex: re.Pattern, window: int = 40) -> list[str]:
+    spans = []
+    for m in regex.finditer(text):
+        spans.append(m.span())
+        if len(spans) >= EVIDENCE_PER_RULE:
+            break
+    return evidence_from_spans(text, spans, window)
+
+
+# ------------------------------------------------------------------ #
+#  RuleSet
+# ------------------------------------------------------------------ #
+
+class RuleSet:
+    """
+    レイヤを dict.update と同じ順序・上書き規則で合成した、不変のルール集合。
+
+    categories: ((カテゴリ名, risk ルール tuple, safe ルール tuple), ...)
+    fingerprint: パターン・重み・実行モードから計算したハッシュ。ルール変更で自動的に変わる。
+    mode: "exact" | "bounded"(REGEX_MODE 参照)
+    """
+
+    def __init__(self, version: str, persona: str, layers: list[RuleLayer], mode: str | None = None):
+        self.version = version
+        self.persona = persona
+        self.mode = mode or REGEX_MODE
+        self.budget = (RULE_BUDGET_MS, REQUEST_BUDGET_MS) if self.mode == "bounded" else None
+        self.layers = tuple(layers)
+        self.layer_names = tuple(layer.name for layer in layers)
+
+        risk_all = {}
+        safe_all = {}
+        for layer in layers:
+            risk_all.update(layer.risk)
+            safe_all.update(layer.safe)
+
+        self.categories = tuple(
+            (cat, rs, safe_all.get(cat, ())) for cat, rs in risk_all.items()
+        )
+        self.rules = tuple(
+            r for _, rs, gs in self.categories for r in (*rs, *gs)
+        )
+        self.by_id = {r.rule_id: r for r in self.rules}
+
+        # リスクルールはエビデンス用に複数ヒット、セーフガードは有無だけ
+        self.hit_limits = {
+            r.rule_id: (EVIDENCE_PER_RULE if r.kind == "risk" else 1) for r in self.rules
+        }
+        self._matcher: MultiMatcher | None = None
+        self._matcher_lock = threading.Lock()
+
+        h = hashlib.sha256(ENGINE_VERSION.encode())
+        if self.mode == "bounded":
+            h.update(f"\0bounded\0{REGEX_GAP}".encode())
+        for r in self.rules:
+            h.update(f"\0{r.rule_id}\0{r.pattern}\0{r.weight}".encode("utf-8"))
+        self.fingerprint = h.hexdigest()[:16]
+
+    @property
+    def compiled(self) -> bool:
+        return self._matcher is not None
+
+    @property
+    def matcher(self) -> MultiMatcher:
+        """照合器(初回に作る)"""
+        m = self._matcher
+        if m is None:
+            with self._matcher_lock:
+                if self._matcher is None:
+                    self._matcher = MultiMatcher(self.rules, bounded=(self.mode == "bounded"))
+                m = self._matcher
+        return m
+
+    def __repr__(self):
+        return f"RuleSet({self.version!r}, {self.persona!r}, rules={len(self.rules)}, mode={self.mode}, fp={self.fingerprint})"
+
+    def with_mode(self, mode: str) -> "RuleSet":
+        """同じレイヤ構成で実行モードだけ違う RuleSet(登録はしない)"""
+        return RuleSet(self.version, self.persona, list(self.layers), mode=mode)
+
+    def match(self, text: str, report: list | None = None, profile: bool = True) -> dict[str, list[tuple[int, int]]]:
+        """
+        全ルールのヒット位置: rule_id → [(start, end), ...](ヒットしたルールのみ)
+        report にリストを渡すと、bounded モードでの予算超過・打ち切りの明細が追記される。
+        YABASA_RULE_PROFILE_RATE の割合でルールごとの時間を測る(ruleprof.py)。profile=False なら測らない(ウォームアップ用)。
+        """
+        entries = PROFILER.sample() if profile else None
+        spans = self.matcher.match_all(text, self.hit_limits, self.budget, report, entries)
+        if entries is not None:
+            PROFILER.record(len(text), entries)
+        return spans
+
+    def score(self, text: str, max_per_category: int):
+        """
+        前処理済みテキストを採点する(マッチングは MultiMatcher で一括)。
+        戻り値: (cat_scores, cat_hits, cat_safe_hits, cat_evidence, measured_flags, evidence_spans, budget_skipped)
+        cat_hits / cat_safe_hits の要素は元のルール dict。
+        evidence_spans はリスクルールのヒット位置 [{start, end, category, rule_id, match}, ...]
+        (text に対するオフセット。match は text[start:end] の先頭 SPAN_PREVIEW_CHARS 文字のプレビュー)。
+        並べ替え・件数の上限はまだかけていない(ヒューリスティックのヒットを足してから finish_spans)。
+        budget_skipped は bounded モードでリクエスト予算が尽きて評価しなかったルールの rule_id
+        (空でなければスコアは一部のルールだけの結果。exact モードでは常に空)。
+        """
+        report = [] if self.budget is not None else None
+        spans = self.match(text, report)
+        budget_skipped = [e["rule_id"] for e in report or () if e["status"] == "skipped"]
+
+        cat_scores = {}
+        cat_hits = {}
+        cat_safe_hits = {}
+        cat_evidence = {}
+        measured_flags = {}
+        evidence_spans = []
+
+        for cat, rs, gs in self.categories:
+            score = 0
+            hits = []
+            evidence = []
+            measured = False
+
+            for r in rs:
+                found = spans.get(r.rule_id)
+                if found:
+                    score += r.weight
+                    hits.append(r.rule)
+                    evidence.extend(evidence_from_spans(text, found))
+                    evidence_spans.extend(
+                        {"start": st, "end": en, "category": cat, "rule_id": r.rule_id, "match": span_preview(text, st, en)}
+                        for st, en in found
+                    )
+                    measured = True
+
+            safe_hits = []
+            for g in gs:
+                if g.rule_id in spans:
+                    score -= g.weight
+                    safe_hits.append(g.rule)
+                    measured = True
+
+            score = max(0, min(score, max_per_category))
+            cat_scores[cat] = score
+            cat_hits[cat] = hits
+            cat_safe_hits[cat] = safe_hits
+            cat_evidence[cat] = evidence[:3]
+            measured_flags[cat] = measured
+
+        return cat_scores, cat_hits, cat_safe_hits, cat_evidence, measured_flags, evidence_spans, budget_skipped
@@ -0,0 +1,167 @@
+"""
+singleflight.py
+同じキーの処理が実行中なら、後から来たリクエストはそれを待って結果を共有する(single-flight)。
+
+  URL_FLIGHTS.do(key, fn)                    # スレッド版(同期エンドポイント・バッチ用)
+  await RESULT_FLIGHTS.do_async(key, coro_fn) # asyncio 版(非同期エンドポイント用)
+
+通常は cache.py の cached_fetch / cached_result(とその非同期版)経由で使う。
+
+  - 結果は保持しない。処理が終われば(成功・失敗とも)キーは外れ、次のリクエストは新しく実行する
+    (失敗を固定しない。結果の再利用は cache.py の TTL キャッシュの役目)
+  - 実行中に来た待ち手には同じ結果・同じ例外を返す
+  - キーごとのタイムアウト: 先頭の実行開始から timeout 秒を過ぎたら待ち手は TimeoutError になり、
+    キーも外す(止まった処理に後続がぶら下がり続けない)
+  - asyncio 版の処理は独立したタスクで動くため、先頭のリクエストが切断されても待ち手は影響を受けない
+
+スレッド版と asyncio 版のキーは別管理(同期経路と非同期経路の間では合流しない)。
+
+環境変数:
+  YABASA_COALESCE_TIMEOUT : キーごとのタイムアウト秒(既定: 30)
+"""
+
+import os
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+from mpmetrics import COALESCED, COALESCE_TIMEOUTS
+
+COALESCE_TIMEOUT = float(os.environ.get("YABASA_COALESCE_TIMEOUT", "30"))
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """合流用の URL 正規化(scheme / host の小文字化、既定ポート・フラグメントの除去)"""
+    try:
+        p = urlsplit((url or "").strip())
+        scheme = p.scheme.lower()
+        host = (p.hostname or "").lower()
+        if p.port and p.port != _DEFAULT_PORTS.get(scheme):
+            host = f"{host}:{p.port}"
+        return urlunsplit((scheme, host, p.path or "/", p.query, ""))
+    except ValueError:
+        return url
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "deadline")
+
+    def __init__(self, deadline: float):
+        self.done = threading.Event()
+        self.value = None
+        self.error: BaseException | None = None
+        self.deadline = deadline
+
+
+class SingleFlight:
+    """
+    キー単位の実行中処理の共有。coalesced(待って結果を共有した件数)/ timeouts を数える。
+    """
+
+    def __init__(self, name: str, timeout: float = COALESCE_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+        self._tasks: dict = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    # ---- スレッド版 ---- #
+
+    def do(self, key, fn, timeout: float | None = None):
+        timeout = self.timeout if timeout is None else timeout
+        now = time.monotonic()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.deadline <= now:
+                # 期限切れの実行には合流しない
+                self._calls.pop(key, None)
+                call = None
+            if call is None:
+                call = self._calls[key] = _Call(now + timeout)
+                leader = True
+                self.leaders += 1
+            else:
+                leader = False
+                self.coalesced += 1
+                COALESCED.inc(kind=self.name)
+
+        if leader:
+            try:
+                call.value = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(max(0.0, call.deadline - time.monotonic())):
+            with self._lock:
+                self.timeouts += 1
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            COALESCE_TIMEOUTS.inc(kind=self.name)
+            raise TimeoutError(f"{self.name}: 合流先の処理が {timeout:g} 秒以内に終わりませんでした")
+
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    # ---- asyncio 版 ---- #
+
+    async def do_async(self, key, coro_fn, timeout: float | None = None):
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        tkey = (id(loop), key)
+        entry = self._tasks.get(tkey)
+        if entry is not None and (entry[1] <= now or entry[0].done()):
+            entry = None
+        if entry is None:
+            task = asyncio.ensure_future(coro_fn())
+            entry = (task, now + timeout)
+            self._tasks[tkey] = entry
+            task.add_done_callback(lambda t, tkey=tkey, entry=entry: self._forget(tkey, entry))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            COALESCED.inc(kind=self.name)
+
+        task, deadline = entry
+        try:
+            # shield: 待ち手(先頭を含む)が取り消されても処理そのものは続ける
+            return await asyncio.wait_for(asyncio.shield(task), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            COALESCE_TIMEOUTS.inc(kind=self.name)
+            self._forget(tkey, entry)
+            raise TimeoutError(f"{self.name}: 合流先の処理が {timeout:g} 秒以内に終わりませんでした") from None
+
+    def _forget(self, tkey, entry):
+        if self._tasks.get(tkey) is entry:
+            del self._tasks[tkey]
+        task = entry[0]
+        if task.done() and not task.cancelled():
+            task.exception()  # 誰も待っていない失敗で "exception was never retrieved" を出さない
+
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "inflight": len(self._calls) + len(self._tasks),
+        }
+
+
+URL_FLIGHTS = SingleFlight("url")
+RESULT_FLIGHTS = SingleFlight("result")
+
+
+def all_stats() -> dict[str, dict]:
+    return {f.name: f.stats() for f in (URL_FLIGHTS, RESULT_FLIGHTS)}
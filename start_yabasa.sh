@@ -1,4 +1,7 @@
 #!/usr/bin/env bash
 set -euo pipefail
 export ENABLE_LOG=${ENABLE_LOG:-1}
-uvicorn api_app:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+# /metrics の値はワーカーごとのファイルを合計する（mpmetrics.py）。前回の起動分は消しておく
+export YABASA_METRICS_DIR=${YABASA_METRICS_DIR:-/tmp/yabasa-metrics}
+rm -rf "$YABASA_METRICS_DIR" && mkdir -p "$YABASA_METRICS_DIR"
+uvicorn api_app:app --host 0.0.0.0 --port 8000
@@ -27,7 +27,7 @@ function renderResult(d) {
   document.getElementById("result").classList.remove("hidden");
   document.getElementById("totalScore").textContent = d.total;
   document.getElementById("totalLabel").textContent = d.label;
-  document.getElementById("radar").src = "data:image/png;base64," + d.chart_png_base64;
+  document.getElementById("radar").src = d.chart_url || ("data:image/png;base64," + d.chart_png_base64);
 
   const scaleList = document.getElementById("scaleList");
   scaleList.innerHTML = "";
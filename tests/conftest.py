@@ -0,0 +1,34 @@
+"""
+テスト共通の設定。リポジトリ直下のモジュールと bench/job_corpus.py を import できるようにし、
+ログ・集計・プロファイルの出力先を一時ディレクトリに向ける(環境変数はモジュールの import 前に入れる)。
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+
+_TMP = tempfile.mkdtemp(prefix="yabasa-tests-")
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ["ENABLE_LOG"] = "0"
+os.environ["YABASA_LOG_DIR"] = os.path.join(_TMP, "logs")
+os.environ["YABASA_DATA_DIR"] = os.path.join(_TMP, "data")
+os.environ["YABASA_BATCH_WORKERS"] = "1"  # 採点はプロセス内で(spawn のワーカーを起こさない)
+os.environ["METRICS_TOKEN"] = "test-token"
+os.environ["ADMIN_PASS"] = "test-pass"
+
+import pytest
+
+
+@pytest.fixture
+def client():
+    """レート制限を外した TestClient"""
+    from fastapi.testclient import TestClient
+    import api_app
+    api_app.limiter.enabled = False
+    with TestClient(api_app.app) as c:
+        yield c
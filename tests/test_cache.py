@@ -0,0 +1,74 @@
+"""結果キャッシュの LRU / TTL と、キャッシュに入れない結果の判定(user-008)"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import cache
+from cache import TTLCache, cached_result
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """cache.time.monotonic を手で進める時計にする"""
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_lru_evicts_least_recently_used():
+    c = TTLCache("t", maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # a を新しくする
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1 and c.get("c") == 3
+    assert c.stats()["evictions"] == 1
+
+
+def test_ttl_expires_entries(clock):
+    c = TTLCache("t", maxsize=10, ttl=5)
+    c.set("a", 1)
+    clock[0] += 4.9
+    assert c.get("a") == 1
+    clock[0] += 0.2
+    assert c.get("a") is None
+    st = c.stats()
+    assert st["expirations"] == 1 and st["hits"] == 1 and st["misses"] == 1 and st["size"] == 0
+
+
+def test_zero_size_disables_cache():
+    c = TTLCache("t", maxsize=0, ttl=60)
+    c.set("a", 1)
+    assert c.get("a") is None and len(c) == 0
+
+
+def test_cached_result_respects_cacheable(monkeypatch):
+    c = TTLCache("t", maxsize=10, ttl=60)
+    monkeypatch.setattr(cache, "RESULT_CACHE", c)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"partial": True}
+
+    for _ in range(2):
+        assert cached_result(("k",), compute, lambda res: not res["partial"]) == {"partial": True}
+    assert len(calls) == 2 and len(c) == 0
+    cached_result(("k",), lambda: {"partial": False}, lambda res: not res["partial"])
+    assert cached_result(("k",), compute) == {"partial": False}
+    assert len(calls) == 2
+
+
+def test_analyze_cacheable():
+    from api_app import _cacheable
+    assert _cacheable({"total": 10, "partial": False})
+    assert not _cacheable({"chart_unavailable": True})
+    assert not _cacheable({"partial": True})
+
+
+def test_concerns_cacheable():
+    from ilora_endpoint import _complete
+    assert _complete((None,) * 7 + ([],))
+    assert not _complete((None,) * 7 + (["v48.rule"],))
@@ -0,0 +1,52 @@
+"""evidence_spans の並び順・件数の上限・プレビュー(user-004)"""
+
+import pytest
+
+from ruleset import MAX_EVIDENCE_SPANS, SPAN_PREVIEW_CHARS, finish_spans
+from rules import preprocess_text, score_text
+from rules_v48 import score_text_v48
+from rules_ilora import score_text_ilora
+from job_corpus import make_posting
+
+SALARY = "年収300万〜1000万 "
+SCORERS = [score_text, score_text_v48, score_text_ilora]
+
+
+def _span(start, rule_id="r"):
+    return {"start": start, "end": start + 2, "category": "c", "rule_id": rule_id, "match": "xx"}
+
+
+def test_finish_spans_sorts_then_caps():
+    # ヒューリスティックのヒットは末尾に足されるが、出現順では先頭に来る
+    spans = [_span(i * 10) for i in range(1, 20)] + [_span(0, "SALARY_RANGE_WIDE")]
+    out = finish_spans(spans)
+    assert len(out) == MAX_EVIDENCE_SPANS
+    assert out[0]["rule_id"] == "SALARY_RANGE_WIDE"
+    assert [sp["start"] for sp in out] == sorted(sp["start"] for sp in out)
+
+
+@pytest.mark.parametrize("scorer", SCORERS)
+def test_spans_capped_in_order_with_salary(scorer):
+    text = SALARY + make_posting(16000, "dense", "lifecycle")
+    spans = scorer(text, with_spans=True)[-2]
+    assert len(spans) == MAX_EVIDENCE_SPANS
+    assert [(sp["start"], sp["end"]) for sp in spans] == sorted((sp["start"], sp["end"]) for sp in spans)
+    assert any(sp["rule_id"] == "SALARY_RANGE_WIDE" for sp in spans)
+
+
+@pytest.mark.parametrize("scorer", SCORERS)
+def test_span_previews_are_short_and_match_text(scorer):
+    text = make_posting(80000, "dense", "lifecycle")
+    pre = preprocess_text(text)
+    for sp in scorer(text, with_spans=True)[-2]:
+        assert len(sp["match"]) <= SPAN_PREVIEW_CHARS + 1
+        assert pre[sp["start"]:sp["end"]].startswith(sp["match"].rstrip("…"))
+
+
+def test_api_returns_capped_spans(client):
+    text = SALARY + make_posting(16000, "dense", "lifecycle")
+    for path, body in (("/analyze", {"text": text, "chart": "none"}),
+                       ("/ilora/concerns", {"text": text, "persona": "lifecycle"})):
+        spans = client.post(path, json=body).json()["evidence_spans"]
+        assert len(spans) == MAX_EVIDENCE_SPANS
+        assert any(sp["rule_id"] == "SALARY_RANGE_WIDE" for sp in spans)
@@ -0,0 +1,86 @@
+"""ホストごとのサーキットブレーカー(open / half_open / closed)(user-013)"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import hostsched
+from hostsched import HostScheduler, HostUnavailable, CLOSED, OPEN, HALF_OPEN
+
+URL = "https://jobs.example.com/p/1"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """hostsched.time.monotonic を手で進める時計にする"""
+    now = [1000.0]
+    monkeypatch.setattr(hostsched, "time", SimpleNamespace(monotonic=lambda: now[0], sleep=time.sleep))
+    return now
+
+
+def _fetch(sched, status=200):
+    with sched.slot(URL) as h:
+        h.status = status
+
+
+def _state(sched):
+    return sched.stats()["jobs.example.com"]["state"]
+
+
+def test_opens_after_consecutive_failures(clock):
+    sched = HostScheduler(min_interval=0, failures=3, cooldown=60)
+    _fetch(sched, 503)
+    _fetch(sched, 200)  # 成功で連続失敗の数え直し
+    for _ in range(2):
+        _fetch(sched, 503)
+    assert _state(sched) == CLOSED
+    _fetch(sched, 429)
+    assert _state(sched) == OPEN and sched.is_open(URL)
+    with pytest.raises(HostUnavailable):
+        _fetch(sched)
+    assert sched.stats()["jobs.example.com"]["rejected"] == 1
+
+
+def test_client_errors_do_not_count(clock):
+    sched = HostScheduler(min_interval=0, failures=1, cooldown=60)
+    _fetch(sched, 404)
+    assert _state(sched) == CLOSED
+
+
+def test_half_open_lets_one_trial_through_and_closes_on_success(clock):
+    sched = HostScheduler(min_interval=0, failures=1, cooldown=60)
+    _fetch(sched, 500)
+    clock[0] += 60
+    assert not sched.is_open(URL)
+    with sched.slot(URL) as h:
+        assert _state(sched) == HALF_OPEN
+        with pytest.raises(HostUnavailable):
+            _fetch(sched)  # 試行中の1件が終わるまで他は通さない
+        h.status = 200
+    assert _state(sched) == CLOSED
+    _fetch(sched)
+
+
+def test_failed_trial_reopens(clock):
+    sched = HostScheduler(min_interval=0, failures=5, cooldown=60)
+    for _ in range(5):
+        _fetch(sched, 502)
+    clock[0] += 61
+    with pytest.raises(ConnectionError):
+        with sched.slot(URL):
+            raise ConnectionError("reset")
+    st = sched.stats()["jobs.example.com"]
+    assert st["state"] == OPEN and st["opens"] == 2
+    with pytest.raises(HostUnavailable):
+        _fetch(sched)
+
+
+def test_fetch_failure_detail_only_while_open(clock, monkeypatch):
+    sched = HostScheduler(min_interval=0, failures=1, cooldown=60)
+    monkeypatch.setattr(hostsched, "HOST_SCHEDULER", sched)
+    assert hostsched.fetch_failure_detail(URL) is None
+    _fetch(sched, 503)
+    assert hostsched.fetch_failure_detail(URL)
+    clock[0] += 60
+    assert hostsched.fetch_failure_detail(URL) is None
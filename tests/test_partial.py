@@ -0,0 +1,49 @@
+"""bounded モードでリクエスト予算が尽きたときの partial と、結果キャッシュに入れないこと(user-005)"""
+
+import pytest
+
+import ruleset
+from cache import RESULT_CACHE
+from rules_v48 import score_text_v48
+
+TEXT = "固定残業45時間 未経験大歓迎 アットホームな職場です。" * 50
+
+
+@pytest.fixture
+def no_budget(monkeypatch):
+    """全バリアントのリクエスト予算を 0 ms にする(最初のルール以外は評価されない)"""
+    ruleset.warm_rulesets()
+    for rs in ruleset._VARIANTS.values():
+        monkeypatch.setattr(rs, "budget", (50.0, 0.0))
+    RESULT_CACHE.clear()
+    yield
+    RESULT_CACHE.clear()
+
+
+def test_budget_skipped_is_reported(no_budget):
+    skipped = score_text_v48(TEXT, with_spans=True)[-1]
+    assert skipped
+    assert all(isinstance(rule_id, str) for rule_id in skipped)
+
+
+def test_exact_mode_is_never_partial():
+    assert score_text_v48(TEXT, with_spans=True)[-1] == []
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/analyze", {"text": TEXT, "chart": "none"}),
+    ("/ilora/concerns", {"text": TEXT, "persona": "lifecycle"}),
+])
+def test_partial_results_are_not_cached(client, no_budget, path, body):
+    r = client.post(path, json=body)
+    assert r.status_code == 200
+    assert r.json()["partial"] is True
+    assert len(RESULT_CACHE) == 0
+
+
+def test_complete_results_are_cached(client):
+    RESULT_CACHE.clear()
+    r = client.post("/analyze", json={"text": TEXT, "chart": "none"})
+    assert r.json()["partial"] is False
+    assert len(RESULT_CACHE) == 1
+    RESULT_CACHE.clear()
@@ -0,0 +1,66 @@
+"""1リクエスト分のプロファイル: トークン・同時実行数の上限・成果物の取得(user-024)"""
+
+import pytest
+
+from reqprof import REQUEST_PROFILER, PROFILE_HEADER
+from job_corpus import make_posting
+
+TEXT = "固定残業45時間 未経験大歓迎 アットホームな職場です。"
+AUTH = {"Authorization": "Bearer test-token"}
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    monkeypatch.setattr(REQUEST_PROFILER, "enabled", True)
+    monkeypatch.setattr(REQUEST_PROFILER, "directory", tmp_path)
+    return REQUEST_PROFILER
+
+
+@pytest.mark.parametrize("headers, status", [
+    ({PROFILE_HEADER: "pstats"}, 401),
+    ({PROFILE_HEADER: "pstats", "Authorization": "Token test-token"}, 401),
+    ({PROFILE_HEADER: "pstats", "Authorization": "Bearer wrong"}, 403),
+    ({PROFILE_HEADER: "svg", **AUTH}, 400),
+])
+def test_profile_request_is_checked(client, profiler, headers, status):
+    assert client.post("/analyze", json={"text": TEXT}, headers=headers).status_code == status
+
+
+def test_missing_metrics_token_is_401(client, profiler, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN")
+    r = client.post("/analyze", json={"text": TEXT}, headers={PROFILE_HEADER: "pstats", **AUTH})
+    assert r.status_code == 401
+
+
+def test_disabled_profiler_ignores_header(client, monkeypatch):
+    monkeypatch.setattr(REQUEST_PROFILER, "enabled", False)
+    r = client.post("/analyze", json={"text": TEXT}, headers={PROFILE_HEADER: "pstats"})
+    assert r.status_code == 200 and "X-Yabasa-Profile-Id" not in r.headers
+
+
+def test_busy_profiler_returns_429(client, profiler):
+    assert profiler._slots.acquire(blocking=False)
+    try:
+        r = client.post("/analyze", json={"text": TEXT}, headers={PROFILE_HEADER: "1", **AUTH})
+    finally:
+        profiler._slots.release()
+    assert r.status_code == 429 and r.headers["Retry-After"] == "1"
+
+
+@pytest.mark.parametrize("path, body, fmt", [
+    ("/analyze", {"text": make_posting(16000, "dense"), "chart": "none"}, "pstats"),
+    ("/ilora/concerns", {"text": make_posting(16000, "dense"), "persona": "lifecycle"}, "collapsed"),
+])
+def test_profiled_response_and_download(client, profiler, path, body, fmt):
+    r = client.post(f"{path}?profile={fmt}", json=body, headers=AUTH)
+    assert r.status_code == 200
+    url = r.headers["X-Yabasa-Profile-Url"]
+    assert url == f"/profiles/{r.headers['X-Yabasa-Profile-Id']}" and url.endswith(f".{fmt}")
+    assert client.get(url).status_code == 401
+    d = client.get(url, headers=AUTH)
+    assert d.status_code == 200 and d.content
+
+
+def test_unknown_profile_id_is_404(client, profiler):
+    assert client.get("/profiles/20250101T000000-analyze-deadbeef.pstats", headers=AUTH).status_code == 404
+    assert client.get("/profiles/..%2Fsecret", headers=AUTH).status_code == 404
@@ -0,0 +1,85 @@
+"""single-flight の合流と、失敗・タイムアウトの伝わり方(user-011)"""
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class Boom(Exception):
+    pass
+
+
+def test_waiters_get_leader_error_and_key_is_released():
+    sf = SingleFlight("t", timeout=5)
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise Boom("x")
+
+    def call():
+        try:
+            sf.do("k", fail)
+        except Boom as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=call) for _ in range(3)]
+    for t in waiters:
+        t.start()
+    while sf.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader] + waiters:
+        t.join(5)
+
+    assert len(errors) == 4 and all(e is errors[0] for e in errors)
+    assert sf.stats() == {"leaders": 1, "coalesced": 3, "timeouts": 0, "inflight": 0}
+    # 失敗は固定しない: 次の呼び出しは新しく実行する
+    assert sf.do("k", lambda: 42) == 42
+
+
+def test_waiter_times_out():
+    sf = SingleFlight("t", timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+    leader = threading.Thread(target=lambda: sf.do("k", lambda: (started.set(), release.wait(5))))
+    leader.start()
+    started.wait(5)
+    with pytest.raises(TimeoutError):
+        sf.do("k", lambda: "never")
+    release.set()
+    leader.join(5)
+    assert sf.timeouts == 1
+
+
+def test_async_waiters_get_leader_error():
+    sf = SingleFlight("t", timeout=5)
+
+    async def main():
+        gate = asyncio.Event()
+        runs = []
+
+        async def fail():
+            runs.append(1)
+            await gate.wait()
+            raise Boom("x")
+
+        tasks = [asyncio.ensure_future(sf.do_async("k", fail)) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        again = await sf.do_async("k", lambda: asyncio.sleep(0, result=7))
+        return runs, results, again
+
+    runs, results, again = asyncio.run(main())
+    assert runs == [1]
+    assert all(isinstance(r, Boom) for r in results)
+    assert again == 7 and sf.stats()["inflight"] == 0
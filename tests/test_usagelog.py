@@ -0,0 +1,55 @@
+"""利用ログの日別・ワーカー別ファイルへの書き込み(user-019)"""
+
+import os
+import csv
+
+from usagelog import UsageLogWriter, COLUMNS, LEGACY_FILE, log_files, read_rows
+
+
+def _row(ts, label="低（比較的安全）"):
+    return [ts, "127.0.0.1", "text", 10, label, "standard", "", "pytest"]
+
+
+def test_rows_roll_over_by_utc_day(tmp_path):
+    w = UsageLogWriter(log_dir=str(tmp_path), batch=100, interval=60)
+    seen = []
+    w.add_listener(seen.extend)
+    w.log(_row("2026-10-16T23:59:59+00:00"))
+    w.log(_row("2026-10-17T00:00:00+00:00"))
+    w.log(_row("2026-10-17T12:00:00+00:00"))
+    w.close()  # 間隔を待たずに残りを書き切る
+
+    pid = os.getpid()
+    assert sorted(os.listdir(tmp_path)) == [f"usage-2026-10-16.w{pid}.csv", f"usage-2026-10-17.w{pid}.csv"]
+    with open(tmp_path / f"usage-2026-10-17.w{pid}.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == COLUMNS and len(rows) == 3
+    assert len(seen) == 3
+    assert w.stats()["written"] == 3 and w.stats()["dropped"] == 0
+
+
+def test_appends_without_repeating_header(tmp_path):
+    for _ in range(2):
+        w = UsageLogWriter(log_dir=str(tmp_path), interval=60)
+        w.log(_row("2026-10-17T01:00:00+00:00"))
+        w.close()
+    rows = list(read_rows(str(tmp_path)))
+    assert len(rows) == 2 and rows[0]["ts_iso"].startswith("2026-10-17")
+
+
+def test_read_rows_includes_legacy_file_first(tmp_path):
+    with open(tmp_path / LEGACY_FILE, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([COLUMNS, _row("2025-01-01T00:00:00+00:00")])
+    w = UsageLogWriter(log_dir=str(tmp_path), interval=60)
+    w.log(_row("2026-10-17T01:00:00+00:00"))
+    w.close()
+    assert os.path.basename(log_files(str(tmp_path))[0]) == LEGACY_FILE
+    assert [r["ts_iso"][:4] for r in read_rows(str(tmp_path))] == ["2025", "2026"]
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    w = UsageLogWriter(log_dir=str(tmp_path), maxsize=1, interval=60)
+    w._ensure_thread = lambda: None  # 書き込みスレッドを動かさない
+    w.log(_row("2026-10-17T01:00:00+00:00"))
+    w.log(_row("2026-10-17T01:00:01+00:00"))
+    assert w.stats()["dropped"] == 1
@@ -0,0 +1,68 @@
+"""利用ログの集計(SQLite)の初回バックフィルと加算(user-020)"""
+
+import csv
+
+import pytest
+
+import usagerollup
+from usagelog import COLUMNS, read_rows
+from usagerollup import UsageRollup
+
+ROWS = [
+    ["2026-10-16T09:00:00+00:00", "ip", "text", 10, "低（比較的安全）", "standard", "", "ua"],
+    ["2026-10-16T10:00:00+00:00", "ip", "url", 60, "高（要警戒）", "standard", "IT", "ua"],
+    ["2026-10-17T09:00:00+00:00", "ip", "text", 40, "中（注意が必要）", "lifecycle", "", "ua"],
+]
+
+
+@pytest.fixture
+def logs(tmp_path, monkeypatch):
+    """tmp_path/logs に日別の CSV を置き、集計はそこから読む"""
+    d = tmp_path / "logs"
+    d.mkdir()
+    with open(d / "usage-2026-10-16.w1.csv", "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([COLUMNS] + ROWS[:2])
+    with open(d / "usage-2026-10-17.w1.csv", "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([COLUMNS] + ROWS[2:])
+    monkeypatch.setattr(usagerollup, "read_rows", lambda: read_rows(str(d)))
+    return d
+
+
+def test_backfills_once_from_existing_csv(tmp_path, logs):
+    r = UsageRollup(tmp_path / "rollup.sqlite3")
+    assert r.open() is True
+    assert r.totals() == {"low": 1, "high": 1, "mid": 1}
+    # 別のプロセス(= 新しいインスタンス)が開いても作り直さない
+    r2 = UsageRollup(tmp_path / "rollup.sqlite3")
+    assert r2.open() is False
+    assert r2.daily("2026-10-01", "2026-10-31") == [("2026-10-16", 2), ("2026-10-17", 1)]
+
+
+def test_add_rows_after_backfill(tmp_path, logs):
+    r = UsageRollup(tmp_path / "rollup.sqlite3")
+    r.open()
+    r.add_rows([["2026-10-17T11:00:00+00:00", "ip", "text", 5, "低（比較的安全）", "standard", "", "ua"]])
+    assert r.totals()["low"] == 2
+    assert r.breakdown("mode", "2026-10-17", "2026-10-17") == {"lifecycle": 1, "standard": 1}
+    assert r.last_days(1) == ["2026-10-17"]
+
+
+def test_first_add_rows_does_not_double_count(tmp_path, logs):
+    # listener が最初に呼ばれた時点で CSV には既にその行がある → バックフィルに含まれる
+    r = UsageRollup(tmp_path / "rollup.sqlite3")
+    r.add_rows(ROWS[2:])
+    assert r.totals() == {"low": 1, "high": 1, "mid": 1}
+
+
+def test_rebuild_replaces_counts(tmp_path, logs):
+    r = UsageRollup(tmp_path / "rollup.sqlite3")
+    r.open()
+    r.add_rows(ROWS)
+    assert sum(r.totals().values()) == 6
+    assert r.rebuild() == 3
+    assert sum(r.totals().values()) == 3
+
+
+def test_breakdown_rejects_unknown_dimension(tmp_path, logs):
+    with pytest.raises(ValueError):
+        UsageRollup(tmp_path / "rollup.sqlite3").breakdown("ip", "2026-10-01", "2026-10-31")
@@ -0,0 +1,182 @@
+"""
+usagelog.py
+利用ログ(/analyze の1件ごとの行)の書き込み。リクエストの処理中はメモリ上のキューに積むだけで、
+ファイルへの書き込みは専用スレッドがまとめて行う。
+
+  USAGE_LOG.log([ts_iso, ip, source, total, label, mode, sector, ua])   # 待たない
+  for row in read_rows(): ...                                           # dict(COLUMNS → 値)
+
+  - キューは LOG_QUEUE 件まで。あふれた行は捨てて dropped に数える(リクエストを待たせない)
+  - LOG_BATCH 件たまるか LOG_FLUSH_SEC 秒たったらまとめて書く
+  - ファイルは日付(UTC)ごと・ワーカー(プロセス)ごとに分ける:
+      logs/usage-2026-10-17.w12345.csv
+    ワーカーごとに別ファイルなので uvicorn --workers N でも行が混ざらない
+  - 終了時(close() / atexit)にキューに残った分を書き切る
+  - 旧形式の logs/usage.csv があれば read_rows() はそれも読む
+
+flush のたびに add_listener() で登録した関数に書いた行を渡す(集計の更新用)。
+
+環境変数:
+  ENABLE_LOG            : 1 のときだけ記録する(既定: 1)
+  YABASA_LOG_DIR        : 出力先ディレクトリ(既定: logs)
+  YABASA_LOG_QUEUE      : キューの上限件数(既定: 10000)
+  YABASA_LOG_BATCH      : 1回に書く件数の目安(既定: 256)
+  YABASA_LOG_FLUSH_SEC  : 書き込み間隔の上限秒(既定: 1)
+"""
+
+import os
+import csv
+import glob
+import time
+import queue
+import atexit
+import threading
+
+COLUMNS = ["ts_iso", "ip", "source", "total", "label", "mode", "sector", "ua"]
+
+LOG_DIR = os.environ.get("YABASA_LOG_DIR", "logs")
+LOG_QUEUE = int(os.environ.get("YABASA_LOG_QUEUE", "10000"))
+LOG_BATCH = int(os.environ.get("YABASA_LOG_BATCH", "256"))
+LOG_FLUSH_SEC = float(os.environ.get("YABASA_LOG_FLUSH_SEC", "1"))
+
+LEGACY_FILE = "usage.csv"
+_STOP = object()
+
+
+def log_enabled() -> bool:
+    return os.environ.get("ENABLE_LOG", "1") == "1"
+
+
+class UsageLogWriter:
+    def __init__(self, log_dir: str = LOG_DIR, maxsize: int = LOG_QUEUE,
+                 batch: int = LOG_BATCH, interval: float = LOG_FLUSH_SEC):
+        self.log_dir = log_dir
+        self.batch = max(1, batch)
+        self.interval = interval
+        self._q: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._pid = None
+        self._listeners: list = []
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.errors = 0
+
+    # ---- 受け付け ---- #
+
+    def log(self, row: list):
+        """1行を積む(ブロックしない)"""
+        self._ensure_thread()
+        try:
+            self._q.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def add_listener(self, fn):
+        """fn(rows) を flush のたびに書いた行(list のリスト)で呼ぶ(書き込みスレッドから)"""
+        self._listeners.append(fn)
+
+    def _ensure_thread(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return
+        with self._lock:
+            if self._thread is None or self._pid != pid:
+                # fork 後の子プロセスでは親のスレッドは動いていないので作り直す
+                self._pid = pid
+                self._thread = threading.Thread(target=self._run, name="usage-log", daemon=True)
+                self._thread.start()
+
+    # ---- 書き込みスレッド ---- #
+
+    def _run(self):
+        buf = []
+        deadline = None  # 最初に積まれた行から LOG_FLUSH_SEC 秒以内に書く
+        while True:
+            timeout = self.interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._q.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            stop = item is _STOP
+            if item is not None and not stop:
+                if not buf:
+                    deadline = time.monotonic() + self.interval
+                buf.append(item)
+            if buf and (stop or len(buf) >= self.batch or time.monotonic() >= deadline):
+                self._flush(buf)
+                buf = []
+                deadline = None
+            if stop:
+                return
+
+    def path_for(self, day: str) -> str:
+        return os.path.join(self.log_dir, f"usage-{day}.w{os.getpid()}.csv")
+
+    def _flush(self, rows: list):
+        by_day: dict[str, list] = {}
+        for row in rows:
+            by_day.setdefault(str(row[0])[:10], []).append(row)
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            for day, part in by_day.items():
+                path = self.path_for(day)
+                is_new = not os.path.exists(path)
+                with open(path, "a", newline="", encoding="utf-8") as f:
+                    w = csv.writer(f)
+                    if is_new:
+                        w.writerow(COLUMNS)
+                    w.writerows(part)
+            self.written += len(rows)
+            self.flushes += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"[LOG] 利用ログを書けませんでした({len(rows)} 行): {e}")
+            return
+        for fn in self._listeners:
+            try:
+                fn(rows)
+            except Exception as e:
+                print(f"[LOG] 集計の更新に失敗しました: {e}")
+
+    # ---- 終了 ---- #
+
+    def close(self, timeout: float = 5.0):
+        """キューに残った分を書き切ってスレッドを止める"""
+        t = self._thread
+        if t is None or self._pid != os.getpid() or not t.is_alive():
+            return
+        try:
+            self._q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        t.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._q.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
+
+
+USAGE_LOG = UsageLogWriter()
+atexit.register(USAGE_LOG.close)
+
+
+def log_files(log_dir: str = LOG_DIR) -> list[str]:
+    """利用ログのファイル(旧形式の usage.csv → 日付順の日別ファイル)"""
+    files = sorted(glob.glob(os.path.join(log_dir, "usage-*.csv")))
+    legacy = os.path.join(log_dir, LEGACY_FILE)
+    return ([legacy] if os.path.exists(legacy) else []) + files
+
+
+def read_rows(log_dir: str = LOG_DIR):
+    """全ファイルの行を dict で返す(書き込み中の分は含まない)"""
+    for path in log_files(log_dir):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
@@ -0,0 +1,187 @@
+"""
+usagerollup.py
+利用ログの集計(SQLite)。/admin/data はログ全体を読み直さず、ここから答える。
+
+  usage_daily : (日付, mode, sector, ラベル, source) ごとの件数
+  usage_total : ラベルごとの累計件数
+
+  - usagelog.USAGE_LOG が書き込むたびに、その行の分だけ件数を足す(1回の書き込み = 1トランザクション)
+  - 初めて開いたときは既存の CSV(logs/usage.csv と日別ファイル)から一度だけ作る。
+    集計を作り直すときは python usagerollup.py --rebuild
+  - 複数ワーカーから同じファイルに書く(WAL + busy_timeout。件数の加算は UPSERT なので競合しても失われない)
+  - 問い合わせは日付の範囲で引くので、かかる時間は表示する日数(× mode・sector 等の組み合わせ数)に比例する
+
+  ROLLUP.daily(start, end)                  -> [(日付, 件数), ...]
+  ROLLUP.breakdown("mode", start, end)      -> {"standard": 件数, ...}
+
+環境変数:
+  YABASA_DATA_DIR     : データ保存先(既定: data)
+  YABASA_ROLLUP_DB    : 集計の SQLite ファイル(既定: {YABASA_DATA_DIR}/usage_rollup.sqlite3)
+"""
+
+import os
+import sys
+import sqlite3
+import threading
+from pathlib import Path
+
+from usagelog import read_rows, COLUMNS
+
+DATA_DIR = Path(os.environ.get("YABASA_DATA_DIR", "data"))
+ROLLUP_DB = Path(os.environ.get("YABASA_ROLLUP_DB", str(DATA_DIR / "usage_rollup.sqlite3")))
+
+DIMENSIONS = ("mode", "sector", "label", "source")
+LABEL_KEYS = {"低": "low", "中": "mid", "高": "high"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_daily (
+  day TEXT NOT NULL, mode TEXT NOT NULL, sector TEXT NOT NULL, label TEXT NOT NULL, source TEXT NOT NULL,
+  n INTEGER NOT NULL,
+  PRIMARY KEY (day, mode, sector, label, source)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usage_total (label TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+
+def label_key(label: str) -> str:
+    """"中（注意が必要）" → "mid"(低/中/高 以外は "other")"""
+    return LABEL_KEYS.get((label or "")[:1], "other")
+
+
+def _group(rows) -> dict[tuple, int]:
+    """行(COLUMNS 順の list、または dict)を (day, mode, sector, label, source) ごとに数える"""
+    counts: dict[tuple, int] = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            row = dict(zip(COLUMNS, row))
+        day = str(row.get("ts_iso") or "")[:10]
+        if not day:
+            continue
+        key = (day, row.get("mode") or "", row.get("sector") or "", label_key(row.get("label")), row.get("source") or "")
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+class UsageRollup:
+    def __init__(self, path: Path = ROLLUP_DB):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def open(self) -> bool:
+        """テーブルを用意し、未作成なら既存の CSV から集計を作る(起動時に1回)。作ったら True"""
+        with self._lock:
+            if self._ready:
+                return False
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.executescript(_SCHEMA)
+                conn.execute("BEGIN IMMEDIATE")
+                backfill = conn.execute("SELECT value FROM meta WHERE key='backfilled'").fetchone() is None
+                if backfill:
+                    n = self._add(conn, _group(read_rows()))
+                    conn.execute("INSERT INTO meta VALUES ('backfilled', '1')")
+                    if n:
+                        print(f"[LOG] 既存の利用ログ {n} 行から集計を作りました")
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            self._ready = True
+            return backfill
+
+    def rebuild(self) -> int:
+        """集計を捨てて CSV から作り直す。戻り値は行数"""
+        self.open()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM usage_daily")
+            conn.execute("DELETE FROM usage_total")
+            n = self._add(conn, _group(read_rows()))
+            conn.execute("COMMIT")
+            return n
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _add(conn: sqlite3.Connection, counts: dict[tuple, int]) -> int:
+        conn.executemany(
+            "INSERT INTO usage_daily VALUES (?,?,?,?,?,?) "
+            "ON CONFLICT(day, mode, sector, label, source) DO UPDATE SET n = n + excluded.n",
+            [(*k, n) for k, n in counts.items()],
+        )
+        totals: dict[str, int] = {}
+        for k, n in counts.items():
+            totals[k[3]] = totals.get(k[3], 0) + n
+        conn.executemany(
+            "INSERT INTO usage_total VALUES (?,?) ON CONFLICT(label) DO UPDATE SET n = n + excluded.n",
+            list(totals.items()),
+        )
+        return sum(totals.values())
+
+    def add_rows(self, rows: list):
+        """書き込んだ行の分だけ件数を足す(usagelog の listener)"""
+        counts = _group(rows)
+        if not counts:
+            return
+        if self.open():
+            return  # CSV に書いた後に呼ばれるので、この行は今作った集計に含まれている
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._add(conn, counts)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    # ---- 問い合わせ ---- #
+
+    def _query(self, sql: str, args=()) -> list:
+        self.open()
+        conn = self._connect()
+        try:
+            return conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+
+    def totals(self) -> dict[str, int]:
+        """ラベル(low / mid / high / other)ごとの累計"""
+        return dict(self._query("SELECT label, n FROM usage_total"))
+
+    def last_days(self, limit: int) -> list[str]:
+        """件数のある日付の新しい方から limit 日(昇順で返す)"""
+        rows = self._query("SELECT DISTINCT day FROM usage_daily ORDER BY day DESC LIMIT ?", (limit,))
+        return sorted(r[0] for r in rows)
+
+    def daily(self, start: str, end: str) -> list[tuple[str, int]]:
+        return self._query(
+            "SELECT day, SUM(n) FROM usage_daily WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day",
+            (start, end),
+        )
+
+    def breakdown(self, dim: str, start: str, end: str) -> dict[str, int]:
+        if dim not in DIMENSIONS:
+            raise ValueError(f"breakdown は {' / '.join(DIMENSIONS)} のいずれかを指定してください: {dim!r}")
+        rows = self._query(
+            f"SELECT {dim}, SUM(n) FROM usage_daily WHERE day BETWEEN ? AND ? GROUP BY {dim} ORDER BY 2 DESC",
+            (start, end),
+        )
+        return {k: n for k, n in rows}
+
+
+ROLLUP = UsageRollup()
+
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        print(f"{ROLLUP.rebuild()} 行から集計を作り直しました: {ROLLUP.path}")
+    else:
+        print(__doc__)